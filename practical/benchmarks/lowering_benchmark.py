@@ -0,0 +1,85 @@
+#!/usr/bin/env python3.10
+
+"""
+Measures the throughput of the tiny-py-to-standard lowering, in tiny_py operations lowered
+per second, over large synthetic functions in both the region and SSA forms of the dialect.
+Each function is a long sequence of assignments whose expressions mix integer and floating
+point variables, array reads and constants, so that most kinds of operation are lowered.
+
+Run from the practical directory after sourcing environment.sh (or with src and src/dialects
+on the PYTHONPATH), e.g. python benchmarks/lowering_benchmark.py --statements 4000. Passing
+--min-ops-per-second makes this exit with an error if either form is slower than that,
+which can be used to catch regressions.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path[:0]=[os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"),
+              os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "dialects")]
+
+from xdsl.ir import MLContext
+from python_compiler import generate_ir
+from tiny_py_to_standard import LowerTinyPyToStandard
+
+def generate_source(statements: int, variables: int) -> str:
+    """
+    The source of a function of the given number of statements, which is all straight line
+    code as in an unrolled loop body
+    """
+    lines=["def kernel(a: Array[float], b: Array[float], n: int):"]
+    for i in range(variables):
+        lines.append(f"    x{i}=n+{i}" if i % 2 == 0 else f"    y{i}={i}.5")
+    for i in range(statements):
+        x=f"x{2*(i % (variables//2))}"
+        y=f"y{2*(i % (variables//2))+1}"
+        if i % 3 == 0:
+            lines.append(f"    a[{x}]=a[{x}]*{y}+b[n-{i % 7}]*({x}+{i % 11})-{y}/2.0")
+        elif i % 3 == 1:
+            lines.append(f"    {y}={y}*b[{x}]+({x}-{i % 5})*{y}")
+        else:
+            lines.append(f"    {x}={x}*{i % 13}+n-{x}/3")
+    return "\n".join(lines)
+
+def count_operations(module) -> int:
+    ops=[]
+    module.walk(ops.append)
+    return len(ops)
+
+def time_lowering(source: str, ssa_form: bool, repeats: int):
+    best=None
+    for _ in range(repeats):
+        module=generate_ir(source, ssa_form)
+        input_ops=count_operations(module)
+        start=time.perf_counter()
+        LowerTinyPyToStandard().apply(MLContext(), module)
+        elapsed=time.perf_counter()-start
+        best=elapsed if best is None else min(best, elapsed)
+    return best, input_ops, count_operations(module)
+
+def main():
+    arg_parser=argparse.ArgumentParser(description="Benchmark the tiny-py-to-standard lowering")
+    arg_parser.add_argument("--statements", type=int, default=2000, help="Statements in the function")
+    arg_parser.add_argument("--variables", type=int, default=100, help="Distinct scalar variables")
+    arg_parser.add_argument("--repeats", type=int, default=3, help="Best of this many runs is reported")
+    arg_parser.add_argument("--min-ops-per-second", type=float, default=None,
+                            help="Fail if either form lowers fewer tiny_py operations per second than this")
+    args=arg_parser.parse_args()
+
+    source=generate_source(args.statements, args.variables)
+    slowest=None
+    for ssa_form in [False, True]:
+        elapsed, input_ops, output_ops=time_lowering(source, ssa_form, args.repeats)
+        rate=input_ops/elapsed
+        slowest=rate if slowest is None else min(slowest, rate)
+        print(f"{'ssa' if ssa_form else 'regions'}: {input_ops} tiny_py operations lowered to {output_ops} "
+              f"in {elapsed*1000:.0f}ms, {rate:,.0f} operations per second")
+
+    if args.min_ops_per_second is not None and slowest < args.min_ops_per_second:
+        print(f"Lowering is slower than {args.min_ops_per_second:,.0f} operations per second", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
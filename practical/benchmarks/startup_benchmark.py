@@ -0,0 +1,121 @@
+#!/usr/bin/env python3.10
+
+"""
+Measures how long tinypy-opt and python_compiler take to start up, which matters as the tool
+is run once per kernel in a build. Each case is run in a fresh interpreter with
+python -X importtime, and the wall time of the run is reported along with the time spent
+importing modules and which of our passes and dialects were imported. The cases are
+importing python_compiler (which is what a script using the decorator pays before it runs),
+tinypy-opt just parsing and printing a kernel, and tinypy-opt lowering it.
+
+Run from the practical directory after sourcing environment.sh (or with src and src/dialects
+on the PYTHONPATH), e.g. python benchmarks/startup_benchmark.py --max-import-ms 800. Passing
+--max-import-ms or --max-wall-ms makes this exit with an error if any case takes longer than
+that. It is also an error for a case to import a pass that it does not run, as passes are
+meant to be imported only once requested. The test suite checks these against fixed budgets
+in tests/test_startup.py, this script is for finding out where the time goes.
+"""
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+src_dir=os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path[:0]=[src_dir, os.path.join(src_dir, "dialects")]
+
+from util.lazy_registry import tinypy_passes, tinypy_dialects
+
+importtime_pattern=re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|( *)(\S+)\s*$")
+
+def generate_kernel(path: str):
+    from python_compiler import generate_ir, print_ir
+    source="\n".join(["def kernel(a: Array[float], b: Array[float], n: int):",
+                      "    for i in range(0, n):",
+                      "        a[i]=a[i]*2.0+b[i]",
+                      "    print(a[0])"])
+    with open(path, "w") as f:
+        f.write(print_ir(generate_ir(source)))
+
+def run_case(command, repeats: int):
+    """
+    Runs the command with python -X importtime, returning the best wall time and import time
+    (in milliseconds) and the modules that were imported, by their cumulative import time
+    """
+    environment=dict(os.environ)
+    environment["PYTHONPATH"]=os.pathsep.join([src_dir, os.path.join(src_dir, "dialects")]
+                                              + ([environment["PYTHONPATH"]] if "PYTHONPATH" in environment else []))
+    best_wall, best_import, modules=None, None, {}
+    for _ in range(repeats):
+        start=time.perf_counter()
+        result=subprocess.run([sys.executable, "-X", "importtime"]+command, capture_output=True, text=True,
+                              env=environment)
+        wall=(time.perf_counter()-start)*1000
+        if result.returncode != 0:
+            raise Exception(f"`{' '.join(command)}' failed:\n{result.stderr}")
+        import_us, run_modules=0, {}
+        for line in result.stderr.splitlines():
+            match=importtime_pattern.match(line)
+            if match is None:
+                continue
+            run_modules[match.group(4)]=int(match.group(2))/1000
+            # Only the modules imported at the top level, as the others are within their time
+            if len(match.group(3)) <= 1:
+                import_us+=int(match.group(2))
+        best_wall=wall if best_wall is None else min(best_wall, wall)
+        if best_import is None or import_us/1000 < best_import:
+            best_import, modules=import_us/1000, run_modules
+    return best_wall, best_import, modules
+
+def main():
+    arg_parser=argparse.ArgumentParser(description="Benchmark the start up of tinypy-opt and python_compiler")
+    arg_parser.add_argument("--input", type=str, default=None,
+                            help="tiny_py IR that tinypy-opt is run on, by default a small generated kernel")
+    arg_parser.add_argument("--repeats", type=int, default=5, help="Best of this many runs is reported")
+    arg_parser.add_argument("--top", type=int, default=8, help="Number of the slowest imports listed per case")
+    arg_parser.add_argument("--max-import-ms", type=float, default=None,
+                            help="Fail if any case spends longer than this importing modules")
+    arg_parser.add_argument("--max-wall-ms", type=float, default=None,
+                            help="Fail if any case takes longer than this to run")
+    args=arg_parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        input_file=args.input
+        if input_file is None:
+            input_file=os.path.join(work_dir, "kernel.mlir")
+            generate_kernel(input_file)
+        tinypy_opt=os.path.join(src_dir, "tools", "tinypy-opt")
+        cases=[("import python_compiler", ["-c", "import python_compiler"], []),
+               ("tinypy-opt parse and print", [tinypy_opt, input_file], []),
+               ("tinypy-opt -p tiny-py-to-standard", [tinypy_opt, input_file, "-p", "tiny-py-to-standard"],
+                ["tiny-py-to-standard"])]
+
+        failures=[]
+        for name, command, requested_passes in cases:
+            wall, import_ms, modules=run_case(command, args.repeats)
+            our_passes=[pass_name for pass_name, (module_name, _) in tinypy_passes.items() if module_name in modules]
+            our_dialects=[module_name for _, module_name, _ in tinypy_dialects if module_name in modules]
+            print(f"{name}: {wall:.0f}ms wall, {import_ms:.0f}ms importing {len(modules)} modules")
+            print(f"  passes imported: {', '.join(our_passes) or 'none'}, "
+                  f"dialects imported: {', '.join(our_dialects) or 'none'}")
+            top_level=sorted(modules.items(), key=lambda module: -module[1])[:args.top]
+            for module_name, cumulative_ms in top_level:
+                print(f"  {cumulative_ms:>8.1f}ms  {module_name}")
+
+            unexpected=[pass_name for pass_name in our_passes if pass_name not in requested_passes]
+            if len(unexpected) > 0:
+                failures.append(f"{name} imports passes that it does not run: {', '.join(unexpected)}")
+            if args.max_import_ms is not None and import_ms > args.max_import_ms:
+                failures.append(f"{name} spends {import_ms:.0f}ms importing, over the budget of {args.max_import_ms:.0f}ms")
+            if args.max_wall_ms is not None and wall > args.max_wall_ms:
+                failures.append(f"{name} takes {wall:.0f}ms, over the budget of {args.max_wall_ms:.0f}ms")
+
+    if len(failures) > 0:
+        print("\n".join(failures), file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3.10
+
+"""
+Times the visitor in util.visitor over large synthetic tiny_py functions, against the
+previous approach of recursing through the IR and looking up the traverse and visit methods
+by name for every operation (with the assigned variables held in a list). The visitors are
+the ones used by the lowering to find the variables assigned and read in each loop body.
+It also checks that an expression nested deeper than Python's recursion limit can be walked.
+
+Run from the practical directory after sourcing environment.sh (or with src and src/dialects
+on the PYTHONPATH), e.g. python benchmarks/visitor_benchmark.py --statements 20000
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path[:0]=[os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"),
+              os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "dialects")]
+
+import tiny_py
+from tiny_py_to_standard import GetAssignedVariables, GetUsedVariables
+from util.visitor import camel_to_snake, get_method
+
+class RecursiveVisitor:
+    """
+    The visitor before the dispatch table, kept here as the baseline
+    """
+    def traverse(self, operation):
+        class_name = camel_to_snake(type(operation).__name__)
+        traverse = get_method(self, f"traverse_{class_name}")
+        if traverse:
+            traverse(operation)
+        else:
+            for r in operation.regions:
+                for b in r.blocks:
+                    for op in b.ops:
+                        self.traverse(op)
+        visit = get_method(self, f"visit_{class_name}")
+        if visit:
+            visit(operation)
+
+class RecursiveGetAssignedVariables(RecursiveVisitor):
+    def __init__(self):
+        self.assigned_vars=[]
+
+    def traverse_assign(self, assign):
+        var_name=assign.var_name.data
+        if var_name not in self.assigned_vars:
+            self.assigned_vars.append(var_name)
+
+class RecursiveGetUsedVariables(RecursiveVisitor):
+    def __init__(self):
+        self.used_vars=set()
+
+    def traverse_var(self, var):
+        self.used_vars.add(var.variable.data)
+
+def build_expression(terms: int, variables: int):
+    """
+    A left nested chain of binary operations over the variables, array reads and constants
+    """
+    expr=tiny_py.Var.get("v0")
+    for i in range(1, terms):
+        if i % 3 == 0:
+            rhs=tiny_py.ArrayAccess.get("a", [tiny_py.Var.get(f"v{i % variables}")])
+        elif i % 3 == 1:
+            rhs=tiny_py.Constant.get(i)
+        else:
+            rhs=tiny_py.Var.get(f"v{i % variables}")
+        expr=tiny_py.BinaryOperation.get("add" if i % 2 else "mult", expr, rhs)
+    return expr
+
+def build_function(statements: int, terms: int, variables: int):
+    """
+    A function body of assignments to the variables, as found in a large unrolled loop body
+    """
+    body=[]
+    for i in range(statements):
+        if i % 4 == 3:
+            body.append(tiny_py.ArrayAssign.get("a", [tiny_py.Var.get(f"v{i % variables}")],
+                                                build_expression(terms, variables)))
+        else:
+            body.append(tiny_py.Assign.get(f"v{i % variables}", build_expression(terms, variables)))
+    return tiny_py.Function.get("kernel", None, [], body)
+
+def time_visitor(visitor_class, function, attribute, repeats):
+    best=None
+    for _ in range(repeats):
+        start=time.perf_counter()
+        visitor=visitor_class()
+        for op in function.body.blocks[0].ops:
+            visitor.traverse(op)
+        elapsed=time.perf_counter()-start
+        best=elapsed if best is None else min(best, elapsed)
+    return best, getattr(visitor, attribute)
+
+def main():
+    arg_parser=argparse.ArgumentParser(description="Benchmark the IR visitor")
+    arg_parser.add_argument("--statements", type=int, default=5000, help="Statements in the function")
+    arg_parser.add_argument("--terms", type=int, default=8, help="Terms in each expression")
+    arg_parser.add_argument("--variables", type=int, default=500, help="Distinct variables assigned")
+    arg_parser.add_argument("--depth", type=int, default=5000, help="Terms in the deep expression")
+    arg_parser.add_argument("--repeats", type=int, default=3, help="Best of this many runs is reported")
+    args=arg_parser.parse_args()
+
+    function=build_function(args.statements, args.terms, args.variables)
+    ops=[]
+    function.walk(ops.append)
+    print(f"{args.statements} statements, {len(ops)-1} operations, {args.variables} variables")
+    for name, old_class, new_class, attribute in [
+            ("assigned variables", RecursiveGetAssignedVariables, GetAssignedVariables, "assigned_vars"),
+            ("used variables", RecursiveGetUsedVariables, GetUsedVariables, "used_vars")]:
+        old_time, old_result=time_visitor(old_class, function, attribute, args.repeats)
+        new_time, new_result=time_visitor(new_class, function, attribute, args.repeats)
+        # The assigned variables are in the order they are first assigned, the read ones are a set
+        if list(old_result) != list(new_result) if isinstance(old_result, list) else old_result != new_result:
+            raise Exception(f"The visitors found different {name}")
+        print(f"  {name}: recursive {old_time*1000:.1f}ms, dispatch table {new_time*1000:.1f}ms "
+              f"({old_time/new_time:.1f}x)")
+
+    deep=tiny_py.Assign.get("v0", build_expression(args.depth, args.variables))
+    for name, visitor in [("recursive", RecursiveGetUsedVariables()), ("dispatch table", GetUsedVariables())]:
+        try:
+            visitor.traverse(deep)
+            print(f"  {args.depth} term expression, {name}: {len(visitor.used_vars)} variables read")
+        except RecursionError:
+            print(f"  {args.depth} term expression, {name}: exceeds the recursion limit")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+from __future__ import annotations
+
+from typing import List
+
+from xdsl.dialects.builtin import ArrayAttr, IntAttr, StringAttr, SymbolRefAttr
+from xdsl.dialects.llvm import LinkageAttr
+from xdsl.ir import Attribute, Operation, ParametrizedAttribute, Dialect, TypeAttribute, SSAValue
+from xdsl.irdl import (Region, irdl_attr_definition, irdl_op_definition, OpAttr, IRDLOperation,
+                        ParameterDef, VarOperand, VarOpResult, AnyAttr)
+from xdsl.parser import Parser
+from xdsl.printer import Printer
+
+"""
+The parts of MLIR's llvm dialect that we need for calling variadic external functions,
+such as printf, but which are not provided by xDSL's llvm dialect. The func dialect can
+not express a variadic function, so if printf is called with different argument types in
+the same module then it is declared and called via these operations instead.
+"""
+
+@irdl_attr_definition
+class LLVMFunctionType(ParametrizedAttribute, TypeAttribute):
+    """
+    The type of an LLVM function, e.g. !llvm.func<i32 (!llvm.ptr<i8>, ...)>
+    """
+    name = "llvm.func"
+
+    output: ParameterDef[Attribute]
+    inputs: ParameterDef[ArrayAttr]
+    variadic: ParameterDef[IntAttr]
+
+    @staticmethod
+    def get(output: Attribute, inputs: List[Attribute], variadic: bool = False) -> LLVMFunctionType:
+        return LLVMFunctionType([output, ArrayAttr(inputs), IntAttr(int(variadic))])
+
+    def print_parameters(self, printer: Printer) -> None:
+        printer.print_string("<")
+        printer.print_attribute(self.output)
+        printer.print_string(" (")
+        params=list(self.inputs.data)
+        for idx, param in enumerate(params):
+            if idx > 0:
+                printer.print_string(", ")
+            printer.print_attribute(param)
+        if self.variadic.data:
+            printer.print_string(", ..." if len(params) > 0 else "...")
+        printer.print_string(")>")
+
+    @staticmethod
+    def parse_parameters(parser: Parser) -> list[Attribute]:
+        parser.parse_characters("<", "llvm.func parameters expected")
+        output=parser.try_parse_type()
+        if output is None:
+            parser.raise_error("Expected llvm.func return type")
+        parser.parse_characters("(", "llvm.func argument types expected")
+        inputs=[]
+        variadic=False
+        while not parser.tokenizer.starts_with(")"):
+            if parser.tokenizer.starts_with("..."):
+                parser.parse_characters("...", "llvm.func variadic marker expected")
+                variadic=True
+            else:
+                param=parser.try_parse_type()
+                if param is None:
+                    parser.raise_error("Expected llvm.func argument type")
+                inputs.append(param)
+            if not parser.tokenizer.starts_with(")"):
+                parser.parse_characters(",", "llvm.func argument types must be separated by `,`")
+        parser.parse_characters(")", "End of llvm.func argument types expected")
+        parser.parse_characters(">", "End of llvm.func parameters expected")
+        return [output, ArrayAttr(inputs), IntAttr(int(variadic))]
+
+@irdl_op_definition
+class LLVMFuncOp(IRDLOperation):
+    """
+    An LLVM function, we only use this for declaring external functions and-so
+    the body is always empty
+    """
+    name = "llvm.func"
+
+    body: Region
+    sym_name: OpAttr[StringAttr]
+    function_type: OpAttr[LLVMFunctionType]
+    linkage: OpAttr[LinkageAttr]
+
+    @staticmethod
+    def external(name: str, function_type: LLVMFunctionType) -> LLVMFuncOp:
+        return LLVMFuncOp.build(attributes={"sym_name": StringAttr(name),
+                                "function_type": function_type, "linkage": LinkageAttr("external")},
+                                regions=[Region()])
+
+@irdl_op_definition
+class LLVMCallOp(IRDLOperation):
+    """
+    Calls an LLVM function, which can be variadic
+    """
+    name = "llvm.call"
+
+    args: VarOperand
+    res: VarOpResult
+    callee: OpAttr[SymbolRefAttr]
+
+    @staticmethod
+    def get(callee: str, args: List[SSAValue | Operation],
+            result_types: List[Attribute]) -> LLVMCallOp:
+        return LLVMCallOp.build(operands=[args], result_types=[result_types],
+                                attributes={"callee": SymbolRefAttr(callee)})
+
+llvmFuncIR = Dialect([
+    LLVMFuncOp,
+    LLVMCallOp,
+], [
+    LLVMFunctionType,
+])
@@ -3,9 +3,9 @@ from __future__ import annotations
 from typing import List
 
 from xdsl.dialects.builtin import IntegerAttr, StringAttr, ArrayAttr, AnyAttr, FloatAttr
-from xdsl.ir import Data, Operation, ParametrizedAttribute, Dialect, TypeAttribute
+from xdsl.ir import Attribute, Data, Operation, ParametrizedAttribute, Dialect, TypeAttribute
 from xdsl.irdl import (AnyOf, Region, Block, irdl_attr_definition,
-                        irdl_op_definition, OpAttr, IRDLOperation)
+                        irdl_op_definition, OpAttr, IRDLOperation, ParameterDef)
 from xdsl.parser import Parser
 from xdsl.printer import Printer
 
@@ -47,6 +47,24 @@ class EmptyType(ParametrizedAttribute, TypeAttribute):
     """
     name="empty"
 
+@irdl_attr_definition
+class Argument(ParametrizedAttribute):
+    """
+    An argument to a function, holding the name of the argument and its type. The
+    type is obtained from the Python type annotation of the argument
+    """
+    name="tiny_py.argument"
+
+    var_name: ParameterDef[StringAttr]
+    type: ParameterDef[Attribute]
+
+    @staticmethod
+    def get(var_name: str | StringAttr, type: Attribute) -> Argument:
+        if isinstance(var_name, str):
+            # If var_name is a string then wrap it in StringAttr
+            var_name=StringAttr(var_name)
+        return Argument([var_name, type])
+
 @irdl_op_definition
 class Module(IRDLOperation):
     """
@@ -69,7 +87,9 @@ class Function(IRDLOperation):
     """
     A Python function, our handling here is simplistic and limited but sufficient
     for the exercise (and keeps this simple!) You can see how we have a mixture of
-    attributes and a region for the body
+    attributes and a region for the body. The arguments are a list of Argument
+    attributes, and return_var is the type that is returned (or empty if the function
+    does not return a value)
     """
     name = "tiny_py.function"
 
@@ -80,8 +100,8 @@ class Function(IRDLOperation):
 
     @staticmethod
     def get(fn_name: str | StringAttr,
-            return_var: Operation | None,
-            args: List[Operation],
+            return_var: Attribute | None,
+            args: List[Argument],
             body: List[Operation],
             verify_op: bool = True) -> Routine:
         if isinstance(fn_name, str):
@@ -183,6 +203,59 @@ class Var(IRDLOperation):
             res.verify(verify_nested_ops=False)
         return res
 
+@irdl_op_definition
+class ArrayAccess(IRDLOperation):
+    """
+    Reading an element of an array, which is a function argument, storing the array
+    name as a string and the index expressions (one per dimension) in a region
+    """
+    name = "tiny_py.array_access"
+
+    var_name: OpAttr[StringAttr]
+    indices: Region
+
+    @staticmethod
+    def get(var_name: str | StringAttr,
+            indices: List[Operation],
+            verify_op: bool = True) -> ArrayAccess:
+        if isinstance(var_name, str):
+            # If var_name is a string then wrap it in StringAttr
+            var_name=StringAttr(var_name)
+
+        res = ArrayAccess.build(attributes={"var_name": var_name}, regions=[Region([Block(indices)])])
+        if verify_op:
+            # We don't verify nested operations since they might have already been verified
+            res.verify(verify_nested_ops=False)
+        return res
+
+@irdl_op_definition
+class ArrayAssign(IRDLOperation):
+    """
+    Writing to an element of an array, this is similar to assignment but along with
+    the RHS expression there are also the index expressions (one per dimension)
+    """
+    name = "tiny_py.array_assign"
+
+    var_name: OpAttr[StringAttr]
+    indices: Region
+    value: Region
+
+    @staticmethod
+    def get(var_name: str | StringAttr,
+            indices: List[Operation],
+            value: Operation,
+            verify_op: bool = True) -> ArrayAssign:
+        if isinstance(var_name, str):
+            # If var_name is a string then wrap it in StringAttr
+            var_name=StringAttr(var_name)
+
+        res = ArrayAssign.build(attributes={"var_name": var_name}, regions=[Region([Block(indices)]),
+                Region([Block([value])])])
+        if verify_op:
+            # We don't verify nested operations since they might have already been verified
+            res.verify(verify_nested_ops=False)
+        return res
+
 @irdl_op_definition
 class BinaryOperation(IRDLOperation):
     """
@@ -223,29 +296,45 @@ class Constant(IRDLOperation):
     @staticmethod
     def get(value: None | bool | int | str | float, width=None,
             verify_op: bool = True) -> Literal:
-        if width is None: width=32
-        if type(value) is int:
-            attr = IntegerAttr.from_int_and_width(value, width)
-        elif type(value) is float:
-            attr = FloatAttr(value, width)
-        elif type(value) is str:
-            attr = StringAttr(value)
-        else:
-            raise Exception(f"Unknown constant of type {type(value)}")
-        res = Constant.create(attributes={"value": attr})
+        res = Constant.create(attributes={"value": get_constant_attr(value, width)})
         if verify_op:
             # We don't verify nested operations since they might have already been verified
             res.verify(verify_nested_ops=False)
         return res
 
+def get_constant_attr(value: None | bool | int | str | float, width=None) -> Attribute:
+    """
+    The attribute that holds the value of a constant, integers and floats are 32 bit
+    unless another width is given
+    """
+    if width is None: width=32
+    if type(value) is int:
+        return IntegerAttr.from_int_and_width(value, width)
+    elif type(value) is float:
+        return FloatAttr(value, width)
+    elif type(value) is str:
+        return StringAttr(value)
+    raise Exception(f"Unknown constant of type {type(value)}")
+
 @irdl_op_definition
 class Return(IRDLOperation):
     """
-    Return from a function, we just support return without
-    any values/expressions at the moment
+    Return from a function, optionally returning the value of an expression
+    which is held in the region (this is empty if no value is returned)
     """
     name = "tiny_py.return"
 
+    value: Region
+
+    @staticmethod
+    def get(value: Operation | None = None,
+            verify_op: bool = True) -> Return:
+        res = Return.build(regions=[Region([Block([] if value is None else [value])])])
+        if verify_op:
+            # We don't verify nested operations since they might have already been verified
+            res.verify(verify_nested_ops=False)
+        return res
+
 @irdl_op_definition
 class CallExpr(IRDLOperation):
     """
@@ -290,9 +379,12 @@ tinyPyIR = Dialect([
     Assign,
     Loop,
     Var,
+    ArrayAccess,
+    ArrayAssign,
     BinaryOperation,
     CallExpr,
 ], [
     BoolType,
     EmptyType,
+    Argument,
 ])
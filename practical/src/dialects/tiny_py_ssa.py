@@ -0,0 +1,276 @@
+from __future__ import annotations
+
+from typing import Annotated, List
+
+from xdsl.dialects.builtin import IntegerAttr, StringAttr, AnyAttr, FloatAttr
+from xdsl.ir import Attribute, Operation, SSAValue, ParametrizedAttribute, Dialect, TypeAttribute
+from xdsl.irdl import (AnyOf, Region, Block, irdl_attr_definition, irdl_op_definition, OpAttr,
+                        IRDLOperation, Operand, VarOperand, OpResult, VarOpResult)
+from tiny_py import BoolType, EmptyType, get_constant_attr
+
+"""
+This is the SSA form of our tiny_py dialect. In tiny_py the operands of an expression are
+held in regions, so each expression is a tree of nested operations and every node of the
+tree has its own regions and blocks. Here instead each expression is an operation in the
+enclosing block that produces a result, and the operations that are applied to it take
+that result as an operand, in the same way as the standard dialects. The IR can then be
+worked through (e.g. lowered, printed or verified) block by block without recursing into
+expressions, so there is no limit on the size of an expression, whereas an expression of
+several hundred terms in tiny_py exceeds Python's recursion limit.
+
+Expressions are placed before the statement (or expression) that uses them, in the order
+that Python evaluates them. The results are of the opaque value type, as the types of
+expressions are only known once the variables that they reference have been assigned, which
+is worked out when lowering. Functions and the module are the same as in tiny_py, so a
+tiny_py function holds the operations of this dialect in its body.
+
+The operations are built with create rather than build, which checks each argument against
+the definition and is several times slower, as there are very many of these operations in
+large kernels. Each operation is still verified once it has been created.
+"""
+
+@irdl_attr_definition
+class ValueType(ParametrizedAttribute, TypeAttribute):
+    """
+    The type of the result of an expression, the actual type is found when lowering
+    """
+    name="tiny_py_ssa.value"
+
+# As the value type has no parameters every result shares this instance of it
+value_type=ValueType()
+
+@irdl_op_definition
+class Constant(IRDLOperation):
+    """
+    A constant value, as in tiny_py this is an integer, floating point or string
+    """
+    name = "tiny_py_ssa.constant"
+
+    value: OpAttr[AnyOf([StringAttr, IntegerAttr, FloatAttr])]
+    result: Annotated[OpResult, ValueType]
+
+    @staticmethod
+    def get(value: None | bool | int | str | float | Attribute, width=None,
+            verify_op: bool = True) -> Constant:
+        if not isinstance(value, Attribute):
+            value=get_constant_attr(value, width)
+        res = Constant.create(attributes={"value": value}, result_types=[value_type])
+        if verify_op:
+            res.verify(verify_nested_ops=False)
+        return res
+
+@irdl_op_definition
+class Var(IRDLOperation):
+    """
+    Reads the value that is currently assigned to a variable
+    """
+    name = "tiny_py_ssa.var"
+
+    variable: OpAttr[StringAttr]
+    result: Annotated[OpResult, ValueType]
+
+    @staticmethod
+    def get(variable: str | StringAttr,
+            verify_op: bool = True) -> Var:
+        if isinstance(variable, str):
+            # If variable is a string then wrap it in StringAttr
+            variable=StringAttr(variable)
+
+        res = Var.create(attributes={"variable": variable}, result_types=[value_type])
+        if verify_op:
+            res.verify(verify_nested_ops=False)
+        return res
+
+@irdl_op_definition
+class BinaryOperation(IRDLOperation):
+    """
+    A Python binary operation, storing the operation type as a string and
+    taking the values of the LHS and RHS expressions as operands
+    """
+    name = "tiny_py_ssa.binaryoperation"
+
+    op: OpAttr[StringAttr]
+    lhs: Annotated[Operand, ValueType]
+    rhs: Annotated[Operand, ValueType]
+    result: Annotated[OpResult, ValueType]
+
+    @staticmethod
+    def get(op: str | StringAttr,
+            lhs: SSAValue,
+            rhs: SSAValue,
+            verify_op: bool = True) -> BinaryOperation:
+        if isinstance(op, str):
+            # If op is a string then wrap it in StringAttr
+            op=StringAttr(op)
+
+        res = BinaryOperation.create(attributes={"op": op}, operands=[lhs, rhs], result_types=[value_type])
+        if verify_op:
+            res.verify(verify_nested_ops=False)
+        return res
+
+@irdl_op_definition
+class ArrayAccess(IRDLOperation):
+    """
+    Reading an element of an array argument, with one index operand per dimension
+    """
+    name = "tiny_py_ssa.array_access"
+
+    var_name: OpAttr[StringAttr]
+    indices: Annotated[VarOperand, ValueType]
+    result: Annotated[OpResult, ValueType]
+
+    @staticmethod
+    def get(var_name: str | StringAttr,
+            indices: List[SSAValue],
+            verify_op: bool = True) -> ArrayAccess:
+        if isinstance(var_name, str):
+            # If var_name is a string then wrap it in StringAttr
+            var_name=StringAttr(var_name)
+
+        res = ArrayAccess.create(attributes={"var_name": var_name}, operands=list(indices), result_types=[value_type])
+        if verify_op:
+            res.verify(verify_nested_ops=False)
+        return res
+
+@irdl_op_definition
+class CallExpr(IRDLOperation):
+    """
+    Calling a function, the same as in tiny_py but with the arguments as operands. If the
+    type is not empty then the call is an expression and has a result
+    """
+    name = "tiny_py_ssa.call_expr"
+
+    func: OpAttr[StringAttr]
+    builtin: OpAttr[BoolType]
+    type: OpAttr[AnyOf([AnyAttr(), EmptyType])]
+    args: Annotated[VarOperand, ValueType]
+    res: Annotated[VarOpResult, ValueType]
+
+    @staticmethod
+    def get(func: str | StringAttr,
+            args: List[SSAValue],
+            type=EmptyType(),
+            builtin: bool | BoolType = False,
+            verify_op: bool = True) -> CallExpr:
+        if isinstance(func, str):
+            # If func is a string then wrap it in StringAttr
+            func=StringAttr(func)
+        if not isinstance(builtin, BoolType):
+            builtin=BoolType(builtin)
+
+        result_types=[] if isinstance(type, EmptyType) else [value_type]
+        res = CallExpr.create(attributes={"func": func, "type": type, "builtin": builtin},
+                              operands=list(args), result_types=result_types)
+        if verify_op:
+            res.verify(verify_nested_ops=False)
+        return res
+
+@irdl_op_definition
+class Assign(IRDLOperation):
+    """
+    Assigns the value of an expression to a variable
+    """
+    name = "tiny_py_ssa.assign"
+
+    var_name: OpAttr[StringAttr]
+    value: Annotated[Operand, ValueType]
+
+    @staticmethod
+    def get(var_name: str | StringAttr,
+            value: SSAValue,
+            verify_op: bool = True) -> Assign:
+        if isinstance(var_name, str):
+            # If var_name is a string then wrap it in StringAttr
+            var_name=StringAttr(var_name)
+
+        res = Assign.create(attributes={"var_name": var_name}, operands=[value])
+        if verify_op:
+            res.verify(verify_nested_ops=False)
+        return res
+
+@irdl_op_definition
+class ArrayAssign(IRDLOperation):
+    """
+    Writing to an element of an array, taking the value and then one index per dimension
+    as operands
+    """
+    name = "tiny_py_ssa.array_assign"
+
+    var_name: OpAttr[StringAttr]
+    value: Annotated[Operand, ValueType]
+    indices: Annotated[VarOperand, ValueType]
+
+    @staticmethod
+    def get(var_name: str | StringAttr,
+            value: SSAValue,
+            indices: List[SSAValue],
+            verify_op: bool = True) -> ArrayAssign:
+        if isinstance(var_name, str):
+            # If var_name is a string then wrap it in StringAttr
+            var_name=StringAttr(var_name)
+
+        res = ArrayAssign.create(attributes={"var_name": var_name}, operands=[value]+list(indices))
+        if verify_op:
+            res.verify(verify_nested_ops=False)
+        return res
+
+@irdl_op_definition
+class Return(IRDLOperation):
+    """
+    Return from a function, optionally with the value of an expression as the operand
+    """
+    name = "tiny_py_ssa.return"
+
+    value: Annotated[VarOperand, ValueType]
+
+    @staticmethod
+    def get(value: SSAValue | None = None,
+            verify_op: bool = True) -> Return:
+        res = Return.create(operands=[] if value is None else [value])
+        if verify_op:
+            res.verify(verify_nested_ops=False)
+        return res
+
+@irdl_op_definition
+class Loop(IRDLOperation):
+    """
+    A Python loop between two bounds, which are operands computed before the loop, with
+    the body held in a region
+    """
+    name = "tiny_py_ssa.loop"
+
+    variable: OpAttr[StringAttr]
+    from_expr: Annotated[Operand, ValueType]
+    to_expr: Annotated[Operand, ValueType]
+    body: Region
+
+    @staticmethod
+    def get(variable: str | StringAttr,
+            from_expr: SSAValue,
+            to_expr: SSAValue,
+            body: List[Operation],
+            verify_op: bool = True) -> Loop:
+        if isinstance(variable, str):
+            # If variable is a string then wrap it in StringAttr
+            variable=StringAttr(variable)
+
+        res = Loop.create(attributes={"variable": variable}, operands=[from_expr, to_expr],
+                          regions=[Region([Block(body)])])
+        if verify_op:
+            # We don't verify nested operations since they might have already been verified
+            res.verify(verify_nested_ops=False)
+        return res
+
+tinyPySSAIR = Dialect([
+    Constant,
+    Var,
+    BinaryOperation,
+    ArrayAccess,
+    CallExpr,
+    Assign,
+    ArrayAssign,
+    Return,
+    Loop,
+], [
+    ValueType,
+])
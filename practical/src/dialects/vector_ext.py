@@ -0,0 +1,77 @@
+from __future__ import annotations
+
+from xdsl.dialects.builtin import StringAttr, VectorType
+from xdsl.ir import Attribute, Operation, ParametrizedAttribute, Dialect, SSAValue
+from xdsl.irdl import (irdl_attr_definition, irdl_op_definition, OpAttr, IRDLOperation,
+                        ParameterDef, Operand, OpResult)
+from xdsl.parser import Parser
+from xdsl.printer import Printer
+from xdsl.utils.exceptions import VerifyException
+
+"""
+The parts of MLIR's vector dialect that we need for vectorising reductions, but which
+are not provided by xDSL's vector dialect. This is the vector.reduction operation, which
+combines all the elements of a vector into a single scalar value, along with the
+attribute that selects how they are combined.
+"""
+
+# The kinds of combination, these are the names used by MLIR's vector.kind attribute
+combining_kinds=["add", "mul", "minui", "minsi", "minf", "maxui", "maxsi", "maxf", "and", "or", "xor"]
+
+@irdl_attr_definition
+class CombiningKindAttr(ParametrizedAttribute):
+    """
+    How the elements of a vector are combined, e.g. #vector.kind<add>
+    """
+    name = "vector.kind"
+
+    kind: ParameterDef[StringAttr]
+
+    @staticmethod
+    def get(kind: str) -> CombiningKindAttr:
+        return CombiningKindAttr([StringAttr(kind)])
+
+    def verify(self) -> None:
+        if self.kind.data not in combining_kinds:
+            raise VerifyException(f"Unknown vector combining kind `{self.kind.data}'")
+
+    def print_parameters(self, printer: Printer) -> None:
+        printer.print_string(f"<{self.kind.data}>")
+
+    @staticmethod
+    def parse_parameters(parser: Parser) -> list[Attribute]:
+        parser.parse_characters("<", "vector.kind parameters expected")
+        kind=parser.try_parse_bare_id()
+        if kind is None or kind.text not in combining_kinds:
+            parser.raise_error("Expected vector combining kind")
+        parser.parse_characters(">", "End of vector.kind parameters expected")
+        return [StringAttr(kind.text)]
+
+@irdl_op_definition
+class ReductionOp(IRDLOperation):
+    """
+    Combines the elements of a vector into a scalar of the vector's element type
+    """
+    name = "vector.reduction"
+
+    vector: Operand
+    dest: OpResult
+    kind: OpAttr[CombiningKindAttr]
+
+    def verify_(self) -> None:
+        if not isinstance(self.vector.typ, VectorType):
+            raise VerifyException("vector.reduction operand must be a vector")
+        if self.vector.typ.element_type != self.dest.typ:
+            raise VerifyException("vector.reduction result must be the element type of the vector")
+
+    @staticmethod
+    def get(kind: str, vector: SSAValue | Operation) -> ReductionOp:
+        vector=SSAValue.get(vector)
+        return ReductionOp.build(operands=[vector], result_types=[vector.typ.element_type],
+                                 attributes={"kind": CombiningKindAttr.get(kind)})
+
+vectorExtIR = Dialect([
+    ReductionOp,
+], [
+    CombiningKindAttr,
+])
@@ -0,0 +1,135 @@
+from xdsl.dialects.builtin import ModuleOp, IntegerAttr, FloatAttr
+from xdsl.ir import Attribute, Operation, OpResult, Region, MLContext
+from dataclasses import dataclass
+from typing import Optional
+from xdsl.passes import ModulePass
+import numpy as np
+import tiny_py
+import tiny_py_ssa
+from tiny_py_to_standard import is_float_type, get_type_width, get_common_type
+
+"""
+Folds binary operations of the tiny_py dialect whose operands are both constants into a
+single constant, so that e.g. 2.0*3.14159 or 1024*1024 is computed once by the compiler
+rather than in every iteration at runtime. Folding is repeated up each expression, so an
+expression made up only of literals becomes one constant.
+
+The folded value is the one that the lowered operations would compute, so the operation
+is undertaken in the common type of its operands (as in tiny-py-to-standard), integers
+wrap at the width of their type and integer division truncates towards zero as arith.divsi
+does. Floating point operations are rounded to the precision of their type, so folding f32
+values gives the same result as the f32 operation would. Division by zero is left to be
+undertaken at runtime.
+
+This also folds the SSA form of tiny_py, where the folded constant replaces the result of
+the binary operation and constants that are no longer used are removed.
+"""
+
+numpy_float_types={16: np.float16, 32: np.float32, 64: np.float64}
+
+def wrap_integer(value: int, width: int) -> int:
+    value&=(1 << width)-1
+    return value-(1 << width) if value >= 1 << (width-1) else value
+
+def convert_value(value, from_type: Attribute, to_type: Attribute):
+    """
+    Converts a constant's value to another type, matching the conversions of convert_to_type
+    """
+    if is_float_type(to_type):
+        return numpy_float_types[get_type_width(to_type)](value)
+    if is_float_type(from_type):
+        value=int(value)
+    return wrap_integer(value, get_type_width(to_type))
+
+def fold_values(operation: str, lhs, rhs, typ: Attribute):
+    """
+    Computes the result of the binary operation, or None if it should not be folded
+    """
+    if operation == "add":
+        result=lhs+rhs
+    elif operation == "sub":
+        result=lhs-rhs
+    elif operation == "mult":
+        result=lhs*rhs
+    elif operation == "div":
+        if rhs == 0:
+            return None
+        if is_float_type(typ):
+            result=lhs/rhs
+        else:
+            result=abs(lhs)//abs(rhs)
+            if (lhs < 0) != (rhs < 0):
+                result=-result
+    else:
+        return None
+    if is_float_type(typ):
+        return float(result)
+    return wrap_integer(result, get_type_width(typ))
+
+def get_operand_op(op: Operation, operand_name: str) -> Optional[Operation]:
+    """
+    The operation of an operand, in tiny_py this is held in the operand's region and in
+    the SSA form it is the operation that produces the operand
+    """
+    operand=getattr(op, operand_name)
+    if isinstance(operand, OpResult):
+        return operand.op
+    if isinstance(operand, Region):
+        return operand.blocks[0].ops.first
+    return None
+
+def try_fold(op: tiny_py.BinaryOperation | tiny_py_ssa.BinaryOperation) -> Optional[Operation]:
+    lhs=get_operand_op(op, "lhs")
+    rhs=get_operand_op(op, "rhs")
+    constant_type=tiny_py_ssa.Constant if isinstance(op, tiny_py_ssa.BinaryOperation) else tiny_py.Constant
+    if not isinstance(lhs, constant_type) or not isinstance(rhs, constant_type):
+        return None
+    lhs_attr, rhs_attr=lhs.attributes["value"], rhs.attributes["value"]
+    if not all(isinstance(attr, IntegerAttr) or isinstance(attr, FloatAttr) for attr in [lhs_attr, rhs_attr]):
+        return None
+
+    lhs_type=lhs_attr.type if isinstance(lhs_attr, FloatAttr) else lhs_attr.typ
+    rhs_type=rhs_attr.type if isinstance(rhs_attr, FloatAttr) else rhs_attr.typ
+    typ=get_common_type(lhs_type, rhs_type)
+    with np.errstate(all="ignore"):
+        result=fold_values(op.op.data, convert_value(lhs_attr.value.data, lhs_type, typ),
+                           convert_value(rhs_attr.value.data, rhs_type, typ), typ)
+    if result is None:
+        return None
+    attr=FloatAttr(result, typ) if is_float_type(typ) else IntegerAttr(result, typ)
+    if constant_type is tiny_py_ssa.Constant:
+        return tiny_py_ssa.Constant.get(attr)
+    return tiny_py.Constant.create(attributes={"value": attr})
+
+def replace_ssa_binary_operation(op: tiny_py_ssa.BinaryOperation, folded: tiny_py_ssa.Constant):
+    operand_ops=[op.lhs.op, op.rhs.op]
+    op.results[0].replace_by(folded.results[0])
+    op.parent_block().erase_op(op)
+    for operand_op in operand_ops:
+        if operand_op.parent is not None and len(operand_op.results[0].uses) == 0:
+            operand_op.parent_block().erase_op(operand_op)
+
+@dataclass
+class FoldConstants(ModulePass):
+  """
+  This is the entry point for the transformation pass, which runs on the tiny_py dialect
+  and so comes before tiny-py-to-standard
+  """
+  name = 'fold-constants'
+
+  def apply(self, ctx: MLContext, input_module: ModuleOp):
+    binary_ops=[]
+    ssa_binary_ops=[]
+    input_module.walk(lambda op: binary_ops.append(op) if isinstance(op, tiny_py.BinaryOperation) else None)
+    input_module.walk(lambda op: ssa_binary_ops.append(op) if isinstance(op, tiny_py_ssa.BinaryOperation) else None)
+    # The walk visits an operation before those nested in it, so the operations are folded
+    # in reverse order, which folds each operand before the operation that uses it. In the
+    # SSA form operands come before the operations that use them, so these are folded in order
+    for op in list(reversed(binary_ops))+ssa_binary_ops:
+      folded=try_fold(op)
+      if folded is not None:
+        op.parent_block().insert_op_before(folded, op)
+        if isinstance(op, tiny_py_ssa.BinaryOperation):
+          replace_ssa_binary_operation(op, folded)
+        else:
+          op.parent_block().erase_op(op)
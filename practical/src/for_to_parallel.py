@@ -1,23 +1,360 @@
-from xdsl.dialects.builtin import ModuleOp
-from xdsl.ir import Operation, SSAValue, Region, Block, MLContext, BlockArgument
-from xdsl.dialects import scf, arith
+from xdsl.dialects.builtin import ModuleOp, IntegerAttr, FloatAttr, IndexType, i64
+from xdsl.ir import Operation, SSAValue, Region, Block, MLContext, BlockArgument, OpResult
+from xdsl.dialects import scf, arith, func
 from dataclasses import dataclass
+from typing import Optional, Dict, List, Set
+import sys
 from xdsl.passes import ModulePass
 from xdsl.pattern_rewriter import (GreedyRewritePatternApplier,
                                    PatternRewriter, PatternRewriteWalker,
                                    RewritePattern, op_type_rewrite_pattern)
+from parallel_legality import (analyse_loop, IterArgKind, IterArgClassification, LoopLegality,
+                               subtraction_reductions, reduction_identities)
+from tiny_py_to_standard import convert_to_type, is_float_type
 
-matched_operations={"arith.addf": arith.Addf, "arith.addi": arith.Addi}
+# The operations that can be used as reductions, each of these is associative and commutative
+matched_operations={"arith.addf": arith.Addf, "arith.addi": arith.Addi, "arith.mulf": arith.Mulf,
+                    "arith.muli": arith.Muli, "arith.maxf": arith.Maxf, "arith.minf": arith.Minf,
+                    "arith.maxsi": arith.MaxSI, "arith.minsi": arith.MinSI, "arith.maxui": arith.MaxUI,
+                    "arith.minui": arith.MinUI, "arith.andi": arith.AndI, "arith.ori": arith.OrI,
+                    "arith.xori": arith.XOrI}
+
+def get_constant_value(value: SSAValue) -> Optional[int]:
+    """
+    Returns the integer value of an SSA value if it is a constant, which for our loop
+    bounds is an arith.constant that might be cast to an index
+    """
+    if not isinstance(value, OpResult):
+        return None
+    op=value.op
+    if isinstance(op, arith.IndexCastOp):
+        return get_constant_value(op.input)
+    if isinstance(op, arith.Constant) and isinstance(op.value, IntegerAttr):
+        return op.value.value.data
+    return None
+
+@dataclass
+class ParallelCostModel:
+    """
+    Decides whether a loop has enough work to be worth running in parallel, as for short
+    loops the overhead of starting and synchronising the threads is larger than the work
+    that is shared amongst them. The work of a loop is estimated as its trip count multiplied
+    by the number of operations in each iteration, and the loop is only parallelised if this
+    is at least min_parallel_work
+    """
+    min_parallel_work: int
+
+    def get_trip_count(self, for_loop: scf.For) -> Optional[int]:
+        """
+        The number of iterations of the loop if its bounds are constant, or None otherwise
+        """
+        lb=get_constant_value(for_loop.lb)
+        ub=get_constant_value(for_loop.ub)
+        step=get_constant_value(for_loop.step)
+        if lb is None or ub is None or step is None or step <= 0:
+            return None
+        return max(0, -(-(ub-lb) // step))
+
+    def get_ops_per_iteration(self, block: Block) -> int:
+        """
+        Counts the operations executed by each iteration, where there is an inner loop with
+        constant bounds its operations are multiplied by its trip count, and if the trip count
+        is not known then it is assumed to iterate at least once
+        """
+        count=0
+        for op in block.ops:
+            if isinstance(op, scf.Yield):
+                continue
+            count+=1
+            inner_count=sum(self.get_ops_per_iteration(inner_block)
+                            for region in op.regions for inner_block in region.blocks)
+            if isinstance(op, scf.For):
+                inner_count*=self.get_trip_count(op) or 1
+            count+=inner_count
+        return count
+
+    def get_min_trip_count(self, for_loop: scf.For) -> int:
+        """
+        The smallest number of iterations for which the loop is worth parallelising
+        """
+        ops_per_iteration=max(1, self.get_ops_per_iteration(for_loop.body.blocks[0]))
+        return -(-self.min_parallel_work // ops_per_iteration)
+
+    def should_parallelise(self, for_loop: scf.For) -> Optional[bool]:
+        """
+        Returns whether the loop should be parallelised, or None if this depends upon the
+        trip count which is only known at runtime. Where a single iteration is enough work,
+        e.g. with a min_parallel_work of zero, the trip count doesn't matter
+        """
+        min_trip_count=self.get_min_trip_count(for_loop)
+        if min_trip_count <= 1:
+            return True
+        trip_count=self.get_trip_count(for_loop)
+        if trip_count is None:
+            return None
+        return trip_count >= min_trip_count
+
+def version_loop(for_loop: scf.For, cost_model: ParallelCostModel):
+    """
+    Where the bounds are not known until runtime we generate two versions of the loop, the
+    original sequential loop and one that will be parallelised, with a check of the trip
+    count selecting between them. As this avoids a division the check is
+    (ub - lb) >= min_trip_count * step, and each version is wrapped in a region of scf.if.
+    xDSL's arith.cmpi does not accept index operands, so these are compared as i64
+    """
+    parent_block=for_loop.parent_block()
+    sequential_loop=for_loop.clone()
+
+    min_trip_count=arith.Constant.from_int_and_width(cost_model.get_min_trip_count(for_loop), IndexType())
+    min_range=arith.Muli.get(min_trip_count, for_loop.step)
+    loop_range=arith.Subi.get(for_loop.ub, for_loop.lb)
+    min_range_cast=arith.IndexCastOp.get(min_range, i64)
+    loop_range_cast=arith.IndexCastOp.get(loop_range, i64)
+    condition=arith.Cmpi.get(loop_range_cast, min_range_cast, "sge")
+    result_types=[res.typ for res in for_loop.results]
+    if_op=scf.If.get(condition, result_types, Region(Block()), Region(Block()))
+    parent_block.insert_ops_before([min_trip_count, min_range, loop_range, min_range_cast,
+                                    loop_range_cast, condition, if_op], for_loop)
+
+    for old_result, new_result in zip(for_loop.results, if_op.results):
+        old_result.replace_by(new_result)
+    for_loop.detach()
+    if_op.true_region.blocks[0].add_ops([for_loop, scf.Yield.get(*for_loop.results)])
+    if_op.false_region.blocks[0].add_ops([sequential_loop, scf.Yield.get(*sequential_loop.results)])
+
+def is_inside_parallel_loop(for_loop: scf.For, cost_model: ParallelCostModel, legal_loops: Dict[int, LoopLegality],
+                            nested_loops: Set[int]) -> bool:
+    """
+    Whether an enclosing loop is parallelised (or versioned), a loop inside this already runs
+    in parallel and may carry a reduction of the enclosing loop, which relies on the loop
+    being directly in the enclosing loop's body so it can't be versioned
+    """
+    parent=for_loop.parent_op()
+    while parent is not None:
+        if (isinstance(parent, scf.For) and id(parent) in legal_loops and
+                (id(parent) in nested_loops or cost_model.should_parallelise(parent) is not False)):
+            return True
+        parent=parent.parent_op()
+    return False
+
+def normalise_reduction(body: Block, idx: int, classification: IterArgClassification):
+    """
+    Rewrites the update of a reduction into the form acc = acc op x, where acc is the block
+    argument and the result is yielded directly, as this is the form that is converted into
+    scf.reduce. For a chain such as acc = acc + a + b this first combines the other operands,
+    x = a + b, negating those that are subtracted, and converts x to the type of acc rather
+    than converting acc to the type of x and back again
+    """
+    chain=classification.chain
+    block_arg=body.args[idx+1]
+    if len(chain) == 1 and chain[0].name == classification.reduction_kind:
+      # Already in this form
+      return
+
+    acc_type=block_arg.typ
+    op_instance=matched_operations[classification.reduction_kind]
+    if isinstance(chain[0], scf.For):
+      # A reduction through an inner loop, the inner loop instead reduces into a partial
+      # value that starts from the identity of the reduction, and this is then combined
+      # with the value
+      inner_loop=chain[0]
+      operand_idx=[i for i, operand in enumerate(inner_loop.operands) if operand is block_arg][0]
+      identity_value=reduction_identities[classification.reduction_kind]
+      if is_float_type(acc_type):
+        identity=arith.Constant.from_float_and_width(float(identity_value), acc_type)
+      else:
+        identity=arith.Constant.from_int_and_width(identity_value, acc_type)
+      body.insert_op_before(identity, inner_loop)
+      inner_loop.replace_operand(operand_idx, identity.results[0])
+      # The first three operands of the loop are the bounds and step
+      update=op_instance.build(operands=[block_arg, inner_loop.results[operand_idx-3]], result_types=[acc_type])
+      body.insert_op_before(update, body.ops.last)
+      body.ops.last.replace_operand(idx, update.results[0])
+      return
+
+    new_ops=[]
+    combined=None
+    on_chain=[block_arg]+[op.results[0] for op in chain]
+    for op in chain:
+      if op.name not in matched_operations and op.name not in subtraction_reductions:
+        continue
+      other_arg=[operand for operand in op.operands if not any(operand is value for value in on_chain)][0]
+      if op.name in subtraction_reductions:
+        if is_float_type(other_arg.typ):
+          negate=[arith.Negf.get(other_arg)]
+        else:
+          zero=arith.Constant.from_int_and_width(0, other_arg.typ)
+          negate=[zero, arith.Subi.get(zero, other_arg)]
+        new_ops+=negate
+        other_arg=negate[-1].results[0]
+      conv_ops, other_arg=convert_to_type(other_arg, acc_type)
+      new_ops+=conv_ops
+      if combined is not None:
+        combine_op=op_instance.build(operands=[combined, other_arg], result_types=[acc_type])
+        new_ops.append(combine_op)
+        other_arg=combine_op.results[0]
+      combined=other_arg
+
+    update=op_instance.build(operands=[block_arg, combined], result_types=[acc_type])
+    new_ops.append(update)
+    body.insert_ops_before(new_ops, body.ops.last)
+    body.ops.last.replace_operand(idx, update.results[0])
+    for op in reversed(chain):
+      body.erase_op(op)
+
+def is_hoistable(op: Operation, block: Block, hoisted: List[Operation]) -> bool:
+    """
+    Whether an operation can be moved out of the block, which is the case if it has no
+    side effects and all its operands are defined outside of the block (or by operations
+    that are also being hoisted)
+    """
+    if not op.name.startswith("arith.") or len(op.regions) > 0:
+        return False
+    for operand in op.operands:
+        if isinstance(operand, BlockArgument) and operand.block is block:
+            return False
+        if isinstance(operand, OpResult) and operand.op.parent_block() is block and not any(
+                operand.op is hoisted_op for hoisted_op in hoisted):
+            return False
+    return True
+
+def is_identity(value: SSAValue, reduction_kind: str) -> bool:
+    if reduction_kind not in reduction_identities or not isinstance(value, OpResult):
+        return False
+    if not isinstance(value.op, arith.Constant) or not isinstance(value.op.value, (IntegerAttr, FloatAttr)):
+        return False
+    return value.op.value.value.data == reduction_identities[reduction_kind]
+
+class CollapseParallelNestRewriter(RewritePattern):
+    """
+    Collapses a perfect nest of parallel loops, where the body of the outer loop is just
+    the inner loop, into one multi-dimensional parallel loop so that the whole iteration
+    space is shared out amongst the threads rather than just the outer loop. Operations
+    in the outer loop that calculate the inner loop's bounds are hoisted out of it, so
+    the inner bounds must not depend upon the outer loop. Where the outer loop reduces the
+    results of the inner loop, the inner loop must perform the same kind of reduction and
+    start from the identity, then the collapsed loop does the inner loop's reductions from
+    the outer loop's initial values
+    """
+
+    @op_type_rewrite_pattern
+    def match_and_rewrite(self, outer_loop: scf.ParallelOp, rewriter: PatternRewriter):
+        outer_body=outer_loop.body.blocks[0]
+        ops=list(outer_body.ops)
+        inner_loops=[op for op in ops if isinstance(op, scf.ParallelOp)]
+        if len(inner_loops) != 1:
+          return
+        inner_loop=inner_loops[0]
+        inner_body=inner_loop.body.blocks[0]
+        inner_position=ops.index(inner_loop)
+
+        # Everything before the inner loop must be able to be hoisted, and after it there can
+        # only be the reductions of its results
+        hoisted=[]
+        for op in ops[:inner_position]:
+          if not is_hoistable(op, outer_body, hoisted):
+            return
+          hoisted.append(op)
+        outer_reductions=ops[inner_position+1:-1]
+        if len(outer_loop.initVals) != len(inner_loop.initVals) or len(outer_reductions) != len(outer_loop.initVals):
+          return
+        if len(ops[-1].operands) != 0:
+          return
+        for operand in inner_loop.operands:
+          if isinstance(operand, BlockArgument) and operand.block is outer_body:
+            return
+
+        # Each outer reduction must reduce one result of the inner loop, in the same way,
+        # and the inner loop must start this from the identity of the reduction
+        inner_reductions=[op for op in inner_body.ops if isinstance(op, scf.ReduceOp)]
+        init_values=[None]*len(inner_loop.initVals)
+        outer_results=[None]*len(inner_loop.initVals)
+        for outer_idx, outer_reduction in enumerate(outer_reductions):
+          if not isinstance(outer_reduction, scf.ReduceOp) or not isinstance(outer_reduction.argument, OpResult):
+            return
+          inner_idx=outer_reduction.argument.index
+          if outer_reduction.argument.op is not inner_loop or init_values[inner_idx] is not None:
+            return
+          outer_kind=outer_reduction.body.blocks[0].ops.first.name
+          inner_kind=inner_reductions[inner_idx].body.blocks[0].ops.first.name
+          if outer_kind != inner_kind or not is_identity(inner_loop.initVals[inner_idx], inner_kind):
+            return
+          init_values[inner_idx]=outer_loop.initVals[outer_idx]
+          outer_results[outer_idx]=inner_idx
+
+        # Now hoist the operations out of the outer loop and build the collapsed loop, whose
+        # induction variables are those of the outer loop followed by those of the inner loop
+        for op in hoisted:
+          op.detach()
+        outer_loop.parent_block().insert_ops_before(hoisted, outer_loop)
+        new_block=Block(arg_types=[arg.typ for arg in outer_body.args]+[arg.typ for arg in inner_body.args])
+        for old_arg, new_arg in zip(list(outer_body.args)+list(inner_body.args), new_block.args):
+          old_arg.replace_by(new_arg)
+        for op in list(inner_body.ops):
+          op.detach()
+          new_block.add_op(op)
+
+        collapsed_loop=scf.ParallelOp.get(list(outer_loop.lowerBound)+list(inner_loop.lowerBound),
+                                          list(outer_loop.upperBound)+list(inner_loop.upperBound),
+                                          list(outer_loop.step)+list(inner_loop.step), [new_block], init_values)
+        rewriter.replace_matched_op(collapsed_loop, [collapsed_loop.results[idx] for idx in outer_results], safe_erase=False)
+
+def describe_loop_location(loop: Operation, loop_number: int) -> str:
+    """
+    Describes where a loop is for reporting, loops are numbered in the order that they
+    appear in the module starting from zero
+    """
+    function=loop.parent_op()
+    while function is not None and not isinstance(function, func.FuncOp):
+        function=function.parent_op()
+    location=f"loop {loop_number}"
+    if function is not None:
+        location+=f" in `{function.sym_name.data}'"
+    return location
+
+def report_rejection(for_loop: scf.For, loop_number: int, legality: LoopLegality):
+    """
+    Reports why a loop can not be parallelised as a remark
+    """
+    location=describe_loop_location(for_loop, loop_number)
+    for reason in legality.rejections:
+        print(f"remark: for-to-parallel: {location} not parallelised as {reason}", file=sys.stderr)
 
 class ApplyForToParallelRewriter(RewritePattern):
 
+    def __init__(self, cost_model: ParallelCostModel, legal_loops: Dict[int, LoopLegality],
+                 nested_loops: Set[int]):
+        self.cost_model=cost_model
+        # The result of the legality analysis for each loop that is safe to parallelise,
+        # by id of the loop. Loops with runtime bounds in here have been versioned, the
+        # sequential version of these is not in here so is left as it is
+        self.legal_loops=legal_loops
+        # The ids of loops that are parallelised without considering their cost, as they
+        # are going to be collapsed into the enclosing parallel loop
+        self.nested_loops=nested_loops
+
     @op_type_rewrite_pattern
     def match_and_rewrite(self,
                           for_loop: scf.For, rewriter: PatternRewriter):
         """
         This will apply a rewrite to the for loop to convert it into a parallel for loop
-        with reductions
+        with reductions. Loops that the cost model decides do not have enough work are left
+        as they are, and those with runtime bounds will have been versioned beforehand so
+        this converts the parallel version
         """
+        if id(for_loop) not in self.legal_loops:
+          return
+        if id(for_loop) not in self.nested_loops and self.cost_model.should_parallelise(for_loop) is False:
+          return
+        legality=self.legal_loops[id(for_loop)]
+        for idx, classification in enumerate(legality.iter_args):
+          if classification.kind == IterArgKind.REDUCTION:
+            normalise_reduction(for_loop.body.blocks[0], idx, classification)
+        # The block arguments that are reduced, these are offset by one in the block
+        # arguments as the first is the loop's induction variable
+        reduction_args=[for_loop.body.blocks[0].args[idx+1] for idx, classification in
+                        enumerate(legality.iter_args) if classification.kind == IterArgKind.REDUCTION]
+
         # First we get the body of the for loop and detach it (as will attack to the
         # parallel loop when we create it)
         loop_body=for_loop.body.blocks[0]
@@ -28,17 +365,21 @@ class ApplyForToParallelRewriter(RewritePattern):
         block_args=list(loop_body.args)
 
         ops_to_add=[]
-        for op in loop_body.ops:
+        # The initial values of the reductions, in the order of the reduce operations,
+        # along with which result of the for loop each of these replaces
+        init_values=[]
+        reduced_results=[]
+        for op in list(loop_body.ops):
           # We go through each operation in the loop body and see if it is one that needs
           # a reduction operation applied to it
           if op.name in matched_operations.keys():
             # We need to find if it is the LHS or RHS that is based upon the argument to the block
             # if it is neither then ignore this as it is not going to be updated from one iteration
             # to the next so no need to wrap in a reduction
-            if isinstance(op.lhs, BlockArgument):
+            if op.lhs in reduction_args:
               block_arg_op=op.lhs
               other_arg=op.rhs
-            elif isinstance(op.rhs, BlockArgument):
+            elif op.rhs in reduction_args:
               block_arg_op=op.rhs
               other_arg=op.lhs
             else:
@@ -49,6 +390,8 @@ class ApplyForToParallelRewriter(RewritePattern):
             op.detach()
             yielded_args.remove(op.results[0])
             block_args.remove(block_arg_op)
+            init_values.append(for_loop.iter_args[block_arg_op.index-1])
+            reduced_results.append(for_loop.results[block_arg_op.index-1])
 
             # Create a new block for this reduction operation which has the type of
             # operation LHS and RHS present
@@ -61,7 +404,7 @@ class ApplyForToParallelRewriter(RewritePattern):
 
             # Instantiate the dialect operation and create a reduce return operation
             # that will return the result, then add these operations to the block
-            new_op=op_instance.get(block.args[0], block.args[1])
+            new_op=op_instance.build(operands=[block.args[0], block.args[1]], result_types=[block.args[0].typ])
             reduce_result=None # Needs to be completed!
             block.add_ops([new_op, reduce_result])
 
@@ -69,33 +412,102 @@ class ApplyForToParallelRewriter(RewritePattern):
             reduce_op=None # Needs to be completed!
             ops_to_add.append(reduce_op)
 
+        # The remaining loop carried values are private, each iteration writes the value
+        # before reading it, so these are neither passed into the loop nor yielded. Where
+        # one is passed into an inner loop, that is given the initial value instead
+        for idx, classification in enumerate(legality.iter_args):
+          if classification.kind == IterArgKind.PRIVATE:
+            block_args.remove(loop_body.args[idx+1])
+            yielded_args.remove(loop_body.ops.last.arguments[idx])
+            loop_body.args[idx+1].replace_by(for_loop.iter_args[idx])
+
         # Create a new top level block which will have far fewer arguments
         # as none of the reduction arguments are now present here
         new_block=Block(arg_types=[arg.typ for arg in block_args])
-        new_block.add_ops(ops_to_add)
+        for old_arg, new_arg in zip(block_args, new_block.args):
+            old_arg.replace_by(new_arg)
 
         for op in loop_body.ops:
             op.detach()
             new_block.add_op(op)
 
         # We have a yield at the end of the block which yields non reduction
-        # arguments
+        # arguments, the reductions go just before this as their operands are
+        # calculated by the body
         new_yield=scf.Yield.get(*yielded_args)
         new_block.erase_op(new_block.ops.last)
+        new_block.add_ops(ops_to_add)
         new_block.add_op(new_yield)
 
-        # Create our parallel operation and replace the for loop with this
+        # Create our parallel operation
         parallel_loop=None # Needs to be completed!
 
+        # Now replace the for loop with the parallel loop, each result of the parallel loop
+        # is that of a reduction and replaces the corresponding result of the for loop. The
+        # results of private values are never used after the loop, but may still be yielded
+        # from the scf.if where the loop has been versioned, so are replaced by their initial values
+        new_results=list(for_loop.iter_args)
+        for parallel_result, for_result in zip(parallel_loop.results, reduced_results):
+          new_results[for_result.index]=parallel_result
+        rewriter.replace_matched_op(parallel_loop, new_results)
+
 
 @dataclass
 class ConvertForToParallel(ModulePass):
   """
-  This is the entry point for the transformation pass which will then apply the rewriter
+  This is the entry point for the transformation pass which will then apply the rewriter.
+  Loops are only parallelised if they are safe to run in parallel, and the reasons why
+  a loop isn't are reported to stderr unless the remarks option is false. They must also
+  have enough work, where the estimated work (trip count multiplied by the operations
+  per iteration) is at least min_parallel_work. These are set via options in the same way
+  as mlir-opt, e.g. for-to-parallel{min-parallel-work=500 remarks=false}, and a
+  min-parallel-work of zero parallelises every loop that is safe to. With the collapse
+  option perfectly nested loops become one multi-dimensional parallel loop, so loops
+  directly inside a parallel loop are parallelised whatever their amount of work
   """
   name = 'for-to-parallel'
 
+  min_parallel_work: int = 10000
+  remarks: bool = True
+  collapse: bool = False
+
   def apply(self, ctx: MLContext, input_module: ModuleOp):
-    applyRewriter=ApplyForToParallelRewriter()
+    cost_model=ParallelCostModel(self.min_parallel_work)
+    loops=[]
+    input_module.walk(lambda op: loops.append(op) if isinstance(op, scf.For) else None)
+
+    legal_loops={}
+    for loop_number, for_loop in enumerate(loops):
+      legality=analyse_loop(for_loop, matched_operations)
+      if legality.is_parallel():
+        legal_loops[id(for_loop)]=legality
+      elif self.remarks:
+        report_rejection(for_loop, loop_number, legality)
+
+    # When collapsing, loops directly inside a loop that is parallelised are parallelised
+    # too so that they can be collapsed into it
+    nested_loops=set()
+    if self.collapse:
+      for for_loop in loops:
+        parent=for_loop.parent_op()
+        if (id(for_loop) in legal_loops and isinstance(parent, scf.For) and id(parent) in legal_loops and
+                (id(parent) in nested_loops or cost_model.should_parallelise(parent) is not False)):
+          nested_loops.add(id(for_loop))
+
+    # Loops whose bounds are only known at runtime get a sequential and parallel version,
+    # unless they are inside a loop that is parallelised in which case they stay sequential
+    for for_loop in loops:
+      if (id(for_loop) in legal_loops and id(for_loop) not in nested_loops and
+              cost_model.should_parallelise(for_loop) is None):
+        if is_inside_parallel_loop(for_loop, cost_model, legal_loops, nested_loops):
+          del legal_loops[id(for_loop)]
+        else:
+          version_loop(for_loop, cost_model)
+
+    applyRewriter=ApplyForToParallelRewriter(cost_model, legal_loops, nested_loops)
     walker = PatternRewriteWalker(GreedyRewritePatternApplier([applyRewriter]), apply_recursively=False)
     walker.rewrite_module(input_module)
+
+    if self.collapse:
+      walker = PatternRewriteWalker(GreedyRewritePatternApplier([CollapseParallelNestRewriter()]), apply_recursively=True)
+      walker.rewrite_module(input_module)
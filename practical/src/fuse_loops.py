@@ -0,0 +1,216 @@
+from xdsl.dialects.builtin import ModuleOp, IndexType
+from xdsl.ir import Operation, SSAValue, Block, MLContext
+from xdsl.dialects import scf, memref, func
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+from xdsl.passes import ModulePass
+from llvm_func import LLVMCallOp
+from parallel_legality import get_expression_key, is_injective_index
+
+"""
+Fuses adjacent loops that have identical bounds into a single loop, so that each array
+element is loaded and stored while it is still in cache (or a register) rather than in
+separate passes over the arrays, and there is one loop overhead (and for scf.parallel one
+parallel region) instead of several. Two scf.for loops, or two scf.parallel loops with
+the same number of dimensions, are fused where their lower bounds, upper bounds and steps
+compute the same values (compared by the structure of their expressions, as each loop's
+bounds are computed separately in the lowered IR).
+
+Fusion runs the body of the second loop straight after the body of the first in each
+iteration, so it is only safe if no iteration of one loop accesses an array element that
+a different iteration of the other writes. Where an array is written to in either loop
+and accessed in both, every access to it must therefore be to the same element, and for
+each induction variable an index of that element must be an injective affine function of
+it (as checked by for-to-parallel, e.g. a[i] or a[2*i+1] but not a[i/2] or a[i-i]), so
+different iterations access different elements. As with for-to-parallel, arrays passed as
+different arguments are assumed not to overlap. The second loop must also not use the
+results of the first, which are only known once the first loop has finished, and neither
+loop can contain calls, as the order of their side effects (e.g. printing) would change.
+
+Operations between the two loops, such as computing the bounds of the second loop, are
+moved before the first loop if they only do arithmetic on values that are available there,
+otherwise the loops are not fused. The values carried by scf.for loops are concatenated,
+as are the initial values and scf.reduce operations of scf.parallel loops, so the fused
+loop's results are the first loop's followed by the second's. Fusion is repeated until
+no more loops can be fused, so a sequence of loops becomes one loop and loops nested in
+fused loops are then fused themselves.
+"""
+
+def get_bounds(loop: Operation) -> List[SSAValue]:
+    if isinstance(loop, scf.For):
+        return [loop.lb, loop.ub, loop.step]
+    return list(loop.lowerBound)+list(loop.upperBound)+list(loop.step)
+
+def get_induction_vars(loop: Operation) -> List[SSAValue]:
+    body_args=loop.body.blocks[0].args
+    return [body_args[0]] if isinstance(loop, scf.For) else list(body_args)
+
+def is_same_kind(first: Operation, second: Operation) -> bool:
+    if isinstance(first, scf.For) and isinstance(second, scf.For):
+        return True
+    return (isinstance(first, scf.ParallelOp) and isinstance(second, scf.ParallelOp) and
+            len(first.lowerBound) == len(second.lowerBound))
+
+def has_same_bounds(first: Operation, second: Operation) -> bool:
+    return all(get_expression_key(a) == get_expression_key(b) for a, b in zip(get_bounds(first), get_bounds(second)))
+
+def find_movable_ops(first: Operation, second: Operation) -> Optional[List[Operation]]:
+    """
+    The operations between the two loops, or None if any of these can't be moved before the
+    first loop, which is the case for anything other than arithmetic and for operations that
+    use the results of the first loop
+    """
+    between=[]
+    op=first.next_op
+    while op is not None and op is not second:
+        if not op.name.startswith("arith.") or len(op.regions) > 0:
+            return None
+        if any(operand in first.results for operand in op.operands):
+            return None
+        between.append(op)
+        op=op.next_op
+    return between if op is second else None
+
+def collect_accesses(loop: Operation, aliases: Dict[int, tuple], accesses: Dict[int, list], stored_arrays: set) -> bool:
+    """
+    Records the index key of each load and store in the loop, along with the loop and the
+    operation, by the id of its array, returning False if the loop contains a call
+    """
+    contains_call=[]
+    def record_access(op: Operation):
+        if isinstance(op, func.Call) or isinstance(op, LLVMCallOp):
+            contains_call.append(op)
+        if isinstance(op, memref.Load) or isinstance(op, memref.Store):
+            key=tuple(get_expression_key(index, aliases) for index in op.indices)
+            accesses.setdefault(id(op.memref), []).append((loop, key, op))
+            if isinstance(op, memref.Store):
+                stored_arrays.add(id(op.memref))
+    for op in loop.body.blocks[0].ops:
+        op.walk(record_access)
+    return len(contains_call) == 0
+
+def can_fuse(first: Operation, second: Operation) -> bool:
+    if not is_same_kind(first, second) or not has_same_bounds(first, second):
+        return False
+
+    # The second loop must not use the results of the first, directly or from inside its body
+    uses_first=[]
+    def check_uses(op: Operation):
+        if any(operand in first.results for operand in op.operands):
+            uses_first.append(op)
+    second.walk(check_uses)
+    if uses_first:
+        return False
+
+    # Each loop's induction variables have the same key in the index expressions, so
+    # accesses to the same element in an iteration of the fused loop compare equal
+    aliases={}
+    for loop in [first, second]:
+        for dim, induction_var in enumerate(get_induction_vars(loop)):
+            aliases[id(induction_var)]=("induction", dim)
+    accesses={}
+    stored_arrays=set()
+    if not collect_accesses(first, aliases, accesses, stored_arrays) or not collect_accesses(second, aliases, accesses, stored_arrays):
+        return False
+    for array_id in stored_arrays:
+        loops_accessing=set(loop for loop, _, _ in accesses[array_id])
+        if len(loops_accessing) < 2:
+            continue
+        keys=set(key for _, key, _ in accesses[array_id])
+        if len(keys) > 1:
+            return False
+        # Every access is to the same element, so the indices of any one of them show
+        # whether different iterations access different elements
+        loop, _, op=accesses[array_id][0]
+        if not all(any(is_injective_index(index, induction_var, loop) for index in op.indices)
+                   for induction_var in get_induction_vars(loop)):
+            return False
+    return True
+
+def fuse_for_loops(first: scf.For, second: scf.For) -> scf.For:
+    first_body=first.body.blocks[0]
+    second_body=second.body.blocks[0]
+    body=Block(arg_types=[IndexType()]+[arg.typ for arg in first.iter_args]+[arg.typ for arg in second.iter_args])
+    num_first_args=len(first.iter_args)
+    for old_arg, new_arg in zip(first_body.args, [body.args[0]]+list(body.args[1:1+num_first_args])):
+        old_arg.replace_by(new_arg)
+    for old_arg, new_arg in zip(second_body.args, [body.args[0]]+list(body.args[1+num_first_args:])):
+        old_arg.replace_by(new_arg)
+
+    yielded=[]
+    for loop_body in [first_body, second_body]:
+        for op in list(loop_body.ops):
+            op.detach()
+            if isinstance(op, scf.Yield):
+                yielded+=list(op.operands)
+                op.erase()
+            else:
+                body.add_op(op)
+    body.add_op(scf.Yield.get(*yielded))
+    return scf.For.get(first.lb, first.ub, first.step, list(first.iter_args)+list(second.iter_args), body)
+
+def fuse_parallel_loops(first: scf.ParallelOp, second: scf.ParallelOp) -> scf.ParallelOp:
+    body=Block(arg_types=[IndexType()]*len(first.lowerBound))
+    # The reductions are placed at the end of the body, in order, as the nth reduction
+    # provides the nth result of the loop
+    reductions=[]
+    for loop in [first, second]:
+        loop_body=loop.body.blocks[0]
+        for old_arg, new_arg in zip(loop_body.args, body.args):
+            old_arg.replace_by(new_arg)
+        for op in list(loop_body.ops):
+            op.detach()
+            if isinstance(op, scf.Yield):
+                op.erase()
+            elif isinstance(op, scf.ReduceOp):
+                reductions.append(op)
+            else:
+                body.add_op(op)
+    body.add_ops(reductions+[scf.Yield.get()])
+    return scf.ParallelOp.get(list(first.lowerBound), list(first.upperBound), list(first.step),
+                              [body], list(first.initVals)+list(second.initVals))
+
+def fuse(first: Operation, second: Operation, between: List[Operation]):
+    parent_block=first.parent_block()
+    for op in between:
+        op.detach()
+    parent_block.insert_ops_before(between, first)
+    if isinstance(first, scf.For):
+        fused=fuse_for_loops(first, second)
+    else:
+        fused=fuse_parallel_loops(first, second)
+    parent_block.insert_op_before(fused, first)
+    for old_result, new_result in zip(list(first.results)+list(second.results), fused.results):
+        old_result.replace_by(new_result)
+    parent_block.erase_op(first)
+    parent_block.erase_op(second)
+
+def fuse_next_pair(input_module: ModuleOp) -> bool:
+    """
+    Fuses the first pair of loops that can be fused, returning whether there was one
+    """
+    loops=[]
+    input_module.walk(lambda op: loops.append(op) if isinstance(op, scf.For) or isinstance(op, scf.ParallelOp) else None)
+    for loop in loops:
+        second=loop.next_op
+        while second is not None and not (isinstance(second, scf.For) or isinstance(second, scf.ParallelOp)):
+            second=second.next_op
+        if second is None:
+            continue
+        between=find_movable_ops(loop, second)
+        if between is not None and can_fuse(loop, second):
+            fuse(loop, second, between)
+            return True
+    return False
+
+@dataclass
+class FuseLoops(ModulePass):
+  """
+  This is the entry point for the transformation pass. Run this before for-to-parallel so
+  that the fused loop is parallelised as a whole, or after it to fuse parallel loops
+  """
+  name = 'fuse-loops'
+
+  def apply(self, ctx: MLContext, input_module: ModuleOp):
+    while fuse_next_pair(input_module):
+      pass
@@ -0,0 +1,329 @@
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import Dict, List, Optional
+from xdsl.dialects import scf, arith, memref, func
+from xdsl.dialects.builtin import IntegerAttr, FloatAttr
+from xdsl.ir import Operation, SSAValue, BlockArgument, OpResult
+from llvm_func import LLVMCallOp
+from tiny_py_to_standard import get_type_width
+
+"""
+Legality analysis for converting an scf.for loop into an scf.parallel loop. The
+iterations of a parallel loop can run in any order and at the same time, so this is
+only safe if no iteration depends upon a value computed by another. Loop carried values
+(the block arguments of the loop body after the induction variable, along with the
+values that the body yields for them) are each classified as:
+
+* A reduction, where the value is only updated by combining it with values computed
+  by the iteration using an associative operation (e.g. v=v+a[i]*b[i]). This is what
+  scf.reduce provides. The update can be a chain of the same operation (v=v+a[i]+b[i]),
+  subtraction of values from it (v=v-a[i]) and conversions of the value to and from a
+  wider type, which is how tiny_py combines values of different types. Converting back
+  to the narrower type rounds the value in every iteration, so this is only allowed where
+  the rounding does not depend on the order the values are combined in: integer sums,
+  products and bitwise operations wrap around the same either way, and rounding a float
+  keeps its order so float min and max are unaffected. Other narrowed reductions, such
+  as a float sum converted back to f32 each iteration, are rejected.
+* Private, where the value is overwritten by every iteration before it is read, so
+  each iteration can have its own copy. This is only safe if the value from the last
+  iteration is not used after the loop (or only by an enclosing loop which itself
+  does not use the value).
+* A true dependence, where an iteration reads the value written by the previous one.
+  These loops can not be parallelised.
+
+Where a loop carried value is passed through an inner loop, it is classified by how the
+inner loop uses it. If the inner loop reduces it then so does the outer loop, as each
+iteration of the outer loop can reduce into its own partial value (which starts from the
+identity of the reduction) and then combine this with the outer loop's value.
+
+Accesses to arrays are also checked, if an array is written to in the loop then every
+access to that array must be to the same element in an iteration and one of the indices
+of that element must be an injective affine function of the induction variable, so
+different iterations access different elements. This is the induction variable itself
+(a[i]), plus or minus a loop invariant value (a[i+n], a[n-i]) or multiplied by a nonzero
+constant (a[2*i]), and combinations of these. Other indices that depend upon the induction
+variable, such as a[i/2], a[i-i] or a[i*0], can map different iterations to the
+same element so the loop is rejected, as it is for any index the analysis can't classify.
+We assume, as Fortran does, that arrays passed as different arguments do not overlap.
+Calls are rejected as they might have side effects, e.g. printing, whose order matters.
+"""
+
+# Conversions that can appear in the update of a reduction, these widen or narrow
+# the value but do not change which operation combines it with other values
+reduction_casts=["arith.extf", "arith.truncf", "arith.index_cast"]
+# Reductions that give the same result when the value is narrowed in every iteration as
+# when the narrowed values are combined instead
+narrowing_exact_reductions=["arith.addi", "arith.muli", "arith.andi", "arith.ori", "arith.xori",
+                            "arith.maxf", "arith.minf"]
+# Subtracting from a value is a sum of the negated values that are subtracted
+subtraction_reductions={"arith.subf": "arith.addf", "arith.subi": "arith.addi"}
+# The identity of each reduction, this is required for a reduction through an inner loop
+# so that the partial value of the inner loop can start from it
+reduction_identities={"arith.addf": 0.0, "arith.addi": 0, "arith.mulf": 1.0, "arith.muli": 1,
+                      "arith.andi": -1, "arith.ori": 0, "arith.xori": 0, "arith.maxui": 0, "arith.minui": -1}
+
+class IterArgKind(Enum):
+    REDUCTION = "reduction"
+    PRIVATE = "private"
+    DEPENDENCE = "dependence"
+
+@dataclass
+class IterArgClassification:
+    kind: IterArgKind
+    # For reductions, the name of the operation that combines the value along with the
+    # chain of operations, in order, that updates it in an iteration
+    reduction_kind: str = ""
+    chain: List[Operation] = field(default_factory=list)
+    # Why the value is a dependence, for reporting
+    reason: str = ""
+
+@dataclass
+class LoopLegality:
+    """
+    The result of analysing a loop, the classification of each loop carried value and
+    the reasons why it can't be parallelised (this is empty if it can be)
+    """
+    iter_args: List[IterArgClassification] = field(default_factory=list)
+    rejections: List[str] = field(default_factory=list)
+
+    def is_parallel(self) -> bool:
+        return len(self.rejections) == 0
+
+def describe_value(value: SSAValue) -> str:
+    """
+    A description of a value for reporting, values have no names in the lowered IR so
+    arguments are described by their position
+    """
+    if isinstance(value, BlockArgument) and isinstance(value.block.parent_op(), func.FuncOp):
+        return f"argument {value.index} of `{value.block.parent_op().sym_name.data}'"
+    return f"value of type {value.typ}"
+
+def get_expression_key(value: SSAValue, aliases: Optional[Dict[int, tuple]] = None):
+    """
+    A key for the expression that computes a value, where two values have the same key
+    they are certain to hold the same value in an iteration. Each index expression in the
+    lowered IR is computed separately, so this compares their structure rather than
+    their SSA values, looking through casts of the index. Aliases give the key of values
+    (by id) that are known to be equal, e.g. the induction variables of two loops
+    """
+    if aliases is not None and id(value) in aliases:
+        return aliases[id(value)]
+    if isinstance(value, OpResult):
+        op=value.op
+        if isinstance(op, arith.IndexCastOp):
+            return get_expression_key(op.input, aliases)
+        if isinstance(op, arith.Constant):
+            if isinstance(op.value, IntegerAttr) or isinstance(op.value, FloatAttr):
+                return ("constant", op.value.value.data)
+        if op.name.startswith("arith.") and len(op.regions) == 0:
+            return (op.name, tuple(get_expression_key(operand, aliases) for operand in op.operands))
+    return ("value", id(value))
+
+def is_inside(op: Optional[Operation], loop: Operation) -> bool:
+    while op is not None:
+        if op is loop:
+            return True
+        op=op.parent_op()
+    return False
+
+def is_loop_invariant(value: SSAValue, loop: Operation) -> bool:
+    """
+    Whether the value is the same in every iteration of the loop, which is the case where
+    it is defined outside of the loop or is only arithmetic on such values and constants
+    """
+    if isinstance(value, BlockArgument):
+        return not is_inside(value.block.parent_op(), loop)
+    if not is_inside(value.op, loop):
+        return True
+    return (value.op.name.startswith("arith.") and len(value.op.regions) == 0 and
+            all(is_loop_invariant(operand, loop) for operand in value.op.operands))
+
+def get_constant_value(value: SSAValue) -> Optional[int]:
+    if isinstance(value, OpResult) and isinstance(value.op, arith.IndexCastOp):
+        return get_constant_value(value.op.input)
+    if isinstance(value, OpResult) and isinstance(value.op, arith.Constant) and isinstance(value.op.value, IntegerAttr):
+        return value.op.value.value.data
+    return None
+
+def is_injective_index(index: SSAValue, induction_var: SSAValue, loop: Operation) -> bool:
+    """
+    Whether the index is an injective affine function of the induction variable, so that
+    different iterations of the loop access different elements. This is the induction
+    variable itself, or such an index plus or minus a loop invariant value, or multiplied
+    by a nonzero constant. Anything else, for instance i/2, i-i or i*0, might map
+    different iterations to the same element so is rejected
+    """
+    if index is induction_var:
+        return True
+    if not isinstance(index, OpResult):
+        return False
+    op=index.op
+    if isinstance(op, arith.IndexCastOp):
+        return is_injective_index(op.input, induction_var, loop)
+    if op.name in ["arith.addi", "arith.subi", "arith.muli"]:
+        lhs, rhs=op.operands
+        for varying, other in [(lhs, rhs), (rhs, lhs)]:
+            if op.name == "arith.muli":
+                other_is_valid=get_constant_value(other) not in [None, 0]
+            else:
+                other_is_valid=is_loop_invariant(other, loop)
+            if other_is_valid and is_injective_index(varying, induction_var, loop):
+                return True
+    return False
+
+def classify_iter_arg(for_loop: scf.For, idx: int, reduction_ops: Dict[str, type]) -> IterArgClassification:
+    body=for_loop.body.blocks[0]
+    block_arg=body.args[idx+1]
+    uses=list(block_arg.uses)
+
+    if len(uses) == 0:
+        # Never read so each iteration computes its own value, but only the value from
+        # the last iteration would be correct after the loop
+        if is_result_unused(for_loop, idx):
+            return IterArgClassification(IterArgKind.PRIVATE)
+        return IterArgClassification(IterArgKind.DEPENDENCE,
+                                     reason="is used after the loop, so needs the value of the last iteration")
+
+    classification=match_reduction_chain(body, block_arg, idx, reduction_ops)
+    if classification is None:
+        classification=match_inner_loop(body, block_arg, idx, reduction_ops)
+    if classification is not None:
+        return classification
+    return IterArgClassification(IterArgKind.DEPENDENCE,
+                                 reason="is read from the previous iteration and is not a recognised reduction")
+
+def is_result_unused(for_loop: scf.For, idx: int) -> bool:
+    """
+    Whether a result of the loop is unused, this includes where it is only yielded by an
+    enclosing loop that passed the value into this loop and itself doesn't use the result
+    """
+    uses=list(for_loop.results[idx].uses)
+    if len(uses) == 0:
+        return True
+    parent=for_loop.parent_op()
+    if len(uses) == 1 and isinstance(parent, scf.For) and uses[0].operation is parent.body.blocks[0].ops.last:
+        parent_idx=uses[0].index
+        parent_arg=parent.body.blocks[0].args[parent_idx+1]
+        if all(use.operation is for_loop for use in parent_arg.uses):
+            return is_result_unused(parent, parent_idx)
+    return False
+
+def match_inner_loop(body, block_arg: BlockArgument, idx: int,
+                     reduction_ops: Dict[str, type]) -> Optional[IterArgClassification]:
+    """
+    Matches a value that is passed into an inner loop, and the result of that yielded, in
+    which case it is classified by the inner loop. Reductions through the inner loop have a
+    chain of just the inner loop
+    """
+    uses=list(block_arg.uses)
+    if len(uses) != 1:
+        return None
+    inner_loop=uses[0].operation
+    if not isinstance(inner_loop, scf.For) or inner_loop.parent_block() is not body:
+        return None
+    # The first three operands are the bounds and step, the rest are the initial values
+    inner_idx=uses[0].index-3
+    inner_uses=list(inner_loop.results[inner_idx].uses)
+    if inner_idx < 0 or len(inner_uses) != 1 or inner_uses[0].operation is not body.ops.last or inner_uses[0].index != idx:
+        return None
+    inner_classification=classify_iter_arg(inner_loop, inner_idx, reduction_ops)
+    if inner_classification.kind == IterArgKind.PRIVATE:
+        return inner_classification
+    if (inner_classification.kind == IterArgKind.REDUCTION and
+            inner_classification.reduction_kind in reduction_identities):
+        return IterArgClassification(IterArgKind.REDUCTION, inner_classification.reduction_kind, [inner_loop])
+    return None
+
+def is_narrowing(op: Operation) -> bool:
+    return get_type_width(op.results[0].typ) < get_type_width(op.operands[0].typ)
+
+def match_reduction_chain(body, block_arg: BlockArgument, idx: int,
+                          reduction_ops: Dict[str, type]) -> Optional[IterArgClassification]:
+    """
+    Follows the value from the block argument to the yield, where it must only be used once
+    at each step, by either a conversion or by the combining operation. All combining
+    operations in the chain must be the same kind of reduction
+    """
+    current=block_arg
+    chain=[]
+    reduction_kind=None
+    narrowed=False
+    while True:
+        uses=list(current.uses)
+        if len(uses) != 1:
+            return None
+        user=uses[0].operation
+        if user is body.ops.last:
+            # Reached the yield, which must be for this loop carried value
+            if reduction_kind is None or uses[0].index != idx:
+                return None
+            if narrowed and reduction_kind not in narrowing_exact_reductions:
+                return IterArgClassification(IterArgKind.DEPENDENCE,
+                                             reason="is rounded to a narrower type in every iteration, so "
+                                                    "reducing it in a different order would change the result")
+            return IterArgClassification(IterArgKind.REDUCTION, reduction_kind, chain)
+        if user.parent_block() is not body:
+            return None
+        if user.name in reduction_casts:
+            narrowed=narrowed or is_narrowing(user)
+        elif user.name in reduction_ops or user.name in subtraction_reductions:
+            kind=subtraction_reductions.get(user.name, user.name)
+            if reduction_kind is not None and kind != reduction_kind:
+                return None
+            # Only a value subtracted from is a reduction, not one that is subtracted
+            if user.name in subtraction_reductions and user.operands[0] is not current:
+                return None
+            reduction_kind=kind
+        else:
+            return None
+        chain.append(user)
+        current=user.results[0]
+
+def check_array_accesses(for_loop: scf.For) -> List[str]:
+    """
+    Checks that iterations never access an element of an array that another iteration writes
+    """
+    induction_var=for_loop.body.blocks[0].args[0]
+    # The loads and stores of each array, by the id of the array's SSA value
+    accesses={}
+    stored_arrays={}
+    def record_access(op: Operation):
+        if isinstance(op, memref.Load) or isinstance(op, memref.Store):
+            accesses.setdefault(id(op.memref), []).append(op)
+            if isinstance(op, memref.Store):
+                stored_arrays[id(op.memref)]=op.memref
+    for op in for_loop.body.blocks[0].ops:
+        op.walk(record_access)
+
+    rejections=[]
+    for array_id, array in stored_arrays.items():
+        keys=[tuple(get_expression_key(index) for index in op.indices) for op in accesses[array_id]]
+        if any(key != keys[0] for key in keys):
+            rejections.append(f"{describe_value(array)} is written to and accessed at different "
+                              "elements in an iteration, so iterations may conflict")
+        elif not any(is_injective_index(index, induction_var, for_loop) for index in accesses[array_id][0].indices):
+            rejections.append(f"iterations might write to the same element of {describe_value(array)}, as "
+                              "no index is an injective affine function of the induction variable")
+    return rejections
+
+def analyse_loop(for_loop: scf.For, reduction_ops: Dict[str, type]) -> LoopLegality:
+    """
+    Determines whether the loop can be parallelised, reduction_ops are the operations
+    (by name) that can be used as reductions
+    """
+    legality=LoopLegality()
+    for idx in range(len(for_loop.iter_args)):
+        classification=classify_iter_arg(for_loop, idx, reduction_ops)
+        legality.iter_args.append(classification)
+        if classification.kind == IterArgKind.DEPENDENCE:
+            legality.rejections.append(f"loop carried value {idx} of type {for_loop.iter_args[idx].typ} "
+                                       f"{classification.reason}")
+
+    legality.rejections+=check_array_accesses(for_loop)
+
+    def check_call(op: Operation):
+        if isinstance(op, func.Call) or isinstance(op, LLVMCallOp):
+            legality.rejections.append(f"calls `{op.callee.root_reference.data}', which might have side effects")
+    for op in for_loop.body.blocks[0].ops:
+        op.walk(check_call)
+    return legality
@@ -0,0 +1,54 @@
+from xdsl.dialects.builtin import ModuleOp
+from xdsl.ir import MLContext
+from xdsl.dialects import func, arith
+from dataclasses import dataclass
+from xdsl.passes import ModulePass
+from tiny_py_to_standard import get_constant_key
+
+"""
+The lowering from tiny_py only reuses a constant in the scope that it is first created in,
+e.g. a literal in a loop body is created again in the next loop, and creates a step of one
+for every loop, so the same constant is often defined many times and inside loop bodies. This pass keeps one arith.constant for each distinct value and type in
+a function, placed at the entry of the function in the order that they first appear, and
+replaces the uses of the others with it. As constants have no side effects this is always
+safe, and it reduces the amount of IR that every later pass (and mlir-opt) works through.
+
+Floating point constants are compared by their bits, so 0.0 and -0.0 are kept separate.
+"""
+
+def pool_function_constants(function: func.FuncOp):
+    entry_block=function.body.blocks[0]
+    constants=[]
+    function.walk(lambda op: constants.append(op) if isinstance(op, arith.Constant) else None)
+
+    pooled={}
+    hoisted=[]
+    for op in constants:
+        key=get_constant_key(op.value)
+        if key is None:
+            continue
+        if key in pooled:
+            op.results[0].replace_by(pooled[key].results[0])
+            op.parent_block().erase_op(op)
+        else:
+            pooled[key]=op
+            op.detach()
+            hoisted.append(op)
+    if hoisted:
+        if entry_block.ops.first is None:
+            entry_block.add_ops(hoisted)
+        else:
+            entry_block.insert_ops_before(hoisted, entry_block.ops.first)
+
+@dataclass
+class PoolConstants(ModulePass):
+  """
+  This is the entry point for the transformation pass, which runs on the standard dialects
+  and so comes after tiny-py-to-standard
+  """
+  name = 'pool-constants'
+
+  def apply(self, ctx: MLContext, input_module: ModuleOp):
+    for op in input_module.ops:
+      if isinstance(op, func.FuncOp) and len(op.body.blocks) > 0:
+        pool_function_constants(op)
@@ -1,7 +1,8 @@
-import ast, inspect
-import tiny_py
-from xdsl.printer import Printer
-from xdsl.dialects.builtin import ModuleOp
+import ast, inspect, ctypes, json, functools, os
+from util.compile_cache import CompileCache, hash_key, hash_files
+from util import toolchain, native_kernel
+from util.pass_options import parse_pipeline, split_pipeline
+from util.lazy_import import lazy_import, get_module_file
 import sys
 
 """
@@ -10,34 +11,352 @@ function and generate an IR based on our tiny_py dialect. We use the Python
 ast library to do the parsing which keeps this simple. Note that there are
 other MLIR/xDSL Python parsers which are more complete, such as the xDSL
 frontend and pyMLIR
+
+The IR can also be generated in the SSA form of tiny_py (see tiny_py_ssa), which handles
+the very large expressions of generated code, by the SSAAnalyzer. This is selected by
+ssa_form, either as an argument of the decorator or of compile_module
 """
 
-def python_compile(func):
+compile_cache=CompileCache()
+
+# These are only imported when IR is generated, so that scripts which find their IR (or
+# compiled kernels) in the cache do not pay for importing xDSL and our dialects on start up
+tiny_py=lazy_import("tiny_py")
+tiny_py_ssa=lazy_import("tiny_py_ssa")
+builtin=lazy_import("xdsl.dialects.builtin")
+memref=lazy_import("xdsl.dialects.memref")
+
+# Types that arguments and return values can be annotated with, the explicitly sized
+# types follow the NumPy names (e.g. np.float64) so they match the dtype of arrays. Each is
+# the name of the type in the builtin dialect
+python_type_mapping={"int": "i32", "float": "f32", "int32": "i32", "int64": "i64",
+                     "float32": "f32", "float64": "f64"}
+
+class Array:
+    """
+    Type annotation for array arguments, for instance Array[np.float64, 2] is a two
+    dimensional array of doubles (the rank is one if it is omitted). When calling a
+    compiled kernel these are passed as NumPy arrays of that dtype without copying
+    """
+    def __class_getitem__(cls, params):
+        return cls
+
+_compiler_version=None
+_lowering_version=None
+
+def get_compiler_version():
+    """
+    The version that cached IR is keyed upon, this is a hash of the source of our
+    Python parser and the tiny_py dialects, so changing either of these (for instance
+    when completing the exercises) means that we don't pick up stale IR from the cache
+    """
+    global _compiler_version
+    if _compiler_version is None:
+        _compiler_version=hash_files([__file__, get_module_file("tiny_py"), get_module_file("tiny_py_ssa")])
+    return _compiler_version
+
+def get_lowering_version():
+    """
+    Similarly to the compiler version, compiled kernels also depend upon the source of
+    the transformations that lower tiny_py to the standard dialects, and of everything
+    these use such as the legality analysis, our other dialects and the toolchain driver.
+    This hashes all of the source in src, along with the modules of the passes as these are
+    looked up separately and might be elsewhere on the path (e.g. the sample solutions)
+    """
+    global _lowering_version
+    if _lowering_version is None:
+        src_dir=os.path.dirname(os.path.dirname(get_module_file("util.toolchain")))
+        files=set(os.path.realpath(path) for path in get_lowering_passes().get_module_files())
+        for directory, _, names in os.walk(src_dir):
+            files.update(os.path.realpath(os.path.join(directory, name)) for name in names if name.endswith(".py"))
+        _lowering_version=hash_key(get_compiler_version(), hash_files(sorted(files)))
+    return _lowering_version
+
+def get_lowering_passes():
+    """
+    The tinypy-opt transformations that can be used when compiling a kernel, these are
+    only imported when they are needed as most runs just generate the IR, and then only
+    those that are looked up
+    """
+    from util.lazy_registry import get_tinypy_passes
+    return get_tinypy_passes()
+
+def python_compile(func=None, *, jit=False, preset="sequential", passes="", ssa_form=False):
     """
     This is our decorator which will undertake the parsing and output the
-    xDSL format IR in our tiny_py dialect
-    """
-    def compile_wrapper():
-        a=ast.parse(inspect.getsource(func))
-        analyzer = Analyzer()
-        tiny_py_ir=analyzer.visit(a)
-        # This next line wraps our IR in the built in Module operation, this
-        # is required to comply with the MLIR standard (the top level must be
-        # a built in module).
-        tiny_py_ir=ModuleOp([tiny_py_ir])
-
-        # Now we use the xDSL printer to output our built IR to stdio
-        printer = Printer(stream=sys.stdout)
-        printer.print_op(tiny_py_ir)
+    xDSL format IR in our tiny_py dialect. The generated IR is held in an on-disk
+    cache keyed on the source of the function, so calling the function again (or
+    in another run) when its source has not changed skips parsing and building the IR.
+
+    If jit is set, for instance via @python_compile(jit=True), then instead the
+    function is compiled to native code using the named toolchain preset and executed.
+    Additional tinypy-opt passes, with their options, can be run after those of the preset
+    via passes, e.g. passes="tile-loops{tile-sizes=64,64}", which lets a driver try
+    different options for the same kernel. If ssa_form is set then the IR is generated in
+    the SSA form of tiny_py
+    """
+    if func is None:
+        # Decorator has been provided with arguments, so return the actual decorator
+        return lambda f: python_compile(f, jit=jit, preset=preset, passes=passes, ssa_form=ssa_form)
+    if jit:
+        return jit_compile(func, preset, passes, ssa_form)
+
+    source=None
+
+    @functools.wraps(func)
+    def compile_wrapper(*args, **kwargs):
+        # The arguments are ignored as the function is compiled rather than run, they are
+        # accepted so that the same kernel can be called with or without jit
+        nonlocal source
+        if source is None:
+            source=inspect.getsource(func)
+
+        cache_key=hash_key(source, get_compiler_version(), get_form_name(ssa_form))
+        ir_text=compile_cache.read_text(cache_key, ".mlir")
+        if ir_text is None:
+            ir_text=print_ir(generate_ir(source, ssa_form))
+            compile_cache.insert(cache_key, ".mlir", ir_text)
+
+        # Now we output our built IR to stdio
+        sys.stdout.write(ir_text)
         print("") # Gives us a new line
 
         f = open("output.mlir", "w")
-        printer_file = Printer(stream=f)
-        printer_file.print_op(tiny_py_ir)
+        f.write(ir_text)
         f.write("") # Terminates file on new line
         f.close()
+    compile_wrapper.python_compiled=True
     return compile_wrapper
 
+def jit_compile(func, preset_name, extra_passes="", ssa_form=False):
+    """
+    Returns a callable that on first call compiles the function down to a shared object
+    (which is held in the cache so only needs building once per version of the source)
+    and then executes this in-process via ctypes, subsequent calls go straight to the
+    native code
+    """
+    kernel=None
+
+    @functools.wraps(func)
+    def jit_wrapper(*args):
+        nonlocal kernel
+        if kernel is None:
+            kernel=load_kernel(inspect.getsource(func), preset_name, extra_passes, ssa_form)
+        return kernel(*args)
+    jit_wrapper.python_compiled=True
+    return jit_wrapper
+
+def load_kernel(source, preset_name, extra_passes="", ssa_form=False):
+    """
+    Loads the native kernel for the source, building it first if it is not in the cache
+    """
+    preset=toolchain.get_preset(preset_name)
+    pipeline=",".join(preset.tinypy_passes+split_pipeline(extra_passes))
+    cache_key=hash_key(source, get_lowering_version(), preset_name, pipeline, " ".join(preset.mlir_pipeline),
+                       " ".join(preset.clang_flags), get_form_name(ssa_form))
+    so_path=compile_cache.lookup(cache_key, ".so")
+    # The signature of the kernel is held alongside the shared object, so that we
+    # know how to call it without having to parse the source again
+    signature=compile_cache.read_text(cache_key, ".json")
+    if so_path is None or signature is None:
+        from xdsl.ir import MLContext
+        tiny_py_ir=generate_ir(source, ssa_form)
+        ctx=MLContext()
+        for lowering_pass in parse_pipeline(pipeline, get_lowering_passes()):
+            lowering_pass.apply(ctx, tiny_py_ir)
+        signature=json.dumps(native_kernel.get_kernel_signature(tiny_py_ir))
+        shared_object=toolchain.build_shared_object(print_ir(tiny_py_ir), preset)
+        so_path=compile_cache.insert(cache_key, ".so", shared_object)
+        compile_cache.insert(cache_key, ".json", signature)
+        if so_path is None:
+            # Too large to cache, so it is loaded from a scratch file that is removed once
+            # loaded (the loaded library stays mapped in after its file is removed)
+            return native_kernel.bind_kernel(load_scratch_library(shared_object), json.loads(signature))
+
+    return native_kernel.bind_kernel(ctypes.CDLL(so_path), json.loads(signature))
+
+def load_scratch_library(shared_object):
+    import tempfile
+    fd, scratch_path=tempfile.mkstemp(prefix="tinypy-", suffix=".so")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(shared_object)
+        return ctypes.CDLL(scratch_path)
+    finally:
+        os.remove(scratch_path)
+
+def compile_module(functions, output_file="output.mlir", lower=True, max_workers=None, ssa_form=False):
+    """
+    Compiles many functions into a single IR module, with one function in the IR for each
+    which is named after the Python function. The functions are either a Python module, in
+    which case all the functions defined in it that are decorated with python_compile are
+    compiled, or a list of decorated functions. Each function is parsed (and lowered to the
+    standard dialects if lower is set) by a pool of processes, and the results are merged
+    into one module which is written to the output file and returned as text. When lowering,
+    constants are also folded beforehand and pooled afterwards. If ssa_form is set then the
+    functions are parsed into the SSA form of tiny_py, which is needed for functions with
+    very large expressions
+    """
+    if inspect.ismodule(functions):
+        functions=[fn for _, fn in inspect.getmembers(functions) if getattr(fn, "python_compiled", False)
+                    and fn.__module__ == functions.__name__]
+
+    names=set()
+    for fn in functions:
+        if fn.__name__ in names:
+            raise Exception(f"More than one function is named `{fn.__name__}'")
+        names.add(fn.__name__)
+
+    sources=[inspect.getsource(getattr(fn, "__wrapped__", fn)) for fn in functions]
+    if len(sources) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            ir_texts=list(pool.map(compile_function, sources, [lower]*len(sources), [ssa_form]*len(sources)))
+    else:
+        ir_texts=[compile_function(source, lower, ssa_form) for source in sources]
+
+    ir_text=print_ir(merge_modules(ir_texts))
+    if output_file is not None:
+        with open(output_file, "w") as f:
+            f.write(ir_text)
+    return ir_text
+
+def compile_function(source, lower, ssa_form=False):
+    """
+    Generates the IR for a single function, which is run by each process in the pool,
+    and returns it as text. This uses the same cache as the decorator
+    """
+    if lower:
+        cache_key=hash_key(source, get_lowering_version(), "fold-constants,tiny-py-to-standard,pool-constants",
+                           get_form_name(ssa_form))
+    else:
+        cache_key=hash_key(source, get_compiler_version(), get_form_name(ssa_form))
+    ir_text=compile_cache.read_text(cache_key, ".mlir")
+    if ir_text is None:
+        tiny_py_ir=generate_ir(source, ssa_form)
+        if lower:
+            # We don't want the function to be named main, as there are many of them
+            from xdsl.ir import MLContext
+            lowering_passes=get_lowering_passes()
+            lowering_passes["fold-constants"]().apply(MLContext(), tiny_py_ir)
+            lowering_passes["tiny-py-to-standard"](entry_point=False).apply(MLContext(), tiny_py_ir)
+            lowering_passes["pool-constants"]().apply(MLContext(), tiny_py_ir)
+        ir_text=print_ir(tiny_py_ir)
+        compile_cache.insert(cache_key, ".mlir", ir_text)
+    return ir_text
+
+def merge_modules(ir_texts):
+    """
+    Merges the IR of each function into one module. For tiny_py the functions are
+    combined into one tiny_py module, and for the standard dialects the declarations
+    that functions share (e.g. of printf) only appear once. Globals with the same name
+    but different values are renamed, and the references to them updated
+    """
+    from xdsl.dialects import llvm, func
+    from xdsl.dialects.builtin import ModuleOp, StringAttr, SymbolRefAttr
+    from xdsl.parser import Parser
+    from tiny_py_to_standard import variadic_functions, get_variadic_declaration, convert_to_variadic_call
+    ctx=get_parse_context()
+    tiny_py_functions=[]
+    merged_ops=[]
+    symbols={}
+    # Variadic functions (e.g. printf) that are declared differently by functions
+    # because they are called with different argument types
+    variadic_clashes=set()
+    for ir_text in ir_texts:
+        module=Parser(ctx, ir_text).parse_module()
+        renames={}
+        module_ops=[]
+        for op in list(module.ops):
+            op.detach()
+            if isinstance(op, tiny_py.Module):
+                for fn in list(op.children.blocks[0].ops):
+                    fn.detach()
+                    tiny_py_functions.append(fn)
+                continue
+            sym_name=op.attributes["sym_name"].data
+            if sym_name in symbols:
+                if print_ir(op) == print_ir(symbols[sym_name]):
+                    continue
+                if sym_name in variadic_functions:
+                    variadic_clashes.add(sym_name)
+                    continue
+                if not isinstance(op, llvm.GlobalOp):
+                    raise Exception(f"Symbol `{sym_name}' is defined differently by more than one function")
+                new_name=sym_name
+                while new_name in symbols:
+                    new_name+="_"+str(len(symbols))
+                renames[sym_name]=new_name
+                op.attributes["sym_name"]=StringAttr(new_name)
+                sym_name=new_name
+            symbols[sym_name]=op
+            module_ops.append(op)
+
+        def rename_global_reference(nested_op):
+            if isinstance(nested_op, llvm.AddressOfOp) and nested_op.global_name.root_reference.data in renames:
+                nested_op.attributes["global_name"]=SymbolRefAttr(renames[nested_op.global_name.root_reference.data])
+        for op in module_ops:
+            op.walk(rename_global_reference)
+        merged_ops+=module_ops
+
+    # These are declared once as variadic, with the calls to them converted to match
+    for sym_name in variadic_clashes:
+        merged_ops[merged_ops.index(symbols[sym_name])]=get_variadic_declaration(sym_name)
+    def convert_variadic_call(nested_op):
+        if isinstance(nested_op, func.Call) and nested_op.callee.root_reference.data in variadic_clashes:
+            convert_to_variadic_call(nested_op)
+    for op in merged_ops:
+        op.walk(convert_variadic_call)
+
+    if len(tiny_py_functions) > 0:
+        merged_ops.insert(0, tiny_py.Module.get(tiny_py_functions))
+    return ModuleOp(merged_ops)
+
+def get_parse_context():
+    """
+    The context used to parse IR, which is our tiny_py dialect and the standard
+    dialects that it is lowered to
+    """
+    from xdsl.dialects import func, arith, cf, memref, scf, llvm, vector, builtin
+    from llvm_func import llvmFuncIR
+    from vector_ext import vectorExtIR
+    from xdsl.ir import MLContext
+    ctx=MLContext()
+    for dialect in [builtin.Builtin, func.Func, arith.Arith, cf.Cf, memref.MemRef, scf.Scf,
+                    llvm.LLVM, vector.Vector, llvmFuncIR, vectorExtIR, tiny_py.tinyPyIR, tiny_py_ssa.tinyPySSAIR]:
+        ctx.register_dialect(dialect)
+    return ctx
+
+def get_form_name(ssa_form):
+    """
+    The name of the form of tiny_py that is generated, which is part of the cache keys
+    """
+    return "ssa" if ssa_form else "regions"
+
+def generate_ir(source, ssa_form=False):
+    """
+    Parses the source of a function and returns the IR in our tiny_py dialect, or
+    in its SSA form if ssa_form is set
+    """
+    a=ast.parse(source)
+    analyzer = SSAAnalyzer() if ssa_form else Analyzer()
+    tiny_py_ir=analyzer.visit(a)
+    # This next line wraps our IR in the built in Module operation, this
+    # is required to comply with the MLIR standard (the top level must be
+    # a built in module).
+    return builtin.ModuleOp([tiny_py_ir])
+
+def print_ir(module):
+    """
+    Prints IR into a string, which is then used for both stdio and the file
+    """
+    from io import StringIO
+    from xdsl.printer import Printer
+    output=StringIO()
+    printer = Printer(stream=output)
+    printer.print_op(module)
+    return output.getvalue()
+
 class Analyzer(ast.NodeVisitor):
     """
     Our very simple Python parser based on the ast library. It's very simplistic but
@@ -54,9 +373,13 @@ class Analyzer(ast.NodeVisitor):
 
     def visit_Assign(self, node):
         """
-        Handle assignment, we visit the RHS and then create the tiny_py Assign IR operation
+        Handle assignment, we visit the RHS and then create the tiny_py Assign IR operation,
+        or the ArrayAssign operation if we are assigning to an element of an array
         """
         val=self.visit(node.value)
+        if isinstance(node.targets[0], ast.Subscript):
+            var_name, indices=self.getArrayAccess(node.targets[0])
+            return tiny_py.ArrayAssign.get(var_name, indices, val)
         return tiny_py.Assign.get(node.targets[0].id, val)
 
     def visit_Module(self, node):
@@ -71,10 +394,12 @@ class Analyzer(ast.NodeVisitor):
 
     def visit_FunctionDef(self, node):
         """
-        A Python function definition, note that we keep this simple by hard coding that
-        there is no return type and there are no arguments (it would be easy to extend
-        this to handle these and is left as an exercise).
+        A Python function definition, the type of each argument and the return type
+        are obtained from the type annotations, and if there is no return annotation
+        then the function does not return a value.
         """
+        args, return_type=self.getSignature(node)
+
         contents=[]
         for a in node.body:
             operation=self.visit(a)
@@ -83,7 +408,32 @@ class Analyzer(ast.NodeVisitor):
                 # parser function that you will complete in exercise two,
                 # so we don't want to include that in the operations
                 contents.append(operation)
-        return tiny_py.Function.get(node.name, None, [], contents)
+        return tiny_py.Function.get(node.name, return_type, args, contents)
+
+    def getSignature(self, node):
+        """
+        Obtains the arguments and return type of a function definition from its type
+        annotations, the return type is None if the function does not return a value
+        """
+        args=[]
+        for arg in node.args.args:
+            if arg.annotation is None:
+                raise Exception("Argument '"+arg.arg+"' of function '"+node.name+"' requires a type annotation")
+            args.append(tiny_py.Argument.get(arg.arg, self.getTypeFromAnnotation(arg.annotation)))
+        # Keep track of which arguments are arrays, as only these can be subscripted
+        self.array_args=[arg.var_name.data for arg in args if isinstance(arg.type, memref.MemRefType)]
+        return_type=None
+        if node.returns is not None:
+            return_type=self.getTypeFromAnnotation(node.returns)
+        return args, return_type
+
+    def visit_Return(self, node):
+        """
+        Returning from a function, optionally with a value
+        """
+        if node.value is None:
+            return tiny_py.Return.get()
+        return tiny_py.Return.get(self.visit(node.value))
 
     def visit_Constant(self, node):
         """
@@ -97,6 +447,24 @@ class Analyzer(ast.NodeVisitor):
         """
         return tiny_py.Var.get(node.id)
 
+    def visit_Subscript(self, node):
+        """
+        Reading an element of an array argument
+        """
+        var_name, indices=self.getArrayAccess(node)
+        return tiny_py.ArrayAccess.get(var_name, indices)
+
+    def getArrayAccess(self, node):
+        """
+        Obtains the array name and index expressions of a subscript, which is
+        either a[i] or a[i, j, ...] for multi-dimensional arrays
+        """
+        if not isinstance(node.value, ast.Name) or node.value.id not in self.array_args:
+            raise Exception("Subscript of "+ast.unparse(node.value)+" not supported, only array arguments can be subscripted")
+        index_nodes=node.slice.elts if isinstance(node.slice, ast.Tuple) else [node.slice]
+        indices=[self.visit(index) for index in index_nodes]
+        return node.value.id, indices
+
     def visit_For(self, node):
         """
         Handles a for loop, note that we make life simpler here by assuming that
@@ -156,6 +524,34 @@ class Analyzer(ast.NodeVisitor):
 
         return False
 
+    def getTypeFromAnnotation(self, annotation):
+        """
+        Maps a Python type annotation to the type in the IR, int and float follow the same
+        widths that we use for constants. Arrays, annotated as Array[element type, rank],
+        are memrefs with a dynamic size in each dimension
+        """
+        if isinstance(annotation, ast.Subscript) and self.getAnnotationName(annotation.value) == "Array":
+            params=annotation.slice.elts if isinstance(annotation.slice, ast.Tuple) else [annotation.slice]
+            element_type=self.getTypeFromAnnotation(params[0])
+            rank=params[1].value if len(params) > 1 else 1
+            if isinstance(element_type, memref.MemRefType) or not isinstance(rank, int) or rank < 1:
+                raise Exception("Type annotation "+ast.unparse(annotation)+" not supported")
+            return memref.MemRefType.from_element_type_and_shape(element_type, [-1]*rank)
+        name=self.getAnnotationName(annotation)
+        if name in python_type_mapping:
+            return getattr(builtin, python_type_mapping[name])
+        raise Exception("Type annotation "+ast.unparse(annotation)+" not supported")
+
+    def getAnnotationName(self, annotation):
+        """
+        The name of a type in an annotation, ignoring any module prefix (e.g. np.float64)
+        """
+        if isinstance(annotation, ast.Name):
+            return annotation.id
+        if isinstance(annotation, ast.Attribute):
+            return annotation.attr
+        return None
+
     def getOperationStr(self, op):
         """
         Maps Python operation to string name, as we use the string name
@@ -171,3 +567,110 @@ class Analyzer(ast.NodeVisitor):
             return "div"
         else:
             return None
+
+class SSAAnalyzer(Analyzer):
+    """
+    Generates the IR in the SSA form of tiny_py, where each expression is an operation
+    whose result is the operand of the operations applied to it. Visiting an expression
+    appends its operation to the operations of the statement being visited and returns its
+    result, so the operands of an expression come before it, and visiting a statement appends
+    the statement after the expressions that it uses
+    """
+    def __init__(self):
+        self.ops=[]
+
+    def visit_FunctionDef(self, node):
+        """
+        A Python function definition, which is the same as for tiny_py except that each
+        statement of the body is a list of operations
+        """
+        args, return_type=self.getSignature(node)
+        return tiny_py.Function.get(node.name, return_type, args, self.visitBody(node.body))
+
+    def visitBody(self, body):
+        """
+        Visits each statement of a body, returning all of their operations in order
+        """
+        contents=[]
+        for a in body:
+            contents+=self.visitStatement(a)
+        return contents
+
+    def visitStatement(self, node):
+        """
+        Visits a statement, returning the operations of its expressions followed by the
+        statement itself
+        """
+        outer_ops=self.ops
+        self.ops=[]
+        self.visit(node)
+        statement_ops=self.ops
+        self.ops=outer_ops
+        return statement_ops
+
+    def visit_Assign(self, node):
+        val=self.visit(node.value)
+        if isinstance(node.targets[0], ast.Subscript):
+            var_name, indices=self.getArrayAccess(node.targets[0])
+            self.ops.append(tiny_py_ssa.ArrayAssign.get(var_name, val, indices))
+        else:
+            self.ops.append(tiny_py_ssa.Assign.get(node.targets[0].id, val))
+
+    def visit_Return(self, node):
+        val=None if node.value is None else self.visit(node.value)
+        self.ops.append(tiny_py_ssa.Return.get(val))
+
+    def visit_For(self, node):
+        """
+        A for loop, in the format for i in range(from, to), where the from and to
+        expressions come before the loop and the body is visited into the loop's region
+        """
+        expr_from=self.visit(node.iter.args[0])
+        expr_to=self.visit(node.iter.args[1])
+        body=self.visitBody(node.body)
+
+        # As with the region form, you need to construct the tiny_py_ssa Loop and append it
+        # to the operations
+
+    def visit_Constant(self, node):
+        return self.appendExpression(tiny_py_ssa.Constant.get(node.value))
+
+    def visit_Name(self, node):
+        return self.appendExpression(tiny_py_ssa.Var.get(node.id))
+
+    def visit_Subscript(self, node):
+        var_name, indices=self.getArrayAccess(node)
+        return self.appendExpression(tiny_py_ssa.ArrayAccess.get(var_name, indices))
+
+    def visit_BinOp(self, node):
+        """
+        A binary operation, an expression such as a+b+c+... is a chain of these nested down
+        the LHS, so we follow the chain in a loop rather than recursively which means that
+        expressions with many terms don't exceed Python's recursion limit
+        """
+        chain=[]
+        while isinstance(node, ast.BinOp):
+            chain.append(node)
+            node=node.left
+        lhs=self.visit(node)
+        for binop in reversed(chain):
+            op_str=self.getOperationStr(binop.op)
+            if op_str is None:
+                raise Exception("Operation "+str(binop.op)+" not recognised")
+            rhs=self.visit(binop.right)
+            lhs=self.appendExpression(tiny_py_ssa.BinaryOperation.get(op_str, lhs, rhs))
+        return lhs
+
+    def visit_Call(self, node):
+        arguments=[self.visit(arg) for arg in node.args]
+        builtin_fn=self.isFnCallBuiltIn(node.func.id)
+        call=tiny_py_ssa.CallExpr.get(node.func.id, arguments, builtin=builtin_fn)
+        self.ops.append(call)
+        return None
+
+    def appendExpression(self, op):
+        """
+        Appends the operation of an expression and returns its result
+        """
+        self.ops.append(op)
+        return op.results[0]
@@ -0,0 +1,221 @@
+from xdsl.dialects.builtin import ModuleOp, IndexType
+from xdsl.ir import Operation, SSAValue, Block, MLContext
+from xdsl.dialects import scf, arith
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+import sys
+from xdsl.passes import ModulePass
+from for_to_parallel import get_constant_value, describe_loop_location, matched_operations
+from parallel_legality import reduction_identities
+from tiny_py_to_standard import is_float_type
+
+"""
+Tiles loops for cache blocking, each loop is split into a tile loop that steps over tiles
+of the iteration space and point loops that iterate within a tile. Tile sizes are given
+per dimension of a loop nest, outermost first, and count iterations of the loop, so a
+loop with a step of 8 (such as the vector loop from vectorise-parallel) and a tile size
+of 32 has tiles of 256 elements. A tile size of zero, or a dimension beyond those given,
+is not tiled, which is the same convention as mlir-opt's scf-parallel-loop-tiling.
+
+For scf.parallel the tile loop is a parallel loop over all the dimensions and the point
+loops are a nest of sequential scf.for loops, one per tiled dimension, so each thread works
+through whole tiles and parallelism is not nested. The reductions of the parallel loop are
+carried through the point loops, starting from the identity of the reduction, and each
+tile's partial value is then reduced by the tile loop. For scf.for the loop is strip-mined,
+with the tile loop and point loop both carrying the loop's values.
+"""
+
+def get_loop_depth(loop: Operation) -> int:
+    """
+    The number of loop dimensions that enclose the loop, which is the index of the
+    loop's first dimension in the tile sizes
+    """
+    depth=0
+    parent=loop.parent_op()
+    while parent is not None:
+        if isinstance(parent, scf.For):
+            depth+=1
+        elif isinstance(parent, scf.ParallelOp):
+            depth+=len(parent.lowerBound)
+        parent=parent.parent_op()
+    return depth
+
+def get_trip_count(lb: SSAValue, ub: SSAValue, step: SSAValue) -> Optional[int]:
+    lb_value, ub_value, step_value=get_constant_value(lb), get_constant_value(ub), get_constant_value(step)
+    if lb_value is None or ub_value is None or step_value is None or step_value <= 0:
+        return None
+    return max(0, -(-(ub_value-lb_value) // step_value))
+
+def should_tile(lb: SSAValue, ub: SSAValue, step: SSAValue, tile_size: int) -> bool:
+    """
+    Whether a dimension is tiled, which it isn't if its trip count is known to fit in one tile
+    """
+    if tile_size <= 0:
+        return False
+    trip_count=get_trip_count(lb, ub, step)
+    return trip_count is None or trip_count > tile_size
+
+def build_tile_step(step: SSAValue, tile_size: int) -> Tuple[List[Operation], SSAValue]:
+    tile=arith.Constant.from_int_and_width(tile_size, IndexType())
+    tile_step=arith.Muli.get(step, tile)
+    return [tile, tile_step], tile_step.results[0]
+
+def build_point_upper_bound(tile_iv: SSAValue, tile_step: SSAValue, lb: SSAValue, ub: SSAValue,
+                            step: SSAValue, tile_size: int) -> Tuple[List[Operation], SSAValue]:
+    """
+    The upper bound of the point loop, this is the end of the tile or the upper bound of
+    the loop if that is before it. When the trip count is known to be a multiple of the tile
+    size the last tile is full, so the end of the tile is used directly and the point loop
+    has a constant trip count
+    """
+    tile_end=arith.Addi.build(operands=[tile_iv, tile_step], result_types=[IndexType()])
+    trip_count=get_trip_count(lb, ub, step)
+    if trip_count is not None and trip_count % tile_size == 0:
+        return [tile_end], tile_end.results[0]
+    upper=arith.MinSI.build(operands=[tile_end, ub], result_types=[IndexType()])
+    return [tile_end, upper], upper.results[0]
+
+def get_reduction_op(reduce_op: scf.ReduceOp) -> Operation:
+    return reduce_op.body.blocks[0].ops.first
+
+def build_identity(reduction_kind: str, typ) -> arith.Constant:
+    if is_float_type(typ):
+        return arith.Constant.from_float_and_width(float(reduction_identities[reduction_kind]), typ)
+    return arith.Constant.from_int_and_width(reduction_identities[reduction_kind], typ)
+
+def tile_for_loop(for_loop: scf.For, tile_size: int):
+    """
+    Strip-mines the loop, the original loop becomes the point loop and is moved into the
+    new tile loop, with the values of the tile loop passed into it and its results yielded
+    """
+    parent_block=for_loop.parent_block()
+    step_ops, tile_step=build_tile_step(for_loop.step, tile_size)
+    tile_block=Block(arg_types=[IndexType()]+[arg.typ for arg in for_loop.iter_args])
+    tile_loop=scf.For.get(for_loop.lb, for_loop.ub, tile_step, list(for_loop.iter_args), tile_block)
+    parent_block.insert_ops_before(step_ops+[tile_loop], for_loop)
+    for old_result, new_result in zip(for_loop.results, tile_loop.results):
+        old_result.replace_by(new_result)
+
+    bound_ops, upper=build_point_upper_bound(tile_block.args[0], tile_step, for_loop.lb, for_loop.ub,
+                                             for_loop.step, tile_size)
+    for_loop.detach()
+    # The operands of scf.for are the lower bound, upper bound, step and then the loop's values
+    for_loop.replace_operand(0, tile_block.args[0])
+    for_loop.replace_operand(1, upper)
+    for idx, arg in enumerate(tile_block.args[1:]):
+        for_loop.replace_operand(3+idx, arg)
+    tile_block.add_ops(bound_ops+[for_loop, scf.Yield.get(*for_loop.results)])
+
+def tile_parallel_loop(parallel_loop: scf.ParallelOp, tile_sizes: List[int]) -> str:
+    """
+    Tiles the dimensions of the parallel loop that have a tile size, returning why the
+    loop can't be tiled or an empty string if it has been (or there was nothing to tile)
+    """
+    body=parallel_loop.body.blocks[0]
+    reductions=[op for op in body.ops if isinstance(op, scf.ReduceOp)]
+    for reduction in reductions:
+        if get_reduction_op(reduction).name not in reduction_identities:
+            return f"its reduction by {get_reduction_op(reduction).name} has no identity to start each tile from"
+
+    num_dims=len(parallel_loop.lowerBound)
+    tiled_dims=[dim for dim in range(num_dims) if should_tile(parallel_loop.lowerBound[dim],
+                parallel_loop.upperBound[dim], parallel_loop.step[dim], tile_sizes[dim])]
+    if len(tiled_dims) == 0:
+        return ""
+
+    parent_block=parallel_loop.parent_block()
+    tile_steps=list(parallel_loop.step)
+    for dim in tiled_dims:
+        step_ops, tile_steps[dim]=build_tile_step(parallel_loop.step[dim], tile_sizes[dim])
+        parent_block.insert_ops_before(step_ops, parallel_loop)
+
+    tile_block=Block(arg_types=[IndexType()]*num_dims)
+    acc_types=[init.typ for init in parallel_loop.initVals]
+    identities=[build_identity(get_reduction_op(reduction).name, typ) for reduction, typ in zip(reductions, acc_types)]
+    tile_block.add_ops(identities)
+
+    # Build the nest of point loops, each passes the partial values of the reductions into
+    # the loop inside it and yields its results. Untiled dimensions use the tile loop's
+    # induction variable directly
+    point_ivs=list(tile_block.args)
+    current_block=tile_block
+    current_accs=[identity.results[0] for identity in identities]
+    point_loops=[]
+    for dim in tiled_dims:
+        bound_ops, upper=build_point_upper_bound(tile_block.args[dim], tile_steps[dim], parallel_loop.lowerBound[dim],
+                                                 parallel_loop.upperBound[dim], parallel_loop.step[dim], tile_sizes[dim])
+        tile_block.add_ops(bound_ops)
+        point_block=Block(arg_types=[IndexType()]+acc_types)
+        point_loop=scf.For.get(tile_block.args[dim], upper, parallel_loop.step[dim], current_accs, point_block)
+        if current_block is not tile_block:
+            current_block.add_ops([point_loop, scf.Yield.get(*point_loop.results)])
+        point_loops.append(point_loop)
+        point_ivs[dim]=point_block.args[0]
+        current_block=point_block
+        current_accs=list(point_block.args[1:])
+    tile_block.add_op(point_loops[0])
+
+    # Move the body into the innermost point loop, where each reduction instead combines
+    # its value with the partial value of the tile
+    for old_arg, new_arg in zip(body.args, point_ivs):
+        old_arg.replace_by(new_arg)
+    for op in list(body.ops):
+        if isinstance(op, scf.ReduceOp) or isinstance(op, scf.Yield):
+            continue
+        op.detach()
+        current_block.add_op(op)
+    combined=[]
+    for reduction, acc in zip(reductions, current_accs):
+        combine_op=matched_operations[get_reduction_op(reduction).name].build(
+            operands=[acc, reduction.argument], result_types=[acc.typ])
+        current_block.add_op(combine_op)
+        combined.append(combine_op.results[0])
+    current_block.add_op(scf.Yield.get(*combined))
+
+    # The tile loop then reduces each tile's partial values
+    for reduction, partial in zip(reductions, point_loops[0].results):
+        reduction.detach()
+        reduction.replace_operand(0, partial)
+        tile_block.add_op(reduction)
+    tile_block.add_op(scf.Yield.get())
+
+    tile_loop=scf.ParallelOp.get(list(parallel_loop.lowerBound), list(parallel_loop.upperBound), tile_steps,
+                                 [tile_block], list(parallel_loop.initVals))
+    parent_block.insert_op_before(tile_loop, parallel_loop)
+    for old_result, new_result in zip(parallel_loop.results, tile_loop.results):
+        old_result.replace_by(new_result)
+    parent_block.erase_op(parallel_loop)
+    return ""
+
+def report_rejection(loop: Operation, loop_number: int, reason: str):
+    location=describe_loop_location(loop, loop_number)
+    print(f"remark: tile-loops: {location} not tiled as {reason}", file=sys.stderr)
+
+@dataclass
+class TileLoops(ModulePass):
+  """
+  This is the entry point for the transformation pass. The tile sizes are given as an
+  option, e.g. tile-loops{tile-sizes=32,64}, and with none given no loops are tiled. As
+  each point loop of a parallel loop is sequential, run vectorise-parallel before this
+  pass to vectorise the innermost point loops
+  """
+  name = 'tile-loops'
+
+  tile_sizes: List[int] = field(default_factory=list)
+  remarks: bool = True
+
+  def apply(self, ctx: MLContext, input_module: ModuleOp):
+    loops=[]
+    input_module.walk(lambda op: loops.append(op) if isinstance(op, scf.For) or isinstance(op, scf.ParallelOp) else None)
+    # The depths are found before any tiling, as this adds loops to the nest
+    depths=[get_loop_depth(loop) for loop in loops]
+    for loop_number, (loop, depth) in enumerate(zip(loops, depths)):
+      if isinstance(loop, scf.For):
+        if depth < len(self.tile_sizes) and should_tile(loop.lb, loop.ub, loop.step, self.tile_sizes[depth]):
+          tile_for_loop(loop, self.tile_sizes[depth])
+      else:
+        num_dims=len(loop.lowerBound)
+        tile_sizes=(self.tile_sizes[depth:depth+num_dims]+[0]*num_dims)[:num_dims]
+        reason=tile_parallel_loop(loop, tile_sizes)
+        if reason and self.remarks:
+          report_rejection(loop, loop_number, reason)
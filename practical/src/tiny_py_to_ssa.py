@@ -0,0 +1,94 @@
+from xdsl.dialects.builtin import ModuleOp
+from xdsl.ir import Operation, SSAValue, MLContext
+from dataclasses import dataclass
+from typing import List, Optional
+from xdsl.passes import ModulePass
+import tiny_py
+import tiny_py_ssa
+
+"""
+Converts the body of each function from the tiny_py dialect, where the operands of an
+expression are nested in its regions, to the SSA form of the dialect in tiny_py_ssa, where
+each expression is an operation in the block that produces a result. The operations of an
+expression are placed before the statement that uses it, operands first and in the order
+that they are evaluated by the lowering (e.g. for an array assignment the value and then
+the indices), so the lowering of both forms gives the same IR.
+
+The Python parser can generate the SSA form directly, this pass is for IR that is already
+in tiny_py, e.g. that has been written to a file.
+"""
+
+def convert_expr(op: Operation, ops: List[Operation]) -> Optional[SSAValue]:
+    """
+    Appends the operations of the expression to ops, returning its result (which is
+    None for a call that does not return a value)
+    """
+    if isinstance(op, tiny_py.Constant):
+        new_op=tiny_py_ssa.Constant.get(op.value)
+    elif isinstance(op, tiny_py.Var):
+        new_op=tiny_py_ssa.Var.get(op.variable)
+    elif isinstance(op, tiny_py.BinaryOperation):
+        lhs=convert_expr(op.lhs.blocks[0].ops.first, ops)
+        rhs=convert_expr(op.rhs.blocks[0].ops.first, ops)
+        new_op=tiny_py_ssa.BinaryOperation.get(op.op, lhs, rhs)
+    elif isinstance(op, tiny_py.ArrayAccess):
+        indices=[convert_expr(index, ops) for index in op.indices.blocks[0].ops]
+        new_op=tiny_py_ssa.ArrayAccess.get(op.var_name, indices)
+    elif isinstance(op, tiny_py.CallExpr):
+        args=[convert_expr(arg, ops) for arg in op.args.blocks[0].ops]
+        new_op=tiny_py_ssa.CallExpr.get(op.func, args, op.type, op.builtin)
+    else:
+        raise Exception(f"Could not convert `{op.name}' as an expression")
+    ops.append(new_op)
+    return new_op.results[0] if len(new_op.results) > 0 else None
+
+def convert_stmt(op: Operation) -> List[Operation]:
+    """
+    Converts a statement, returning the operations of its expressions followed by the
+    statement itself
+    """
+    ops: List[Operation] = []
+    if isinstance(op, tiny_py.Assign):
+        value=convert_expr(op.value.blocks[0].ops.first, ops)
+        ops.append(tiny_py_ssa.Assign.get(op.var_name, value))
+    elif isinstance(op, tiny_py.ArrayAssign):
+        value=convert_expr(op.value.blocks[0].ops.first, ops)
+        indices=[convert_expr(index, ops) for index in op.indices.blocks[0].ops]
+        ops.append(tiny_py_ssa.ArrayAssign.get(op.var_name, value, indices))
+    elif isinstance(op, tiny_py.Return):
+        value=op.value.blocks[0].ops.first
+        ops.append(tiny_py_ssa.Return.get(None if value is None else convert_expr(value, ops)))
+    elif isinstance(op, tiny_py.Loop):
+        from_expr=convert_expr(op.from_expr.blocks[0].ops.first, ops)
+        to_expr=convert_expr(op.to_expr.blocks[0].ops.first, ops)
+        ops.append(tiny_py_ssa.Loop.get(op.variable, from_expr, to_expr, convert_block(op.body.blocks[0].ops)))
+    elif isinstance(op, tiny_py.CallExpr):
+        convert_expr(op, ops)
+    else:
+        raise Exception(f"Could not convert `{op.name}' as a statement")
+    return ops
+
+def convert_block(stmts) -> List[Operation]:
+    ops: List[Operation] = []
+    for stmt in stmts:
+        ops+=convert_stmt(stmt)
+    return ops
+
+@dataclass
+class ConvertTinyPyToSSA(ModulePass):
+  """
+  This is the entry point for the transformation pass, which runs on the tiny_py dialect
+  and so comes before tiny-py-to-standard (which lowers either form)
+  """
+  name = 'tiny-py-to-ssa'
+
+  def apply(self, ctx: MLContext, input_module: ModuleOp):
+    functions=[]
+    input_module.walk(lambda op: functions.append(op) if isinstance(op, tiny_py.Function) else None)
+    for function in functions:
+      body=function.body.blocks[0]
+      stmts=list(body.ops)
+      new_ops=convert_block(stmts)
+      for stmt in stmts:
+        body.erase_op(stmt)
+      body.add_ops(new_ops)
@@ -6,17 +6,42 @@ from xdsl.dialects.builtin import (StringAttr, ModuleOp, IntegerAttr, IntegerTyp
 from xdsl.dialects import func, arith, cf, memref, scf, llvm
 from xdsl.ir import Operation, Attribute, ParametrizedAttribute, Region, Block, SSAValue, BlockArgument, MLContext
 import tiny_py
+import tiny_py_ssa
+from llvm_func import LLVMFuncOp, LLVMCallOp, LLVMFunctionType
 from xdsl.passes import ModulePass
 from util.list_ops import flatten
 from util.visitor import Visitor
+from util.semantic_error import SemanticError
 from dataclasses import dataclass, field
-from typing import List, Optional, Tuple, Dict
+from typing import Callable, List, Optional, Tuple, Dict, Set
 import copy
 
 """
 This is a transformation pass which converts the tiny_py dialect to standard MLIR dialects. This
 is required so that the MLIR opt tool can then generate LLVM-IR that we feed into LLVM
 to generate and executable
+
+As the operands of a tiny_py expression are nested regions, an expression such as a*b that
+appears twice is two separate trees. The lowering eliminates these common subexpressions by
+numbering the values that it generates, each constant, binary operation, array load and
+conversion has a key made up of what it computes and the SSA values of its operands, and
+where an earlier value with the same key is in scope that value is used instead. Variables
+are referenced by the SSA value currently assigned to them, so once a variable is reassigned
+expressions using it no longer match. Array loads also include a version of memory in their
+key, which changes on every store, call and loop, so a load is never reused across a write.
+Values computed inside a loop body are only reused within that body.
+
+Functions can also be in the SSA form of the dialect (tiny_py_ssa), where each expression
+is an operation in the block whose result is the operand of the operations that use it.
+These operations are translated in order as they are reached, and the SSA value that each
+result is translated to is recorded in the lowering state, which is then looked up by the
+operations that use it. As the expressions are not nested there is no recursion, so
+expressions of any size can be lowered. The other translation functions work on either
+form, by obtaining their operands via translate_operand.
+
+The translation of each operation is looked up by its class in the statement and expression
+translation tables at the end of this file, and a translation for another operation can be
+added to these with register_statement_translation or register_expression_translation.
 """
 
 # A match between operation names and their standard dialect representations, there are
@@ -26,25 +51,107 @@ binary_arith_op_matching={"add": [arith.Addi, arith.Addf], "sub":[arith.Subi, ar
 
 builtin_function_name_mapping={"print": "printf"}
 
-string_index=0
-global_declarations=[]
+# External functions that are variadic, so can be called with different argument types,
+# along with their fixed argument types and return type
+variadic_functions={"printf": ([llvm.LLVMPointerType.typed(IntegerType(8))], i32)}
 
 class GetAssignedVariables(Visitor):
   def __init__(self):
-    self.assigned_vars=[]
+    # A dictionary is used as a set that keeps the order the variables are first assigned in
+    self.assigned_vars: Dict[str, None]={}
 
   def traverse_assign(self, assign:tiny_py.Assign):
-    var_name=assign.var_name.data
-    if var_name not in self.assigned_vars:
-      self.assigned_vars.append(var_name)
+    self.assigned_vars[assign.var_name.data]=None
+
+class GetUsedVariables(Visitor):
+  def __init__(self):
+    self.used_vars=set()
+
+  def traverse_var(self, var:tiny_py.Var):
+    self.used_vars.add(var.variable.data)
+
+def get_used_variables(*ops: Operation) -> Set[str]:
+    used_var_finder=GetUsedVariables()
+    for op in ops:
+        used_var_finder.traverse(op)
+    return used_var_finder.used_vars
+
+def analyse_liveness(stmts: List[Operation], live_out: Set[str], state: LoweringState) -> Set[str]:
+    """
+    Works backwards through the statements to find the variables that are live before them,
+    i.e. whose current value might be read, given those that are live after them. For each
+    loop this records the variables live after the loop and those live at the start of its
+    body, which is where the value from the previous iteration is read. A loop might not run
+    at all, so what is live after the loop is also live before it
+    """
+    live=set(live_out)
+    for stmt in reversed(stmts):
+        if isinstance(stmt, tiny_py.Assign):
+            live.discard(stmt.var_name.data)
+            live|=get_used_variables(*stmt.value.blocks[0].ops)
+        elif isinstance(stmt, tiny_py_ssa.Assign):
+            # In the SSA form the variables read by the value are the tiny_py_ssa.Var
+            # operations before the assignment, so are added once we reach them
+            live.discard(stmt.var_name.data)
+        elif isinstance(stmt, tiny_py.Loop) or isinstance(stmt, tiny_py_ssa.Loop):
+            state.loop_live_out[id(stmt)]=set(live)
+            # What is live at the start of the body is also live at the end of the previous
+            # iteration, so this is repeated until it no longer changes
+            body=list(stmt.body.blocks[0].ops)
+            body_live_in=set()
+            while True:
+                new_live_in=analyse_liveness(body, live | body_live_in, state)
+                new_live_in.discard(stmt.variable.data)
+                if new_live_in == body_live_in:
+                    break
+                body_live_in=new_live_in
+            state.loop_live_in[id(stmt)]=body_live_in
+            live|=body_live_in
+            if isinstance(stmt, tiny_py.Loop):
+                live|=get_used_variables(*stmt.from_expr.blocks[0].ops, *stmt.to_expr.blocks[0].ops)
+        elif isinstance(stmt, tiny_py.Return) or isinstance(stmt, tiny_py_ssa.Return):
+            live=get_used_variables(stmt)
+        else:
+            live|=get_used_variables(stmt)
+    return live
+
+@dataclass
+class LoweringState:
+    """
+    The state of one invocation of the lowering, which is the module level operations
+    that are generated as functions are translated. Strings are interned so each distinct
+    string has one global, and the calls to each external function are recorded so that
+    the function is declared once at the end
+    """
+    string_globals: Dict[str, str] = field(default_factory=dict)
+    global_ops: List[Operation] = field(default_factory=list)
+    external_calls: Dict[str, List[func.Call]] = field(default_factory=dict)
+    # Whether common subexpressions are eliminated, and the version of memory that array
+    # loads are numbered with, which is changed whenever memory might be written to
+    eliminate_common_subexpressions: bool = True
+    memory_version: int = 0
+    # The variables that are live after each loop and at the start of each loop's body, by
+    # the id of the loop, these are found by analyse_liveness for each function
+    loop_live_out: Dict[int, Set[str]] = field(default_factory=dict)
+    loop_live_in: Dict[int, Set[str]] = field(default_factory=dict)
+    # The SSA value that each result of an expression in the SSA form is translated to
+    expression_values: Dict[SSAValue, SSAValue] = field(default_factory=dict)
 
 @dataclass
 class SSAValueCtx:
     """
     Context that relates identifiers from the AST to SSA values used in the flat representation.
+    Nested scopes share the lowering state of their parent. Each scope also holds the values
+    computed in it by their key, for eliminating common subexpressions
     """
     dictionary: Dict[str, SSAValue] = field(default_factory=dict)
     parent_scope: Optional[SSAValueCtx] = None
+    state: Optional[LoweringState] = None
+    expressions: Dict[tuple, SSAValue] = field(default_factory=dict)
+
+    def __post_init__(self):
+        if self.state is None and self.parent_scope is not None:
+            self.state = self.parent_scope.state
 
     def __getitem__(self, identifier: str) -> Optional[SSAValue]:
         """Check if the given identifier is in the current scope, or a parent scope"""
@@ -61,44 +168,77 @@ class SSAValueCtx:
         self.dictionary[identifier] = ssa_value
 
     def copy(self):
-      ssa=SSAValueCtx()
+      ssa=SSAValueCtx(state=self.state)
       ssa.dictionary=dict(self.dictionary)
+      ssa.expressions=dict(self.expressions)
       return ssa
 
-def translate_program(input_module: Module) -> ModuleOp:
-    # create an empty global context
-    global_ctx = SSAValueCtx()
+    def lookup_expression(self, key: tuple) -> Optional[SSAValue]:
+        """Finds a value with the key that has been computed in this scope or a parent scope"""
+        if not self.state.eliminate_common_subexpressions:
+            return None
+        ssa_value = self.expressions.get(key, None)
+        if ssa_value is None and self.parent_scope:
+            return self.parent_scope.lookup_expression(key)
+        return ssa_value
+
+    def record_expression(self, key: tuple, ssa_value: SSAValue):
+        if self.state.eliminate_common_subexpressions:
+            self.expressions[key] = ssa_value
+
+def translate_program(input_module: Module, entry_point: bool = True,
+                      eliminate_common_subexpressions: bool = True) -> ModuleOp:
+    """
+    Translates a module, which holds one func.FuncOp for each function. If entry_point
+    is set then a lone function without arguments or return value is the program's main
+    """
+    # create an empty global context, with fresh state as everything generated at the
+    # module level is specific to this module
+    global_ctx = SSAValueCtx(state=LoweringState(eliminate_common_subexpressions=eliminate_common_subexpressions))
     body = Region()
     block = Block()
     for top_level_entry in input_module.ops:
-      for module in top_level_entry.children.blocks[0].ops:
-        translate_toplevel(global_ctx, module, block)
+      functions=list(top_level_entry.children.blocks[0].ops)
+      for module in functions:
+        translate_toplevel(global_ctx, module, block, entry_point=entry_point and len(functions) == 1)
 
-    assert (len(block.ops)) == 1 and isinstance(block.ops.first, func.FuncOp)
+    assert all(isinstance(op, func.FuncOp) for op in block.ops)
 
-    block.add_ops(global_declarations)
+    block.add_ops(global_ctx.state.global_ops)
+    block.add_ops(generate_external_declarations(global_ctx.state))
     body.add_block(block)
     return ModuleOp(body)
 
-def translate_toplevel(ctx: SSAValueCtx, op: Operation, block) -> Operation:
+def translate_toplevel(ctx: SSAValueCtx, op: Operation, block, entry_point=False) -> Operation:
     if isinstance(op, tiny_py.Function):
-        block.add_op(translate_fun_def(ctx, op))
+        block.add_op(translate_fun_def(ctx, op, entry_point))
 
 def translate_fun_def(ctx: SSAValueCtx,
-                      fn_def: tinypy.Function) -> Operation:
+                      fn_def: tinypy.Function, entry_point=False) -> Operation:
     """
-    Translates a function definition into the func standard dialect
+    Translates a function definition into the func standard dialect, if this is
+    the program's entry point (the only function and it has no arguments or
+    return value) then it is named main so that it can be built into an executable
     """
     routine_name = fn_def.attributes["fn_name"]
 
+    # The types of the arguments are held in the function, and the return type is
+    # either empty or the type of the value being returned
+    arg_types=[arg.type for arg in fn_def.args.data]
+    return_types=[]
+    if not isinstance(fn_def.return_var, tiny_py.EmptyType):
+        return_types.append(fn_def.return_var)
+
     body = Region()
-    block = Block()
+    block = Block(arg_types=arg_types)
 
     # Create a new nested scope and relate parameter identifiers with SSA values of block arguments
     c = SSAValueCtx(dictionary=dict(), parent_scope=ctx)
+    for arg, block_arg in zip(fn_def.args.data, block.args):
+        c[arg.var_name]=block_arg
 
-    arg_types=[]
-    arg_names=[]
+    # Find which variables each loop needs to carry between iterations or out of the loop
+    analyse_liveness(list(fn_def.body.blocks[0].ops), set(), c.state)
 
     body_contents=[]
     for op in fn_def.body.blocks[0].ops:
@@ -108,16 +248,22 @@ def translate_fun_def(ctx: SSAValueCtx,
 
     block.add_ops(flatten(body_contents))
 
-    # A return is always needed at the end of the procedure
-    block.add_op(func.Return.create())
+    # A return is always needed at the end of the procedure, if the Python function
+    # did not end with one then there is no value to return
+    if not isinstance(block.ops.last, func.Return):
+        if len(return_types) > 0:
+            raise Exception(f"Function `{routine_name.data}' must end with a return statement")
+        block.add_op(func.Return.get())
 
     body.add_block(block)
 
-    # To keep it very simple we have an empty list of arguments to our function definition
-    # Also to keep it simple we hard code the name to be main, as this is the program
-    # entry point (could instead use routine_name.data to obtain the string value)
-    function_ir=func.FuncOp.from_region("main", arg_types, [], body)
+    fn_name="main" if entry_point and len(arg_types) == 0 and len(return_types) == 0 else routine_name.data
+    function_ir=func.FuncOp.from_region(fn_name, arg_types, return_types, body)
     function_ir.attributes["sym_visibility"]=StringAttr("public")
+    if any(isinstance(typ, memref.MemRefType) for typ in arg_types):
+        # Arrays are passed in from Python as pointers to memref descriptors, this
+        # generates a wrapper function that accepts them in that form
+        function_ir.attributes["llvm.emit_c_interface"]=UnitAttr()
 
     return function_ir
 
@@ -139,14 +285,12 @@ def try_translate_stmt(ctx: SSAValueCtx,
     If op is an expression, returns a list of the translated Operations.
     Returns None otherwise.
     """
-    if isinstance(op, tiny_py.CallExpr):
-        return translate_call_expr_stmt(ctx, op)
-    if isinstance(op, tiny_py.Return):
-        return translate_return(ctx, op)
-    if isinstance(op, tiny_py.Assign):
-        return translate_assign(ctx, op)
-    if isinstance(op, tiny_py.Loop):
-        return translate_loop(ctx, op)
+    translation=lookup_translation(statement_translations, type(op))
+    if translation is not None:
+        return translation(ctx, op)
+    if len(op.results) > 0 and lookup_translation(expression_translations, type(op)) is not None:
+        # An expression of the SSA form, which is in the block before the operations that use it
+        return translate_ssa_expr(ctx, op)
 
     return None
 
@@ -166,9 +310,24 @@ def translate_stmt(ctx: SSAValueCtx,
 def translate_return(ctx: SSAValueCtx,
                      return_stmt: tiny_py.Return) -> List[Operation]:
     """
-    Translates the return operation, currently assume not returning any value
+    Translates the return operation, which might or might not return a value. A func.return
+    must be directly in the body of the function, so returning from inside a loop is not
+    supported
     """
-    return [func.Return.get([])]
+    fn_def=return_stmt.parent_op()
+    if not isinstance(fn_def, tiny_py.Function):
+        while not isinstance(fn_def, tiny_py.Function):
+            fn_def=fn_def.parent_op()
+        raise SemanticError(f"Return inside a loop of `{fn_def.fn_name.data}' is not supported, "
+                            "a return can only be at the top level of a function")
+    values=get_operand_list(return_stmt.value)
+    if len(values) == 0:
+        return [func.Return.get()]
+    expr, ssa=translate_operand(ctx, values[0])
+
+    # The value is converted to the return type of the enclosing function if needed
+    conv, ssa=convert_to_type(ssa, fn_def.return_var)
+    return expr+conv+[func.Return.get(ssa)]
 
 def translate_loop(ctx: SSAValueCtx,
                   loop_stmt: tiny_py.Loop) -> List[Operation]:
@@ -193,13 +352,17 @@ def translate_loop(ctx: SSAValueCtx,
     assigned_var_finder=GetAssignedVariables()
     for op in loop_stmt.body.blocks[0].ops:
         assigned_var_finder.traverse(op)
+    # Only those that are read by the next iteration or after the loop need to be
+    # carried by the loop, the others are assigned before they are read in every
+    # iteration so are just values in the body
+    carried_vars=get_carried_variables(ctx, loop_stmt, assigned_var_finder.assigned_vars)
 
     # Based on the above information we build the list of block arguments, the first
     # element is always the operand which represents the current loop iteration
     # which is of type index
     block_arg_types=[IndexType()]
     block_args=[]
-    for var_name in assigned_var_finder.assigned_vars:
+    for var_name in carried_vars:
         block_arg_types.append(ctx[StringAttr(var_name)].typ)
         block_args.append(ctx[StringAttr(var_name)])
 
@@ -209,10 +372,14 @@ def translate_loop(ctx: SSAValueCtx,
 
     # In the SSA context that is passed into the translation of the loop
     # body we set each assigned variable to reference the corresponding argument
-    # to the block
+    # to the block. Arrays might be written to by the body, so loads from before
+    # the loop can't be reused in it or after it
+    ctx.state.memory_version+=1
     c = SSAValueCtx(dictionary=dict(), parent_scope=ctx)
-    for idx, var_name in enumerate(assigned_var_finder.assigned_vars):
+    for idx, var_name in enumerate(carried_vars):
       c[StringAttr(var_name)]=block.args[idx+1]
+    # The loop variable references the first block argument, the current iteration
+    c[loop_stmt.variable]=block.args[0]
 
     # Now lets visit each operation in the loop body and build up the operations
     # which will be added to the block
@@ -221,7 +388,7 @@ def translate_loop(ctx: SSAValueCtx,
         pass # Needs to be completed!
 
     # We need to yield out assigned variables at the end of the block
-    yield_stmt=generate_yield(c, assigned_var_finder.assigned_vars)
+    yield_stmt=generate_yield(c, carried_vars)
     block.add_ops(ops+[yield_stmt])
     body=Region()
     body.add_block(block)
@@ -231,11 +398,70 @@ def translate_loop(ctx: SSAValueCtx,
 
     # From now on, whenever the code references any variable that was assigned
     # in the body of the loop we need to use the corresponding loop result
-    for i, var_name in enumerate(assigned_var_finder.assigned_vars):
+    for i, var_name in enumerate(carried_vars):
       ctx[StringAttr(var_name)]=for_loop.results[i]
+    ctx.state.memory_version+=1
 
     return start_expr+end_expr+[start_cast, end_cast, step_op, for_loop]
 
+def translate_ssa_loop(ctx: SSAValueCtx,
+                       loop_stmt: tiny_py_ssa.Loop) -> List[Operation]:
+    """
+    Translates a loop in the SSA form, this is the same as translate_loop except that the
+    from and to expressions have already been translated, as they come before the loop.
+    The missing parts are completed in the same way as those of translate_loop
+    """
+    _, start_ssa=translate_operand(ctx, loop_stmt.from_expr)
+    _, end_ssa=None, None # Needs to be completed!
+    start_cast = arith.IndexCastOp.get(start_ssa, IndexType())
+    end_cast = None # Needs to be completed!
+    step_op = arith.Constant.create(attributes={"value": IntegerAttr.from_index_int_value(1)}, result_types=[IndexType()])
+
+    assigned_var_finder=GetAssignedVariables()
+    for op in loop_stmt.body.blocks[0].ops:
+        assigned_var_finder.traverse(op)
+    carried_vars=get_carried_variables(ctx, loop_stmt, assigned_var_finder.assigned_vars)
+    block_args=[ctx[StringAttr(var_name)] for var_name in carried_vars]
+    block = Block(arg_types=[IndexType()]+[arg.typ for arg in block_args])
+
+    ctx.state.memory_version+=1
+    c = SSAValueCtx(dictionary=dict(), parent_scope=ctx)
+    for idx, var_name in enumerate(carried_vars):
+      c[StringAttr(var_name)]=block.args[idx+1]
+    c[loop_stmt.variable]=block.args[0]
+
+    ops: List[Operation] = []
+    for op in loop_stmt.body.blocks[0].ops:
+        pass # Needs to be completed!
+    block.add_ops(ops+[generate_yield(c, carried_vars)])
+    body=Region()
+    body.add_block(block)
+
+    for_loop=None # Needs to be completed!
+    for i, var_name in enumerate(carried_vars):
+      ctx[StringAttr(var_name)]=for_loop.results[i]
+    ctx.state.memory_version+=1
+
+    return [start_cast, end_cast, step_op, for_loop]
+
+def get_carried_variables(ctx: SSAValueCtx, loop_stmt: tiny_py.Loop, assigned_vars: List[str]) -> List[str]:
+    """
+    The variables assigned in the loop that it carries, which are those live at the start
+    of its body or after it. Without liveness information for the loop every variable
+    assigned in it is carried
+    """
+    live_out=ctx.state.loop_live_out.get(id(loop_stmt))
+    live_in=ctx.state.loop_live_in.get(id(loop_stmt))
+    if live_out is None or live_in is None:
+        carried_vars=list(assigned_vars)
+    else:
+        carried_vars=[var_name for var_name in assigned_vars if var_name in live_in or var_name in live_out]
+    for var_name in carried_vars:
+        if ctx[StringAttr(var_name)] is None:
+            raise Exception(f"Variable `{var_name}' is assigned in a loop and read in a later iteration or after the "
+                            "loop, so it must be assigned before the loop")
+    return carried_vars
+
 def generate_yield(ctx: SSAValueCtx, assigned_vars) -> List[Operation]:
     """
       Generates a yield statement for exiting a block, this exposes
@@ -262,13 +488,67 @@ def translate_assign(ctx: SSAValueCtx,
     var_name = assign.var_name
     assert isinstance(var_name, StringAttr)
 
-    expr, ssa=translate_expr(ctx, assign.value.blocks[0].ops.first)
+    expr, ssa=translate_operand(ctx, assign.value)
+
+    # The type of a variable is set by its first assignment, so if it is later
+    # assigned a value of a different type then we convert to the variable's type
+    if ctx[var_name] is not None:
+        conv, ssa=convert_to_type(ssa, ctx[var_name].typ)
+        expr=expr+conv
 
     # Always update the SSA context as it is this new SSA element that subsequent references
     # to the variable should reference
     ctx[var_name] = ssa
     return expr
 
+def translate_array_indices(ctx: SSAValueCtx,
+                            array_op: Operation) -> Tuple[List[Operation], SSAValue, List[SSAValue]]:
+    """
+    Translates the array and index expressions of an array access or assignment, the
+    array is a memref argument and the indices must be of type index to access it
+    """
+    memref_ssa=ctx[array_op.var_name]
+    if memref_ssa is None:
+        raise Exception(f"Array `{array_op.var_name.data}' being referenced before it is declared")
+    index_exprs=get_operand_list(array_op.indices)
+    if len(index_exprs) != memref_ssa.typ.get_num_dims():
+        raise Exception(f"Array `{array_op.var_name.data}' has {memref_ssa.typ.get_num_dims()} dimensions "
+                        f"but is accessed with {len(index_exprs)} indices")
+    ops: List[Operation] = []
+    indices: List[SSAValue] = []
+    for index in index_exprs:
+        index_ops, index_ssa=translate_operand(ctx, index)
+        conv, index_ssa=convert_expr_to_type(ctx, index_ssa, IndexType())
+        ops+=index_ops+conv
+        indices.append(index_ssa)
+    return ops, memref_ssa, indices
+
+def translate_array_access(ctx: SSAValueCtx,
+                           access: tiny_py.ArrayAccess) -> Tuple[List[Operation], SSAValue]:
+    """
+    Translates reading an element of an array into a memref load
+    """
+    ops, memref_ssa, indices=translate_array_indices(ctx, access)
+    key=("load", memref_ssa, tuple(indices), ctx.state.memory_version)
+    existing=ctx.lookup_expression(key)
+    if existing is not None:
+        return ops, existing
+    load=memref.Load.get(memref_ssa, indices)
+    ctx.record_expression(key, load.results[0])
+    return ops+[load], load.results[0]
+
+def translate_array_assign(ctx: SSAValueCtx,
+                           assign: tiny_py.ArrayAssign) -> List[Operation]:
+    """
+    Translates writing to an element of an array into a memref store, converting the
+    value to the element type of the array if needed
+    """
+    expr, ssa=translate_operand(ctx, assign.value)
+    ops, memref_ssa, indices=translate_array_indices(ctx, assign)
+    conv, ssa=convert_expr_to_type(ctx, ssa, memref_ssa.typ.element_type)
+    ctx.state.memory_version+=1
+    return expr+ops+conv+[memref.Store.get(ssa, memref_ssa, indices)]
+
 def translate_call_expr_stmt(ctx: SSAValueCtx,
                              call_expr: tiny_py.CallExpr, is_expr=False) -> List[Operation]:
     """
@@ -278,10 +558,12 @@ def translate_call_expr_stmt(ctx: SSAValueCtx,
     ops: List[Operation] = []
     args: List[SSAValue] = []
     arg_types = []
+    # The function might write to arrays
+    ctx.state.memory_version+=1
 
     # Generate arguments that will be passed to the call
-    for arg in call_expr.args.blocks[0].ops:
-        op, arg = translate_expr(ctx, arg)
+    for arg in get_operand_list(call_expr.args):
+        op, arg = translate_operand(ctx, arg)
         if op is not None: ops += op
         args.append(arg)
         arg_types.append(arg.typ)
@@ -299,11 +581,16 @@ def translate_call_expr_stmt(ctx: SSAValueCtx,
         name=builtin_function_name_mapping[name]
 
     if name == "printf":
+        if isinstance(args[0].typ, IndexType):
+          # Loop variables are indexes, which are passed to printf as 64 bit integers
+          conv, args[0]=convert_to_type(args[0], i64)
+          ops+=conv
+          arg_types[0]=i64
         # For printf if it is not a string then we need to store and pass the
         # C conversion string
         conv_string=get_printf_conversion_string(args[0].typ)
         if conv_string is not None:
-          conv_ops, conv_ssa = translate_string_into_global_and_get_element_ptr(conv_string)
+          conv_ops, conv_ssa = translate_string_into_global_and_get_element_ptr(ctx, conv_string)
           args.insert(0, conv_ssa)
           arg_types.insert(0, conv_ssa.typ)
           ops+=conv_ops
@@ -326,15 +613,63 @@ def translate_call_expr_stmt(ctx: SSAValueCtx,
     ops.append(call)
 
     if call_expr.builtin.data:
-      global_declarations.append(func.FuncOp.external(name, arg_types, []))
+      # Record the call, as the function is declared once all calls to it are known
+      ctx.state.external_calls.setdefault(name, []).append(call)
 
     return ops
 
+def translate_ssa_call_expr(ctx: SSAValueCtx,
+                            call_expr: tiny_py_ssa.CallExpr) -> List[Operation]:
+    """
+    Translates a call in the SSA form, which is an expression if it has a result
+    """
+    is_expr=len(call_expr.results) > 0
+    ops=translate_call_expr_stmt(ctx, call_expr, is_expr)
+    if is_expr:
+        ctx.state.expression_values[call_expr.results[0]]=ops[-1].results[0]
+    return ops
+
+def generate_external_declarations(state: LoweringState) -> List[Operation]:
+    """
+    Generates one declaration for each external function that is called. If a variadic
+    function, such as printf, is called with different argument types then a func.FuncOp
+    can't describe it, so instead we declare it as an LLVM variadic function and call it
+    via the llvm dialect
+    """
+    declarations=[]
+    for name, calls in state.external_calls.items():
+        arg_types=[arg.typ for arg in calls[0].operands]
+        if all([arg.typ for arg in call.operands] == arg_types for call in calls):
+            declarations.append(func.FuncOp.external(name, arg_types, []))
+        elif name in variadic_functions:
+            declarations.append(get_variadic_declaration(name))
+            for call in calls:
+                convert_to_variadic_call(call)
+        else:
+            raise Exception(f"Function `{name}' is called with different argument types")
+    return declarations
+
+def get_variadic_declaration(name: str) -> LLVMFuncOp:
+    fixed_types, result_type=variadic_functions[name]
+    return LLVMFuncOp.external(name, LLVMFunctionType.get(result_type, fixed_types, True))
+
+def convert_to_variadic_call(call: func.Call):
+    """
+    Replaces a call of an external variadic function via the func dialect with one via
+    the llvm dialect, this call must match the declaration from get_variadic_declaration
+    """
+    name=call.callee.root_reference.data
+    llvm_call=LLVMCallOp.get(name, list(call.operands), [variadic_functions[name][1]])
+    call.parent_block().insert_op_before(llvm_call, call)
+    call.parent_block().erase_op(call)
+
 def get_printf_conversion_string(arg_type):
     if arg_type == f32 or arg_type == f64:
       return "%f"
-    elif arg_type == i32 or arg_type == i64:
+    elif arg_type == i32:
       return "%d"
+    elif arg_type == i64:
+      return "%ld"
     else:
       return None
 
@@ -361,51 +696,113 @@ def try_translate_expr(ctx: SSAValueCtx,
     and the ssa value representing the translated expression.
     Returns None otherwise.
     """
-    if isinstance(op, tiny_py.Constant):
-        op = translate_constant(op)
-        return op
-    if isinstance(op, tiny_py.BinaryOperation):
-        op = translate_binary_expr(ctx, op)
-        return op
-    if isinstance(op, tiny_py.Var):
-        # A variable is very simple, so just handle it here
-        if ctx[op.variable] is None:
-            raise Exception(f"Variable `{op.variable}' being referenced before it is declared")
-        return [], ctx[op.variable]
+    translation=lookup_translation(expression_translations, type(op))
+    if translation is not None:
+        return translation(ctx, op)
 
     return None
 
-def translate_constant(op: tiny_py.Constant) -> Operation:
+def translate_var(ctx: SSAValueCtx, op: tiny_py.Var) -> Tuple[List[Operation], SSAValue]:
+    """
+    A variable is very simple, it is the SSA value currently assigned to it
+    """
+    if ctx[op.variable] is None:
+        raise Exception(f"Variable `{op.variable}' being referenced before it is declared")
+    return [], ctx[op.variable]
+
+def translate_ssa_expr(ctx: SSAValueCtx, op: Operation) -> List[Operation]:
+    """
+    Translates an expression in the SSA form, recording the SSA value of its result for
+    the operations that use it
+    """
+    ops, ssa=lookup_translation(expression_translations, type(op))(ctx, op)
+    ctx.state.expression_values[op.results[0]]=ssa
+    return ops
+
+def translate_operand(ctx: SSAValueCtx,
+                      operand: Region | Operation | SSAValue) -> Tuple[List[Operation], SSAValue]:
+    """
+    Translates an operand of a tiny_py operation. In tiny_py this is an expression, either
+    an operation or the region holding it, which is translated here. In the SSA form it is
+    the result of an expression that has already been translated, as these come before the
+    operations that use them, so the SSA value that it was translated to is returned
+    """
+    if isinstance(operand, SSAValue):
+        return [], ctx.state.expression_values[operand]
+    if isinstance(operand, Region):
+        operand=operand.blocks[0].ops.first
+    return translate_expr(ctx, operand)
+
+def get_operand_list(operands: Region | List[SSAValue]) -> List[Operation | SSAValue]:
+    """
+    The operands of a tiny_py operation that has any number of them (e.g. the indices of an
+    array access), which in tiny_py are the operations in a region and in the SSA form are
+    the operation's operands
+    """
+    if isinstance(operands, Region):
+        return list(operands.blocks[0].ops)
+    return list(operands)
+
+def translate_constant(ctx: SSAValueCtx, op: tiny_py.Constant) -> Operation:
     """
     Translates a constant, literal, depending upon its type
     """
     value = op.attributes["value"]
 
     if isinstance(value, StringAttr):
-        return translate_string_into_global_and_get_element_ptr(value.data)
+        return translate_string_into_global_and_get_element_ptr(ctx, value.data)
+
+    key=get_constant_key(value)
+    existing=ctx.lookup_expression(key) if key is not None else None
+    if existing is not None:
+        return [], existing
 
     if isinstance(value, FloatAttr):
         const= arith.Constant.create(attributes={"value": value},
                                          result_types=[value.type])
+        ctx.record_expression(key, const.results[0])
         return [const], const.results[0]
 
     if isinstance(value, IntegerAttr):
         const= arith.Constant.create(attributes={"value": value},
                                          result_types=[value.typ])
+        ctx.record_expression(key, const.results[0])
         return [const], const.results[0]
 
     raise Exception(f"Could not translate `{op}' as a literal")
 
-def translate_string_into_global_and_get_element_ptr(string_val: str):
-    global string_index
+def get_type_key(typ: Attribute):
+    # Types are not hashable, but the class of a float or index type identifies it and
+    # integer types are identified by their width and signedness
+    if isinstance(typ, IntegerType):
+        return (IntegerType, typ.width.data, typ.signedness.data)
+    return (type(typ),)
 
-    string_identifier="str"+str(string_index)
-    string_index+=1
+def get_constant_key(value: Attribute) -> Optional[tuple]:
+    """
+    A key for the value of a constant, floating point values are compared by their bits
+    so that 0.0 and -0.0 are different constants
+    """
+    if isinstance(value, FloatAttr):
+        return ("float", value.value.data.hex(), get_type_key(value.type))
+    if isinstance(value, IntegerAttr):
+        return ("integer", value.value.data, get_type_key(value.typ))
+    return None
 
+def translate_string_into_global_and_get_element_ptr(ctx: SSAValueCtx, string_val: str):
+    """
+    Looks up a pointer to the string, which is held in a global. Each distinct string
+    only has one global in the module, which is shared by all references to it
+    """
     value=StringAttr(string_val+"\n")
     global_type=llvm.LLVMArrayType.from_size_and_type(len(value.data), IntegerType(8))
-    global_op=llvm.GlobalOp.get(global_type, string_identifier, "internal", 0, True, value=value, unnamed_addr=0)
-    global_declarations.append(global_op)
+
+    string_identifier=ctx.state.string_globals.get(string_val)
+    if string_identifier is None:
+        string_identifier="str"+str(len(ctx.state.string_globals))
+        ctx.state.string_globals[string_val]=string_identifier
+        global_op=llvm.GlobalOp.get(global_type, string_identifier, "internal", 0, True, value=value, unnamed_addr=0)
+        ctx.state.global_ops.append(global_op)
 
     global_lookup=llvm.AddressOfOp.get(string_identifier, llvm.LLVMPointerType.typed(global_type))
     element_pointer=llvm.GEPOp.get(global_lookup.results[0], llvm.LLVMPointerType.typed(IntegerType(8)), [0,0])
@@ -416,27 +813,174 @@ def translate_binary_expr(ctx: SSAValueCtx,
     """
     Translates a binary expression
     """
-    lhs, lhs_ssa=translate_expr(ctx, op.lhs.blocks[0].ops.first)
-    rhs, rhs_ssa=translate_expr(ctx, op.rhs.blocks[0].ops.first)
-    operand_type = lhs_ssa.typ
-    if op.op.data in binary_arith_op_matching:
-        # We match here on the LHS type, for a more advanced coverage if the types are different
-        # then we should convert the lower to the higher type, but we ignore that in our simple example
-        if isinstance(operand_type, IntegerType): index=0
-        if isinstance(operand_type, Float16Type) or isinstance(operand_type, Float32Type
-                        ) or isinstance(operand_type, Float64Type): index=1
-        op_instance=binary_arith_op_matching[op.op.data][index]
-        assert op_instance is not None, "Operation "+op.op.data+" not implemented for type"
-        bin_op=op_instance.get(lhs_ssa, rhs_ssa)
-        return [bin_op], bin_op.results[0]
-    else:
-        raise Exception(f"Could not translate operation `{op.op.data}' as it is unknown")
+    lhs, lhs_ssa=translate_operand(ctx, op.lhs)
+    rhs, rhs_ssa=translate_operand(ctx, op.rhs)
+    key=("binary", op.op.data, lhs_ssa, rhs_ssa)
+    existing=ctx.lookup_expression(key)
+    if existing is not None:
+        return lhs+rhs, existing
+    # If the types of the LHS and RHS are different then we convert the lower to the
+    # higher type (e.g. an integer to a float, or single to double precision)
+    operand_type = get_common_type(lhs_ssa.typ, rhs_ssa.typ)
+    lhs_conv, lhs_ssa=convert_expr_to_type(ctx, lhs_ssa, operand_type)
+    rhs_conv, rhs_ssa=convert_expr_to_type(ctx, rhs_ssa, operand_type)
+    op_instance=get_binary_arith_op(op.op.data, operand_type)
+    # Not all of the arith operations provide a get function, so create them directly (the
+    # operands and result type are already known to be valid, so they don't need checking)
+    bin_op=op_instance.create(operands=[lhs_ssa, rhs_ssa], result_types=[operand_type])
+    ctx.record_expression(key, bin_op.results[0])
+    return lhs+rhs+lhs_conv+rhs_conv+[bin_op], bin_op.results[0]
+
+def get_binary_arith_op(op_name: str, operand_type: Attribute) -> type:
+    """
+    The arith operation for a binary operation undertaken in the operand type, these are
+    held against the operation name and the key of the type once they have been looked up
+    """
+    key=(op_name, get_type_key(operand_type))
+    op_instance=binary_arith_ops.get(key)
+    if op_instance is None:
+        if op_name not in binary_arith_op_matching:
+            raise Exception(f"Could not translate operation `{op_name}' as it is unknown")
+        if isinstance(operand_type, IntegerType) or isinstance(operand_type, IndexType): index=0
+        elif is_float_type(operand_type): index=1
+        else: raise Exception(f"Operation `{op_name}' not implemented for type `{operand_type}'")
+        op_instance=binary_arith_ops[key]=binary_arith_op_matching[op_name][index]
+    return op_instance
+
+def is_float_type(typ: Attribute) -> bool:
+    return isinstance(typ, Float16Type) or isinstance(typ, Float32Type) or isinstance(typ, Float64Type)
+
+def get_type_width(typ: Attribute) -> int:
+    if isinstance(typ, IntegerType):
+        return typ.width.data
+    if isinstance(typ, IndexType):
+        # Indexes are 64 bit on the machines that we target
+        return 64
+    return {Float16Type: 16, Float32Type: 32, Float64Type: 64}[type(typ)]
+
+def get_common_type(lhs: Attribute, rhs: Attribute) -> Attribute:
+    """
+    The type that a binary operation is undertaken in, floating point wins over integers
+    and otherwise the wider of the two types is used
+    """
+    if lhs == rhs:
+        return lhs
+    if is_float_type(lhs) != is_float_type(rhs):
+        return lhs if is_float_type(lhs) else rhs
+    if isinstance(lhs, IndexType) or isinstance(rhs, IndexType):
+        return IndexType()
+    return lhs if get_type_width(lhs) >= get_type_width(rhs) else rhs
+
+def convert_expr_to_type(ctx: SSAValueCtx, ssa: SSAValue, typ: Attribute) -> Tuple[List[Operation], SSAValue]:
+    """
+    Converts the value of an expression to another type, reusing an earlier conversion of
+    the same value where there is one in scope
+    """
+    key=("convert", ssa, get_type_key(typ))
+    existing=ctx.lookup_expression(key)
+    if existing is not None:
+        return [], existing
+    ops, converted=convert_to_type(ssa, typ)
+    if len(ops) > 0:
+        ctx.record_expression(key, converted)
+    return ops, converted
+
+def convert_to_type(ssa: SSAValue, typ: Attribute) -> Tuple[List[Operation], SSAValue]:
+    """
+    Converts an SSA value to another type, returning the conversion operations (empty
+    if it is already of that type) and the converted SSA value
+    """
+    if ssa.typ == typ:
+        return [], ssa
+    if is_float_type(ssa.typ) and is_float_type(typ):
+        if get_type_width(ssa.typ) < get_type_width(typ):
+            conv=arith.ExtFOp.get(ssa, typ)
+        else:
+            # TruncFOp.get in xDSL builds an ExtFOp, so we build the operation directly
+            conv=arith.TruncFOp.build(operands=[ssa], result_types=[typ])
+        return [conv], conv.results[0]
+    if is_float_type(typ):
+        # Indexes can't be converted to floats directly, so go via a 64 bit integer
+        ops, ssa=convert_to_type(ssa, i64) if isinstance(ssa.typ, IndexType) else ([], ssa)
+        conv=arith.SIToFPOp.get(ssa, typ)
+        return ops+[conv], conv.results[0]
+    if is_float_type(ssa.typ):
+        conv=arith.FPToSIOp.get(ssa, i64 if isinstance(typ, IndexType) else typ)
+        ops, ssa=convert_to_type(conv.results[0], typ)
+        return [conv]+ops, ssa
+    if isinstance(ssa.typ, IndexType) or isinstance(typ, IndexType):
+        conv=arith.IndexCastOp.get(ssa, typ)
+        return [conv], conv.results[0]
+    # There is no direct conversion between integer widths here, so we go via an index
+    ops, ssa=convert_to_type(ssa, IndexType())
+    conv=arith.IndexCastOp.get(ssa, typ)
+    return ops+[conv], conv.results[0]
+
+# The translation of each class of operation, as a statement or as an expression. Operations
+# are looked up by their class here rather than checked in turn, so translations for further
+# operations can be added with register_statement_translation and register_expression_translation
+statement_translations: Dict[type, Callable]={}
+expression_translations: Dict[type, Callable]={}
+
+def register_statement_translation(op_class: type, translation: Callable[[SSAValueCtx, Operation], List[Operation]]):
+    statement_translations[op_class]=translation
+
+def register_expression_translation(op_class: type,
+        translation: Callable[[SSAValueCtx, Operation], Tuple[List[Operation], SSAValue]]):
+    """
+    Registers the translation of an expression, which returns the operations and the SSA value of
+    the result. In the SSA form the expression is also a statement, whose result is recorded
+    """
+    expression_translations[op_class]=translation
+
+def lookup_translation(translations: Dict[type, Callable], op_class: type) -> Optional[Callable]:
+    """
+    The translation of the class of operation, or of the nearest class that it is derived from
+    which has one (this is then held against the class so it is only searched for once)
+    """
+    translation=translations.get(op_class)
+    if translation is None and op_class not in translations:
+        for base_class in op_class.__mro__[1:]:
+            translation=translations.get(base_class)
+            if translation is not None: break
+        translations[op_class]=translation
+    return translation
+
+register_statement_translation(tiny_py.CallExpr, translate_call_expr_stmt)
+register_statement_translation(tiny_py.Return, translate_return)
+register_statement_translation(tiny_py.Assign, translate_assign)
+register_statement_translation(tiny_py.Loop, translate_loop)
+register_statement_translation(tiny_py.ArrayAssign, translate_array_assign)
+register_expression_translation(tiny_py.Constant, translate_constant)
+register_expression_translation(tiny_py.BinaryOperation, translate_binary_expr)
+register_expression_translation(tiny_py.ArrayAccess, translate_array_access)
+register_expression_translation(tiny_py.Var, translate_var)
+
+register_statement_translation(tiny_py_ssa.CallExpr, translate_ssa_call_expr)
+register_statement_translation(tiny_py_ssa.Return, translate_return)
+register_statement_translation(tiny_py_ssa.Assign, translate_assign)
+register_statement_translation(tiny_py_ssa.Loop, translate_ssa_loop)
+register_statement_translation(tiny_py_ssa.ArrayAssign, translate_array_assign)
+register_expression_translation(tiny_py_ssa.Constant, translate_constant)
+register_expression_translation(tiny_py_ssa.BinaryOperation, translate_binary_expr)
+register_expression_translation(tiny_py_ssa.ArrayAccess, translate_array_access)
+register_expression_translation(tiny_py_ssa.Var, translate_var)
+
+# The arith operation for each binary operation and type key, the common types are filled in
+# here and any others when they are first used
+binary_arith_ops: Dict[tuple, type]={}
+for op_name in binary_arith_op_matching:
+    for typ in [i32, i64, IndexType(), Float16Type(), Float32Type(), Float64Type()]:
+        get_binary_arith_op(op_name, typ)
 
 @dataclass
 class LowerTinyPyToStandard(ModulePass):
 
   name = 'tiny-py-to-standard'
 
+  entry_point: bool = True
+  eliminate_common_subexpressions: bool = True
+
   def apply(self, ctx: MLContext, input_module: ModuleOp):
-      res_module = translate_program(input_module)
+      res_module = translate_program(input_module, self.entry_point, self.eliminate_common_subexpressions)
       res_module.regions[0].move_blocks(input_module.regions[0])
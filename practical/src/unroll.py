@@ -0,0 +1,202 @@
+from xdsl.dialects.builtin import ModuleOp, IndexType
+from xdsl.ir import Operation, SSAValue, Block, MLContext
+from xdsl.dialects import scf, arith
+from dataclasses import dataclass
+from typing import List, Tuple
+from xdsl.passes import ModulePass
+from for_to_parallel import get_constant_value, matched_operations
+from parallel_legality import classify_iter_arg, IterArgKind, reduction_identities
+from tile_loops import get_trip_count, build_identity
+
+"""
+Unrolls scf.for loops, which removes the overhead of the loop itself and gives the
+backend independent operations to schedule together. Loops with a constant trip count
+up to full_unroll_threshold are replaced by a copy of the body for each iteration. Other
+loops are partially unrolled, with a main loop whose body is factor copies of the original
+body and which steps by factor iterations at a time, followed by the original loop as an
+epilogue for any remaining iterations.
+
+When a loop is partially unrolled, each copy of the body normally uses the values yielded
+by the copy before it. For reductions (e.g. v=v+a[i]) this is one chain of dependent
+operations, so each iteration must wait for the previous one to complete. Instead, when
+split_reductions is set, the main loop carries factor partial values for each reduction,
+one updated by each copy of the body. Every partial value but the first starts from the
+identity of the reduction, and they are combined after the main loop, so the copies are
+independent of each other. As with for-to-parallel, this changes the order in which
+floating point values are combined.
+
+Only loops that are innermost before the pass runs are unrolled, so a loop whose inner
+loops are fully unrolled is not then unrolled itself, as the copies would multiply.
+"""
+
+def clone_iteration(body: Block, induction_var: SSAValue, args: List[SSAValue]) -> Tuple[List[Operation], List[SSAValue]]:
+    """
+    Copies the body of a loop for one iteration, returning the copied operations and the
+    values that the iteration yields
+    """
+    value_mapper={body.args[0]: induction_var}
+    value_mapper.update(zip(body.args[1:], args))
+    ops=[op.clone(value_mapper=value_mapper) for op in body.ops if not isinstance(op, scf.Yield)]
+    yielded=[value_mapper.get(value, value) for value in body.ops.last.operands]
+    return ops, yielded
+
+def is_innermost(for_loop: scf.For) -> bool:
+    inner_loops=[]
+    for op in for_loop.body.blocks[0].ops:
+        op.walk(lambda inner: inner_loops.append(inner) if isinstance(inner, scf.For) or
+                isinstance(inner, scf.ParallelOp) else None)
+    return len(inner_loops) == 0
+
+def unroll_fully(for_loop: scf.For, trip_count: int):
+    """
+    Replaces the loop with a copy of its body for each iteration, the induction variable
+    of each copy is a constant
+    """
+    parent_block=for_loop.parent_block()
+    body=for_loop.body.blocks[0]
+    lb=get_constant_value(for_loop.lb)
+    step=get_constant_value(for_loop.step)
+    current=list(for_loop.iter_args)
+    new_ops=[]
+    for iteration in range(trip_count):
+        induction_var=arith.Constant.from_int_and_width(lb+iteration*step, IndexType())
+        ops, current=clone_iteration(body, induction_var.results[0], current)
+        new_ops+=[induction_var]+ops
+    parent_block.insert_ops_before(new_ops, for_loop)
+    for old_result, new_result in zip(for_loop.results, current):
+        old_result.replace_by(new_result)
+    parent_block.erase_op(for_loop)
+
+def unroll_partially(for_loop: scf.For, factor: int, split_reductions: bool, full_unroll_threshold: int):
+    """
+    Builds the main loop, which runs up to lb + ((ub - lb) / (step * factor)) * (step * factor),
+    and then runs the original loop from there as the epilogue
+    """
+    parent_block=for_loop.parent_block()
+    body=for_loop.body.blocks[0]
+    step=get_constant_value(for_loop.step)
+    trip_count=get_trip_count(for_loop.lb, for_loop.ub, for_loop.step)
+    new_ops=[]
+
+    main_step=arith.Constant.from_int_and_width(step*factor, IndexType())
+    new_ops.append(main_step)
+    if trip_count is not None:
+        # With constant bounds the end of the main loop is known
+        main_ub=arith.Constant.from_int_and_width(get_constant_value(for_loop.lb)+
+                                                 (trip_count//factor)*factor*step, IndexType())
+        new_ops.append(main_ub)
+    else:
+        loop_range=arith.Subi.get(for_loop.ub, for_loop.lb)
+        main_iterations=arith.DivSI.build(operands=[loop_range, main_step], result_types=[IndexType()])
+        main_range=arith.Muli.get(main_iterations, main_step)
+        main_ub=arith.Addi.build(operands=[for_loop.lb, main_range], result_types=[IndexType()])
+        new_ops+=[loop_range, main_iterations, main_range, main_ub]
+
+    # Decide which loop carried values are split, these each have factor slots in the main
+    # loop and the others have one
+    split_kinds=[]
+    for idx in range(len(for_loop.iter_args)):
+        classification=classify_iter_arg(for_loop, idx, matched_operations)
+        if (split_reductions and classification.kind == IterArgKind.REDUCTION and
+                classification.reduction_kind in reduction_identities):
+            split_kinds.append(classification.reduction_kind)
+        else:
+            split_kinds.append(None)
+
+    init_values=[]
+    for init, kind in zip(for_loop.iter_args, split_kinds):
+        init_values.append(init)
+        if kind is not None:
+            identity=build_identity(kind, init.typ)
+            new_ops.append(identity)
+            init_values+=[identity.results[0]]*(factor-1)
+
+    main_block=Block(arg_types=[IndexType()]+[value.typ for value in init_values])
+    slots=[]
+    position=1
+    for kind in split_kinds:
+        count=factor if kind is not None else 1
+        slots.append(list(main_block.args[position:position+count]))
+        position+=count
+
+    # Each copy of the body runs the iteration that is its number of steps on from the
+    # induction variable of the main loop
+    current=[arg_slots[0] for arg_slots in slots]
+    split_yields=[[] for _ in slots]
+    for copy in range(factor):
+        if copy == 0 or len(body.args[0].uses) == 0:
+            induction_var=main_block.args[0]
+        else:
+            offset=arith.Constant.from_int_and_width(copy*step, IndexType())
+            offset_iv=arith.Addi.build(operands=[main_block.args[0], offset], result_types=[IndexType()])
+            main_block.add_ops([offset, offset_iv])
+            induction_var=offset_iv.results[0]
+        args=[arg_slots[copy] if kind is not None else value for arg_slots, kind, value in zip(slots, split_kinds, current)]
+        ops, yielded=clone_iteration(body, induction_var, args)
+        main_block.add_ops(ops)
+        for idx, (kind, value) in enumerate(zip(split_kinds, yielded)):
+            if kind is not None:
+                split_yields[idx].append(value)
+            else:
+                current[idx]=value
+    main_yields=[]
+    for kind, value, values in zip(split_kinds, current, split_yields):
+        main_yields+=values if kind is not None else [value]
+    main_block.add_op(scf.Yield.get(*main_yields))
+    main_loop=scf.For.get(for_loop.lb, main_ub, main_step, init_values, main_block)
+    new_ops.append(main_loop)
+
+    # Combine the partial values of each split reduction, which then start the epilogue
+    epilogue_inits=[]
+    position=0
+    for kind, arg_slots in zip(split_kinds, slots):
+        combined=main_loop.results[position]
+        for partial in main_loop.results[position+1:position+len(arg_slots)]:
+            combine_op=matched_operations[kind].build(operands=[combined, partial], result_types=[combined.typ])
+            new_ops.append(combine_op)
+            combined=combine_op.results[0]
+        epilogue_inits.append(combined)
+        position+=len(arg_slots)
+    parent_block.insert_ops_before(new_ops, for_loop)
+
+    # The operands of scf.for are the lower bound, upper bound, step and then the loop's values
+    if trip_count is not None and trip_count % factor == 0:
+        for old_result, new_result in zip(for_loop.results, epilogue_inits):
+            old_result.replace_by(new_result)
+        parent_block.erase_op(for_loop)
+        return
+    for_loop.replace_operand(0, main_ub.results[0])
+    for idx, init in enumerate(epilogue_inits):
+        for_loop.replace_operand(3+idx, init)
+    if trip_count is not None and trip_count % factor <= full_unroll_threshold:
+        unroll_fully(for_loop, trip_count % factor)
+
+@dataclass
+class UnrollLoops(ModulePass):
+  """
+  This is the entry point for the transformation pass. Loops with a constant trip count
+  of at most full_unroll_threshold are fully unrolled, and others are unrolled by factor
+  with split_reductions controlling whether reductions are split into partial values, e.g.
+  unroll{factor=8 full-unroll-threshold=4}. A factor of one disables partial unrolling
+  """
+  name = 'unroll'
+
+  full_unroll_threshold: int = 8
+  factor: int = 4
+  split_reductions: bool = True
+
+  def apply(self, ctx: MLContext, input_module: ModuleOp):
+    if self.factor < 1:
+      raise Exception(f"The unroll factor must be at least one, but it is {self.factor}")
+
+    loops=[]
+    input_module.walk(lambda op: loops.append(op) if isinstance(op, scf.For) and is_innermost(op) else None)
+    for for_loop in loops:
+      step=get_constant_value(for_loop.step)
+      if step is None or step <= 0:
+        continue
+      trip_count=get_trip_count(for_loop.lb, for_loop.ub, for_loop.step)
+      if trip_count is not None and trip_count <= self.full_unroll_threshold:
+        unroll_fully(for_loop, trip_count)
+      elif self.factor > 1:
+        unroll_partially(for_loop, self.factor, self.split_reductions, self.full_unroll_threshold)
@@ -0,0 +1,103 @@
+import glob
+import multiprocessing
+import os
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+"""
+Compiles many input files in one invocation, which is used by tinypy-opt --batch. The inputs
+are given as file names, glob patterns (e.g. kernels/*.mlir) or @file where file lists one
+input per line. Each input is compiled to a file of the same name in the output directory,
+and the inputs are spread over a pool of worker processes which are forked once everything
+has been set up, so the cost of starting up is paid once for all of the inputs. The
+compilation of one input failing does not stop the others, instead the failures are listed
+in a summary once all inputs are done.
+
+This knows nothing about compilation itself, it calls the function it is given with each input
+and output file which returns the result.
+"""
+
+@dataclass
+class BatchResult:
+    input_file: str
+    output_file: str
+    succeeded: bool
+    # Why the compilation failed, and anything else it printed (e.g. remarks from the passes)
+    error: Optional[str] = None
+    messages: str = ""
+
+def expand_inputs(patterns: List[str]) -> Tuple[List[str], List[str]]:
+    """
+    The input files for the patterns, in order and without duplicates, along with the patterns
+    that did not match any file
+    """
+    files: Dict[str, None]={}
+    unmatched=[]
+    for pattern in patterns:
+        if pattern.startswith("@"):
+            with open(pattern[1:]) as f:
+                matches=[line.strip() for line in f if len(line.strip()) > 0]
+        elif glob.has_magic(pattern):
+            matches=sorted(glob.glob(pattern, recursive=True))
+        else:
+            matches=[pattern] if os.path.exists(pattern) else []
+        if len(matches) == 0:
+            unmatched.append(pattern)
+        for match in matches:
+            files[match]=None
+    return list(files), unmatched
+
+def get_output_files(input_files: List[str], output_dir: str, extension: Optional[str] = None) -> List[str]:
+    """
+    The output file of each input, which is the input's name in the output directory, with its
+    extension replaced if one is given (e.g. by .o for objects). It is an error for an output
+    to overwrite an input or for two inputs to have the same output
+    """
+    names=[os.path.basename(input_file) for input_file in input_files]
+    if extension is not None:
+        names=[os.path.splitext(name)[0]+extension for name in names]
+    outputs=[os.path.join(output_dir, name) for name in names]
+    clashes=sorted(set(output for output in outputs if outputs.count(output) > 1))
+    if len(clashes) > 0:
+        raise Exception(f"Inputs with the same name would be written to the same output file: {', '.join(clashes)}")
+    for input_file, output in zip(input_files, outputs):
+        if os.path.realpath(input_file) == os.path.realpath(output):
+            raise Exception(f"The output of `{input_file}' would overwrite it, use another output directory")
+    return outputs
+
+# The function that compiles each file in the workers, this is set before the workers are
+# forked so that they inherit it, as the function itself can not be sent to them
+compile_file_in_worker: Optional[Callable[[str, str], BatchResult]]=None
+
+def compile_in_worker(files: Tuple[str, str]) -> BatchResult:
+    input_file, output_file=files
+    try:
+        return compile_file_in_worker(input_file, output_file)
+    except Exception as e:
+        return BatchResult(input_file, output_file, False, f"{type(e).__name__}: {e}")
+
+def compile_batch(input_files: List[str], output_files: List[str],
+                  compile_file: Callable[[str, str], BatchResult], jobs: int | None = None) -> List[BatchResult]:
+    """
+    Compiles each input to its output, over jobs worker processes (by default one per CPU).
+    The results are in the same order as the inputs
+    """
+    global compile_file_in_worker
+    if jobs is None:
+        jobs=os.cpu_count() or 1
+    compile_file_in_worker=compile_file
+    work=list(zip(input_files, output_files))
+    if jobs == 1 or len(work) <= 1:
+        return [compile_in_worker(files) for files in work]
+    with multiprocessing.get_context("fork").Pool(min(jobs, len(work))) as pool:
+        return list(pool.imap(compile_in_worker, work, chunksize=1))
+
+def format_summary(results: List[BatchResult], unmatched: List[str]) -> str:
+    failures=[result for result in results if not result.succeeded]
+    lines=[f"Compiled {len(results)-len(failures)} of {len(results)} files"
+           + (f", {len(failures)} failed:" if len(failures) > 0 else "")]
+    for result in failures:
+        lines.append(f"  {result.input_file}: {result.error}")
+    for pattern in unmatched:
+        lines.append(f"  No files match `{pattern}'")
+    return "\n".join(lines)
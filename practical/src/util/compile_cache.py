@@ -0,0 +1,130 @@
+import hashlib
+import os
+import tempfile
+from typing import List, Optional
+
+"""
+A content addressed on-disk cache for the artefacts that our compiler generates. Each
+entry is a single file in the cache directory whose name is the hash of everything that
+went into producing it (e.g. the source of a function and the version of the compiler).
+If any of these inputs change then the hash changes, so we never need to invalidate
+entries explicitly, old entries are simply evicted least recently used first once the
+cache grows beyond its size limit.
+"""
+
+DEFAULT_CACHE_DIR=os.path.join(os.path.expanduser("~"), ".cache", "tinypy")
+DEFAULT_CACHE_SIZE=64 * 1024 * 1024
+
+def hash_key(*parts: str | bytes) -> str:
+    """
+    Builds the key of a cache entry by hashing all the provided parts, we include
+    the length of each part so that different splits of the same text never collide
+    """
+    hasher=hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part=part.encode("utf-8")
+        hasher.update(str(len(part)).encode("utf-8")+b":")
+        hasher.update(part)
+    return hasher.hexdigest()
+
+def hash_files(paths: List[str]) -> str:
+    """
+    Hashes the contents of a number of files, this is useful for versioning the cache
+    on the source of the compiler itself so any change to it invalidates old entries
+    """
+    contents=[]
+    for path in paths:
+        with open(path, "rb") as f:
+            contents.append(f.read())
+    return hash_key(*contents)
+
+class CompileCache:
+    """
+    The cache itself, entries are looked up by key and suffix (the suffix denotes the
+    kind of artefact, for instance .mlir for IR text or .so for a shared object). A lookup
+    refreshes the modification time of the entry, and it is this time that is used to
+    determine which entries are least recently used when evicting.
+    """
+    def __init__(self, directory: str | None = None, max_size: int | None = None):
+        if directory is None:
+            directory=os.environ.get("TINYPY_CACHE_DIR", DEFAULT_CACHE_DIR)
+        if max_size is None:
+            max_size=int(os.environ.get("TINYPY_CACHE_SIZE", DEFAULT_CACHE_SIZE))
+        self.directory=directory
+        self.max_size=max_size
+
+    def path_of(self, key: str, suffix: str) -> str:
+        return os.path.join(self.directory, key+suffix)
+
+    def lookup(self, key: str, suffix: str) -> Optional[str]:
+        """
+        Returns the path of the entry if it is in the cache, or None otherwise
+        """
+        path=self.path_of(key, suffix)
+        try:
+            # Touching the file marks it as most recently used
+            os.utime(path)
+        except OSError:
+            return None
+        return path
+
+    def read_text(self, key: str, suffix: str) -> Optional[str]:
+        path=self.lookup(key, suffix)
+        if path is None:
+            return None
+        try:
+            with open(path, "r") as f:
+                return f.read()
+        except OSError:
+            # Might have been evicted by another process between the lookup and read
+            return None
+
+    def insert(self, key: str, suffix: str, contents: str | bytes) -> Optional[str]:
+        """
+        Adds an entry to the cache and returns its path. We write to a temporary file
+        and then rename, so that concurrent readers never see a partially written entry.
+        An entry that is larger than the whole cache would be evicted straight away, so
+        it is not cached and None is returned, the caller then uses the contents directly
+        """
+        if isinstance(contents, str):
+            contents=contents.encode("utf-8")
+        if len(contents) > self.max_size:
+            return None
+
+        os.makedirs(self.directory, exist_ok=True)
+        path=self.path_of(key, suffix)
+        fd, tmp_path=tempfile.mkstemp(dir=self.directory, prefix=".tmp-")
+        with os.fdopen(fd, "wb") as f:
+            f.write(contents)
+        os.replace(tmp_path, path)
+        # The other entries of this key are kept, as these are often used together, e.g.
+        # the shared object of a kernel is inserted before its signature and then loaded
+        self.evict(keep_key=key)
+        return path
+
+    def evict(self, keep_key: Optional[str] = None):
+        """
+        Removes least recently used entries until the cache is within its size limit,
+        apart from the entries of keep_key which are never removed
+        """
+        entries=[]
+        total_size=0
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.startswith(".tmp-") or not entry.is_file():
+                    continue
+                stat=entry.stat()
+                total_size+=stat.st_size
+                if keep_key is None or not entry.name.startswith(keep_key):
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        entries.sort()
+        for _, size, path in entries:
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total_size-=size
@@ -0,0 +1,139 @@
+import json
+import resource
+import sys
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+"""
+Collects where the time of a compilation goes and how big the IR is as it progresses, this
+is reported by tinypy-opt with the --timing and --stats flags. Timing records the wall time
+of each stage (parsing, verification, each pass and printing) along with the peak resident
+set size of the process once the stage has finished, as this is the high water mark it only
+goes up, so a stage that increases it is the one that needed the memory. Statistics count
+the operations in the IR, by dialect and by operation name, before and after each pass.
+
+The report is either text, which is meant to be read, or JSON which is meant for other
+tools (e.g. dashboards) to consume, and is written to stderr unless a file is given so
+that it does not mix with the IR that is output.
+"""
+
+def get_peak_rss_mb() -> float:
+    # On Linux ru_maxrss is in kilobytes, on macOS it is in bytes
+    peak=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak/(1024*1024) if sys.platform == "darwin" else peak/1024
+
+def count_operations(module) -> Dict[str, Dict[str, int]]:
+    """
+    The number of operations of each name in the module, held by dialect (which is the
+    part of the name before the first dot), the module itself is included
+    """
+    counts: Dict[str, Dict[str, int]]={}
+    def count(op):
+        dialect=op.name.split(".", 1)[0]
+        dialect_counts=counts.setdefault(dialect, {})
+        dialect_counts[op.name]=dialect_counts.get(op.name, 0)+1
+    module.walk(count)
+    return counts
+
+def summarise_counts(counts: Dict[str, Dict[str, int]]) -> Dict[str, object]:
+    return {"total": sum(sum(ops.values()) for ops in counts.values()),
+            "dialects": {dialect: {"total": sum(ops.values()), "ops": dict(sorted(ops.items()))}
+                         for dialect, ops in sorted(counts.items())}}
+
+class CompileReport:
+    """
+    The timings and statistics of one compilation, timing and statistics are only gathered
+    if they are enabled so there is no overhead otherwise
+    """
+    def __init__(self, timing: bool = False, stats: bool = False):
+        self.timing=timing
+        self.stats=stats
+        self.stages: List[Dict[str, object]]=[]
+        self.pass_stats: List[Dict[str, object]]=[]
+        self.input_stats: Optional[Dict[str, object]]=None
+
+    @contextmanager
+    def stage(self, name: str, kind: str):
+        """
+        Times the code run within this, the kind is the sort of stage (parse, verify, pass
+        or print) and the name identifies it, e.g. the name of the pass
+        """
+        if not self.timing:
+            yield
+            return
+        start=time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages.append({"stage": name, "kind": kind, "seconds": time.perf_counter()-start,
+                                "peak_rss_mb": round(get_peak_rss_mb(), 1)})
+
+    def record_input(self, module):
+        if self.stats:
+            self.input_stats=summarise_counts(count_operations(module))
+
+    def record_pass(self, pass_name: str, before: Optional[Dict[str, object]], module):
+        """
+        Records the operation counts after a pass, before is the counts before it (which are
+        those after the previous pass or of the input)
+        """
+        if self.stats:
+            self.pass_stats.append({"pass": pass_name, "before": before,
+                                    "after": summarise_counts(count_operations(module))})
+
+    def current_stats(self) -> Optional[Dict[str, object]]:
+        if len(self.pass_stats) > 0:
+            return self.pass_stats[-1]["after"]
+        return self.input_stats
+
+    def to_json(self) -> Dict[str, object]:
+        report: Dict[str, object]={}
+        if self.timing:
+            report["timing"]={"stages": self.stages,
+                              "total_seconds": sum(stage["seconds"] for stage in self.stages),
+                              "peak_rss_mb": round(get_peak_rss_mb(), 1)}
+        if self.stats:
+            report["stats"]={"input": self.input_stats, "passes": self.pass_stats}
+        return report
+
+    def format_text(self) -> str:
+        lines: List[str]=[]
+        if self.timing:
+            total=sum(stage["seconds"] for stage in self.stages)
+            lines.append("===- Compilation timing -===")
+            lines.append(f"  Total wall time: {total:.4f}s, peak RSS: {get_peak_rss_mb():.1f}MB")
+            lines.append(f"  {'Wall time (s)':>14} {'%':>6} {'Peak RSS (MB)':>14}  Stage")
+            for stage in self.stages:
+                share=100*stage["seconds"]/total if total > 0 else 0
+                label=stage["stage"] if stage["kind"] == stage["stage"] else f"{stage['kind']}: {stage['stage']}"
+                lines.append(f"  {stage['seconds']:>14.4f} {share:>5.1f}% {stage['peak_rss_mb']:>14.1f}  {label}")
+        if self.stats:
+            lines.append("===- IR statistics -===")
+            if self.input_stats is not None:
+                lines.append(f"  input: {self.input_stats['total']} operations")
+                lines+=format_counts(self.input_stats)
+            for pass_stats in self.pass_stats:
+                before=pass_stats["before"]["total"] if pass_stats["before"] is not None else 0
+                lines.append(f"  after {pass_stats['pass']}: {pass_stats['after']['total']} operations "
+                             f"(from {before})")
+                lines+=format_counts(pass_stats["after"])
+        return "\n".join(lines)
+
+    def write(self, format: str = "text", output_file: Optional[str] = None):
+        if not self.timing and not self.stats:
+            return
+        contents=json.dumps(self.to_json(), indent=2) if format == "json" else self.format_text()
+        if output_file is None:
+            print(contents, file=sys.stderr)
+        else:
+            with open(output_file, "w") as f:
+                f.write(contents+"\n")
+
+def format_counts(stats: Dict[str, object]) -> List[str]:
+    lines=[]
+    for dialect, dialect_stats in stats["dialects"].items():
+        lines.append(f"    {dialect_stats['total']:>8}  {dialect}")
+        for op_name, count in dialect_stats["ops"].items():
+            lines.append(f"      {count:>8}  {op_name}")
+    return lines
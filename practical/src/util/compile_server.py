@@ -0,0 +1,194 @@
+import json
+import os
+import signal
+import socket
+import struct
+import sys
+import tempfile
+import traceback
+from typing import Callable, Dict, Optional
+
+"""
+A server that stays resident and handles compile requests over a local Unix socket, so that
+Python startup, importing xDSL and registering the dialects and passes is paid once rather
+than by every invocation of the tool. This is used by tinypy-opt --serve, with the
+tinypy-opt-client tool sending the requests, but the server itself knows nothing about
+compilation and just calls the function it is given on each request.
+
+Requests are handled by a pool of worker processes which are forked from the server once it
+is set up, so each starts with everything already imported. Every worker accepts connections
+on the same listening socket, handling one request at a time, so up to the number of workers
+requests are handled at once and the others wait in the socket's backlog. A worker exits once
+it has handled a number of requests, and any worker that exits (or crashes) is replaced by a
+new one forked from the server, which keeps the state of the workers from growing over time.
+
+Each message (a request or its response) is a JSON object, sent as its length in bytes as an
+eight byte big endian integer followed by the UTF-8 encoded text. The client sends one request
+on a connection and reads one response.
+"""
+
+DEFAULT_MAX_REQUESTS_PER_WORKER=1000
+
+def get_default_socket_path() -> str:
+    """
+    The socket used if one is not given, this can be set via the TINYPY_SERVER_SOCKET
+    environment variable and otherwise is per user in the temporary directory
+    """
+    return os.environ.get("TINYPY_SERVER_SOCKET",
+                          os.path.join(tempfile.gettempdir(), f"tinypy-opt-{os.getuid()}.sock"))
+
+def get_default_worker_count() -> int:
+    return os.cpu_count() or 1
+
+def send_message(sock: socket.socket, message: Dict[str, object]):
+    data=json.dumps(message).encode("utf-8")
+    sock.sendall(struct.pack("!Q", len(data))+data)
+
+def receive_exactly(sock: socket.socket, size: int) -> Optional[bytes]:
+    """
+    Reads size bytes from the socket, returning None if it is closed before then
+    """
+    chunks=[]
+    while size > 0:
+        chunk=sock.recv(min(size, 1024*1024))
+        if len(chunk) == 0:
+            return None
+        chunks.append(chunk)
+        size-=len(chunk)
+    return b"".join(chunks)
+
+def receive_message(sock: socket.socket) -> Optional[Dict[str, object]]:
+    header=receive_exactly(sock, 8)
+    if header is None:
+        return None
+    data=receive_exactly(sock, struct.unpack("!Q", header)[0])
+    if data is None:
+        return None
+    return json.loads(data.decode("utf-8"))
+
+def send_request(socket_path: str, request: Dict[str, object]) -> Dict[str, object]:
+    """
+    Sends a request to the server and waits for its response
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        send_message(sock, request)
+        response=receive_message(sock)
+    if response is None:
+        raise Exception(f"The server at `{socket_path}' closed the connection without responding")
+    return response
+
+def is_server_running(socket_path: str) -> bool:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(socket_path)
+            return True
+        except OSError:
+            return False
+
+def create_listener(socket_path: str) -> socket.socket:
+    """
+    Listens on the socket, a socket file left behind by a server that is no longer running
+    is removed but it is an error if a server is still running on it
+    """
+    if os.path.exists(socket_path):
+        if is_server_running(socket_path):
+            raise Exception(f"A server is already running on `{socket_path}'")
+        os.unlink(socket_path)
+    listener=socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    # Only the user running the server can send it requests, the socket is created with
+    # these permissions (rather than changed after binding) so that there is no window
+    # in which another user could connect
+    old_umask=os.umask(0o077)
+    try:
+        listener.bind(socket_path)
+    finally:
+        os.umask(old_umask)
+    listener.listen(128)
+    return listener
+
+def run_worker(listener: socket.socket, handle_request: Callable[[Dict[str, object]], Dict[str, object]],
+               max_requests: int):
+    """
+    The loop of a worker process, which handles requests until it has handled max_requests
+    """
+    for _ in range(max_requests):
+        connection, _=listener.accept()
+        with connection:
+            try:
+                request=receive_message(connection)
+                if request is None:
+                    continue
+                response=handle_request(request)
+            except Exception:
+                response={"exit_code": 1, "stdout": "", "stderr": traceback.format_exc()}
+            try:
+                send_message(connection, response)
+            except OSError:
+                # The client has gone away, so there is nobody to tell
+                pass
+
+def start_worker(listener: socket.socket, handle_request: Callable[[Dict[str, object]], Dict[str, object]],
+                 max_requests: int) -> int:
+    pid=os.fork()
+    if pid != 0:
+        return pid
+    # In the worker, which stops on the signals that the server forwards to it and must not
+    # return into the server's code, so always leaves via os._exit
+    exit_code=0
+    try:
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        run_worker(listener, handle_request, max_requests)
+    except BaseException:
+        traceback.print_exc()
+        exit_code=1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(exit_code)
+
+def serve(socket_path: str, handle_request: Callable[[Dict[str, object]], Dict[str, object]],
+          workers: int | None = None, max_requests: int = DEFAULT_MAX_REQUESTS_PER_WORKER):
+    """
+    Runs the server until it receives SIGTERM or SIGINT, handle_request is called in a worker
+    with each request and returns the response. Everything that handle_request needs should be
+    set up before this is called, so that the workers inherit it
+    """
+    if workers is None:
+        workers=get_default_worker_count()
+    if workers < 1:
+        raise Exception(f"The server needs at least one worker, not {workers}")
+    listener=create_listener(socket_path)
+    stopping=False
+    children=set()
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping=True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    previous_handlers={signum: signal.signal(signum, stop) for signum in [signal.SIGTERM, signal.SIGINT]}
+    try:
+        for _ in range(workers):
+            children.add(start_worker(listener, handle_request, max_requests))
+        print(f"Server listening on {socket_path} with {workers} workers", file=sys.stderr)
+        while len(children) > 0:
+            try:
+                pid, status=os.wait()
+            except ChildProcessError:
+                break
+            children.discard(pid)
+            if not stopping:
+                # The worker has handled its requests or died, either way it is replaced
+                children.add(start_worker(listener, handle_request, max_requests))
+    finally:
+        for signum, handler in previous_handlers.items():
+            signal.signal(signum, handler)
+        listener.close()
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
@@ -0,0 +1,52 @@
+import importlib.util
+import sys
+
+"""
+Defers importing modules until they are used, which keeps the start up of the tools and of
+scripts that use python_compiler quick as importing xDSL and our dialects is by far the
+biggest part of it, and many runs (e.g. when the IR is already in the compile cache) never
+need them. Only the standard library is imported here so that this is cheap itself.
+"""
+
+def import_module(name: str):
+    """
+    Imports the module by name, this is rather than importlib.import_module because modules
+    imported that way are missing from the output of python -X importtime, which is how
+    the start up is profiled
+    """
+    return __import__(name, fromlist=["__name__"])
+
+class LazyModule:
+    """
+    Stands in for a module which is imported the first time one of its attributes is
+    accessed, e.g. tiny_py=lazy_import("tiny_py") then tiny_py.Loop imports tiny_py
+    """
+    def __init__(self, name: str):
+        self._name=name
+        self._module=None
+
+    def _load(self):
+        if self._module is None:
+            self._module=import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attribute: str):
+        return getattr(self._load(), attribute)
+
+    def __repr__(self):
+        return f"<lazy module '{self._name}'{' (imported)' if self._module is not None else ''}>"
+
+def lazy_import(name: str) -> LazyModule:
+    return LazyModule(name)
+
+def get_module_file(name: str) -> str:
+    """
+    The source file of a module without importing it, this is used to version the compile
+    cache by the source of modules which might not otherwise be needed
+    """
+    if name in sys.modules and getattr(sys.modules[name], "__file__", None) is not None:
+        return sys.modules[name].__file__
+    spec=importlib.util.find_spec(name)
+    if spec is None or spec.origin is None:
+        raise Exception(f"Can not find the module `{name}'")
+    return spec.origin
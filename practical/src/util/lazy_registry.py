@@ -0,0 +1,159 @@
+from collections.abc import MutableMapping
+from typing import Dict, Iterator, List, Tuple
+from xdsl.ir import MLContext
+from util.lazy_import import import_module, get_module_file
+
+"""
+Registers our passes and dialects without importing them, so that the module of a pass is
+only imported when that pass is requested and the module of a dialect only when IR that
+uses it is parsed. Importing them all up front, as tinypy-opt used to, costs far more than
+parsing and printing a typical kernel, and the tool is run thousands of times in a build.
+
+Passes are held in a LazyPassRegistry, which is a dictionary from the name of the pass to
+its class (as xDSL's available_passes is) but where a pass can be registered by the module
+and name of its class. Dialects are registered with a LazyMLContext by the prefixes of the
+names of their operations and attributes (the part before the first dot), the dialect is
+then loaded the first time that the parser looks up a name with one of these prefixes that
+is not already registered. When adding a pass or dialect it must also be added to the
+tables below, the name of a pass is checked when it is loaded.
+"""
+
+# The name of each of our passes, and the module and class that it is defined by
+tinypy_passes: Dict[str, Tuple[str, str]]={
+    "tiny-py-to-standard": ("tiny_py_to_standard", "LowerTinyPyToStandard"),
+    "for-to-parallel": ("for_to_parallel", "ConvertForToParallel"),
+    "vectorise-parallel": ("vectorise_parallel", "VectoriseParallel"),
+    "tile-loops": ("tile_loops", "TileLoops"),
+    "unroll": ("unroll", "UnrollLoops"),
+    "fuse-loops": ("fuse_loops", "FuseLoops"),
+    "fold-constants": ("fold_constants", "FoldConstants"),
+    "pool-constants": ("pool_constants", "PoolConstants"),
+    "tiny-py-to-ssa": ("tiny_py_to_ssa", "ConvertTinyPyToSSA"),
+}
+
+# Our dialects, each is the prefixes of the names it defines and the module and name of
+# the dialect. The llvm and vector prefixes are shared with xDSL's dialects, which are
+# registered up front, so ours are only loaded for the names that those do not define
+tinypy_dialects: List[Tuple[List[str], str, str]]=[
+    (["tiny_py", "bool", "empty"], "tiny_py", "tinyPyIR"),
+    (["tiny_py_ssa"], "tiny_py_ssa", "tinyPySSAIR"),
+    (["llvm"], "llvm_func", "llvmFuncIR"),
+    (["vector"], "vector_ext", "vectorExtIR"),
+]
+
+class LazyPassRegistry(MutableMapping):
+    """
+    The available passes by name, a pass registered lazily is imported when it is first
+    looked up. Checking whether a pass is available and listing the names of the passes
+    do not import anything
+    """
+    def __init__(self, passes: Dict[str, type] | None = None):
+        self.passes: Dict[str, type]=dict(passes or {})
+        self.lazy_passes: Dict[str, Tuple[str, str]]={}
+
+    def register_lazy_pass(self, name: str, module_name: str, class_name: str):
+        self.passes.pop(name, None)
+        self.lazy_passes[name]=(module_name, class_name)
+
+    def load_pass(self, name: str) -> type:
+        module_name, class_name=self.lazy_passes[name]
+        pass_class=getattr(import_module(module_name), class_name)
+        if pass_class.name != name:
+            raise Exception(f"Pass `{name}' is registered as {module_name}.{class_name}, but that is `{pass_class.name}'")
+        del self.lazy_passes[name]
+        self.passes[name]=pass_class
+        return pass_class
+
+    def load_all(self):
+        """
+        Imports every pass that has not been already, e.g. before forking worker processes
+        so that each does not have to import them
+        """
+        for name in list(self.lazy_passes):
+            self.load_pass(name)
+
+    def get_module_files(self) -> List[str]:
+        """
+        The source files of the modules defining the passes, without importing them
+        """
+        return ([get_module_file(p.__module__) for p in self.passes.values()]
+                + [get_module_file(module_name) for module_name, _ in self.lazy_passes.values()])
+
+    def __getitem__(self, name: str) -> type:
+        if name in self.lazy_passes:
+            return self.load_pass(name)
+        return self.passes[name]
+
+    def __setitem__(self, name: str, pass_class: type):
+        self.lazy_passes.pop(name, None)
+        self.passes[name]=pass_class
+
+    def __delitem__(self, name: str):
+        if name in self.lazy_passes:
+            del self.lazy_passes[name]
+        else:
+            del self.passes[name]
+
+    def __contains__(self, name: object) -> bool:
+        return name in self.passes or name in self.lazy_passes
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(list(self.passes)+list(self.lazy_passes))
+
+    def __len__(self) -> int:
+        return len(self.passes)+len(self.lazy_passes)
+
+def get_tinypy_passes() -> LazyPassRegistry:
+    registry=LazyPassRegistry()
+    register_tinypy_passes(registry)
+    return registry
+
+def register_tinypy_passes(registry: LazyPassRegistry):
+    for name, (module_name, class_name) in tinypy_passes.items():
+        registry.register_lazy_pass(name, module_name, class_name)
+
+class LazyMLContext(MLContext):
+    """
+    A context where dialects can be registered to be loaded when the parser first looks
+    up an operation or attribute whose name has one of their prefixes
+    """
+    def __init__(self):
+        super().__init__()
+        self.lazy_dialects: Dict[str, Tuple[str, str]]={}
+
+    def register_lazy_dialect(self, prefixes: List[str], module_name: str, dialect_name: str):
+        for prefix in prefixes:
+            self.lazy_dialects[prefix]=(module_name, dialect_name)
+
+    def load_lazy_dialect(self, name: str) -> bool:
+        """
+        Loads the dialect for the prefix of the name, if there is one that has not been
+        loaded already, returning whether one was loaded
+        """
+        dialect=self.lazy_dialects.get(name.split(".", 1)[0])
+        if dialect is None:
+            return False
+        for prefix in [prefix for prefix, other in self.lazy_dialects.items() if other == dialect]:
+            del self.lazy_dialects[prefix]
+        module_name, dialect_name=dialect
+        self.register_dialect(getattr(import_module(module_name), dialect_name))
+        return True
+
+    def load_all(self):
+        while len(self.lazy_dialects) > 0:
+            self.load_lazy_dialect(next(iter(self.lazy_dialects)))
+
+    def get_optional_op(self, name: str, allow_unregistered: bool = False):
+        if name not in self._registeredOps and self.load_lazy_dialect(name):
+            return self.get_optional_op(name, allow_unregistered)
+        return super().get_optional_op(name, allow_unregistered)
+
+    def get_optional_attr(self, name: str, allow_unregistered: bool = False,
+                          create_unregistered_as_type: bool = False):
+        if name not in self._registeredAttrs and self.load_lazy_dialect(name):
+            return self.get_optional_attr(name, allow_unregistered, create_unregistered_as_type)
+        return super().get_optional_attr(name, allow_unregistered, create_unregistered_as_type)
+
+def register_tinypy_dialects(ctx: LazyMLContext):
+    for prefixes, module_name, dialect_name in tinypy_dialects:
+        ctx.register_lazy_dialect(prefixes, module_name, dialect_name)
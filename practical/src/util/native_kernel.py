@@ -0,0 +1,113 @@
+import ctypes
+from functools import lru_cache
+from util.lazy_import import lazy_import
+
+"""
+Calling compiled kernels from Python via ctypes. The signature of a kernel is described
+by a small dictionary (which is what is stored in the compile cache next to the shared
+object), holding the symbol to call and how each argument and the result is passed.
+Scalars are passed by value, and arrays are passed as a pointer to a memref descriptor
+which references the data of the NumPy array directly, so it is never copied.
+"""
+
+# Calling a kernel that is already compiled does not need xDSL, so it is only imported
+# when the signature of a newly compiled kernel is obtained
+func=lazy_import("xdsl.dialects.func")
+builtin=lazy_import("xdsl.dialects.builtin")
+memref=lazy_import("xdsl.dialects.memref")
+
+# How values of each type in the IR are passed to and from compiled kernels, along
+# with the NumPy dtype that arrays of that element type must have. The types in the IR are
+# named as they are in the builtin dialect
+ctypes_type_mapping=[("i32", "c_int32", "int32"), ("i64", "c_int64", "int64"),
+                     ("f32", "c_float", "float32"), ("f64", "c_double", "float64")]
+
+def get_ctypes_type(typ):
+    """
+    Maps a type in the IR to how it is passed, this is the name of the ctypes type
+    for scalars, and for memrefs the ctypes type of the elements along with the rank
+    """
+    if isinstance(typ, memref.MemRefType):
+        return {"memref": get_ctypes_type(typ.element_type), "rank": typ.get_num_dims()}
+    for ir_type, ctypes_type, _ in ctypes_type_mapping:
+        if typ == getattr(builtin, ir_type):
+            return ctypes_type
+    raise Exception(f"Type {typ} can not be passed to or from a compiled kernel")
+
+def get_kernel_signature(module):
+    """
+    Obtains the signature of the kernel from the lowered IR, where there are array
+    arguments we call the C interface wrapper that MLIR generates for the function
+    """
+    for op in module.ops:
+        if isinstance(op, func.FuncOp) and len(op.body.blocks) > 0:
+            function_type=op.function_type
+            args=[get_ctypes_type(typ) for typ in function_type.inputs.data]
+            results=[get_ctypes_type(typ) for typ in function_type.outputs.data]
+            symbol=op.sym_name.data
+            if "llvm.emit_c_interface" in op.attributes:
+                symbol="_mlir_ciface_"+symbol
+            return {"symbol": symbol, "args": args,
+                    "result": results[0] if len(results) > 0 else None}
+    raise Exception("No kernel found in the lowered IR")
+
+@lru_cache(maxsize=None)
+def get_descriptor_type(element_type: str, rank: int):
+    """
+    The ctypes structure matching MLIR's memref descriptor of the given element type
+    and rank, which is the allocated and aligned pointers, offset, sizes and strides
+    """
+    element_ptr=ctypes.POINTER(getattr(ctypes, element_type))
+    return type(f"MemRefDescriptor{rank}D_{element_type}", (ctypes.Structure,), {"_fields_": [
+        ("allocated", element_ptr), ("aligned", element_ptr), ("offset", ctypes.c_int64),
+        ("sizes", ctypes.c_int64 * rank), ("strides", ctypes.c_int64 * rank)]})
+
+def make_descriptor(array, element_type: str, rank: int):
+    """
+    Builds a memref descriptor that points at the data of a NumPy array, the array is
+    required to match exactly (rather than being converted) as that would need a copy
+    """
+    dtype=[numpy_type for _, ctypes_type, numpy_type in ctypes_type_mapping if ctypes_type == element_type][0]
+    if not hasattr(array, "__array_interface__"):
+        raise TypeError(f"Expected a NumPy array of {dtype} but got {type(array).__name__}")
+    if array.dtype.name != dtype or array.ndim != rank:
+        raise TypeError(f"Expected a {rank} dimensional array of {dtype} but got a "
+                        f"{array.ndim} dimensional array of {array.dtype.name}")
+    if not array.flags["C_CONTIGUOUS"]:
+        raise TypeError("Arrays passed to a compiled kernel must be C contiguous")
+    descriptor_type=get_descriptor_type(element_type, rank)
+    data=ctypes.cast(array.ctypes.data, descriptor_type._fields_[0][1])
+    strides=[stride // array.itemsize for stride in array.strides]
+    return descriptor_type(data, data, 0, (ctypes.c_int64 * rank)(*array.shape),
+                           (ctypes.c_int64 * rank)(*strides))
+
+def bind_kernel(library, signature):
+    """
+    Looks up the kernel in the loaded library and returns a callable for it, if there
+    are no array arguments then this is the ctypes function itself so there is nothing
+    between the caller and the native code
+    """
+    kernel=library[signature["symbol"]]
+    kernel.restype=None if signature["result"] is None else getattr(ctypes, signature["result"])
+    arrays=[]
+    argtypes=[]
+    for idx, arg in enumerate(signature["args"]):
+        if isinstance(arg, dict):
+            arrays.append((idx, arg["memref"], arg["rank"]))
+            argtypes.append(ctypes.POINTER(get_descriptor_type(arg["memref"], arg["rank"])))
+        else:
+            argtypes.append(getattr(ctypes, arg))
+    kernel.argtypes=argtypes
+    # Keep the library alive for as long as the kernel is
+    kernel.library=library
+    if len(arrays) == 0:
+        return kernel
+
+    def array_kernel(*args):
+        args=list(args)
+        descriptors=[]
+        for idx, element_type, rank in arrays:
+            descriptors.append(make_descriptor(args[idx], element_type, rank))
+            args[idx]=ctypes.byref(descriptors[-1])
+        return kernel(*args)
+    return array_kernel
@@ -0,0 +1,85 @@
+import dataclasses
+import re
+import typing
+from typing import Dict, List
+
+"""
+Parses a pass pipeline that follows the same syntax as mlir-opt, where each pass can be
+given options in braces, for instance `tiny-py-to-standard,for-to-parallel{min-parallel-work=500}`.
+Options are whitespace separated key=value pairs, and each key is a field of the pass's
+dataclass with dashes in place of underscores. Values are converted to the type of the
+field, with comma separated values for list fields (e.g. `tile-sizes=32,32`).
+"""
+
+pass_pattern=re.compile(r"^\s*([\w-]+)\s*(?:\{(.*)\})?\s*$", re.DOTALL)
+
+def split_pipeline(pipeline: str) -> List[str]:
+    """
+    Splits the pipeline into its passes, commas inside braces separate the values of an
+    option rather than passes so are not split upon
+    """
+    passes=[]
+    depth=0
+    current=""
+    for char in pipeline:
+        if char == "{":
+            depth+=1
+        elif char == "}":
+            depth-=1
+        if char == "," and depth == 0:
+            passes.append(current)
+            current=""
+        else:
+            current+=char
+    passes.append(current)
+    return [p.strip() for p in passes if len(p.strip()) > 0]
+
+def convert_option_value(pass_name: str, field_name: str, field_type, value: str):
+    try:
+        if typing.get_origin(field_type) in (list, List):
+            element_type=typing.get_args(field_type)[0]
+            return [element_type(v.strip()) for v in value.split(",") if len(v.strip()) > 0]
+        if field_type is bool:
+            if value.lower() not in ("true", "false", "1", "0"):
+                raise ValueError(value)
+            return value.lower() in ("true", "1")
+        return field_type(value)
+    except ValueError:
+        raise Exception(f"Invalid value `{value}' for option `{field_name.replace('_', '-')}' of pass `{pass_name}'")
+
+def parse_pass_options(pass_class, options: str) -> Dict[str, object]:
+    """
+    Converts the text of the options for a pass into the keyword arguments used to
+    construct it
+    """
+    fields=[f.name for f in dataclasses.fields(pass_class)] if dataclasses.is_dataclass(pass_class) else []
+    # Resolves the types of fields even if annotations are postponed in the pass's module
+    field_types=typing.get_type_hints(pass_class)
+    kwargs={}
+    for option in options.split():
+        if "=" not in option:
+            raise Exception(f"Option `{option}' of pass `{pass_class.name}' must be of the form key=value")
+        key, value=option.split("=", 1)
+        field_name=key.replace("-", "_")
+        if field_name not in fields:
+            raise Exception(f"Unknown option `{key}' for pass `{pass_class.name}', available options are: "
+                            f"{', '.join(f.replace('_', '-') for f in fields) or 'none'}")
+        kwargs[field_name]=convert_option_value(pass_class.name, field_name, field_types[field_name], value)
+    return kwargs
+
+def parse_pipeline(pipeline: str, available_passes: Dict[str, type]) -> List[object]:
+    """
+    Parses the pipeline and returns an instance of each pass in it, configured with
+    any options that were provided
+    """
+    pass_instances=[]
+    for pass_text in split_pipeline(pipeline):
+        match=pass_pattern.match(pass_text)
+        if match is None:
+            raise Exception(f"Malformed pass `{pass_text}' in pipeline")
+        pass_name, options=match.group(1), match.group(2)
+        if pass_name not in available_passes:
+            raise Exception(f"Unrecognized pass: {pass_name}")
+        pass_class=available_passes[pass_name]
+        pass_instances.append(pass_class(**parse_pass_options(pass_class, options or "")))
+    return pass_instances
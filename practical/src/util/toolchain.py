@@ -0,0 +1,127 @@
+import os
+import subprocess
+import tempfile
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+"""
+Drives the external LLVM toolchain (mlir-opt, mlir-translate and clang) that turns the
+standard dialect IR generated by tinypy-opt into native code. These are the same commands
+that are run by hand in the exercises, the IR is passed between the tools over pipes
+rather than via intermediate files. The tools are picked up from the PATH, but can be
+overridden via the MLIR_OPT, MLIR_TRANSLATE and CLANG environment variables.
+
+Each tool is a separate function, lower_to_llvm_dialect, translate_to_llvm_ir and
+compile_llvm_ir, so that callers such as tinypy-opt -t native can time them individually.
+"""
+
+class ToolchainError(Exception):
+    pass
+
+@dataclass
+class Preset:
+    """
+    A named build configuration, this is the tinypy-opt passes that lower our tiny_py
+    IR to the standard dialects, the mlir-opt pipeline that then lowers these to the llvm
+    dialect and any additional flags that clang requires
+    """
+    tinypy_passes: List[str]
+    mlir_pipeline: List[str]
+    clang_flags: List[str] = field(default_factory=list)
+
+sequential_mlir_pipeline=["loop-invariant-code-motion", "convert-scf-to-cf", "convert-cf-to-llvm{index-bitwidth=64}",
+    "convert-arith-to-llvm{index-bitwidth=64}", "finalize-memref-to-llvm", "convert-func-to-llvm",
+    "reconcile-unrealized-casts"]
+openmp_mlir_pipeline=["loop-invariant-code-motion", "convert-scf-to-openmp", "convert-scf-to-cf",
+    "convert-cf-to-llvm{index-bitwidth=64}", "convert-arith-to-llvm{index-bitwidth=64}",
+    "convert-openmp-to-llvm", "finalize-memref-to-llvm", "convert-func-to-llvm", "reconcile-unrealized-casts"]
+openmp_vector_mlir_pipeline=["loop-invariant-code-motion", "convert-scf-to-openmp", "convert-scf-to-cf",
+    "convert-cf-to-llvm{index-bitwidth=64}", "convert-vector-to-llvm", "convert-arith-to-llvm{index-bitwidth=64}",
+    "convert-openmp-to-llvm", "finalize-memref-to-llvm", "convert-func-to-llvm", "reconcile-unrealized-casts"]
+
+# The sequential and openmp presets are exactly the pipelines that are used in exercises
+# two and three, openmp-vector also vectorises the parallel loops and so targets the SIMD
+# units of the host. Our optimisation passes are opt in via the -optimised version of each,
+# which also folds and pools constants around the lowering and then fuses adjacent loops,
+# so that the fused loop is then parallelised (or unrolled by sequential-optimised)
+presets={
+    "sequential": Preset(["tiny-py-to-standard"], sequential_mlir_pipeline),
+    "openmp": Preset(["tiny-py-to-standard", "for-to-parallel"], openmp_mlir_pipeline, ["-fopenmp"]),
+    "openmp-vector": Preset(["tiny-py-to-standard", "for-to-parallel", "vectorise-parallel"],
+        openmp_vector_mlir_pipeline, ["-fopenmp", "-march=native"]),
+    "sequential-optimised": Preset(["fold-constants", "tiny-py-to-standard", "pool-constants", "fuse-loops", "unroll"],
+        sequential_mlir_pipeline),
+    "openmp-optimised": Preset(["fold-constants", "tiny-py-to-standard", "pool-constants", "fuse-loops", "for-to-parallel"],
+        openmp_mlir_pipeline, ["-fopenmp"]),
+    "openmp-vector-optimised": Preset(["fold-constants", "tiny-py-to-standard", "pool-constants", "fuse-loops",
+                                       "for-to-parallel", "vectorise-parallel"],
+        openmp_vector_mlir_pipeline, ["-fopenmp", "-march=native"]),
+}
+
+# The kinds of native output that clang can produce, with the flags that select each
+native_outputs={"object": ["-c"], "shared": ["-shared", "-fPIC"], "executable": []}
+# The extension of the file that each is written to when the name is chosen, e.g. by --batch
+native_output_extensions={"object": ".o", "shared": ".so", "executable": ""}
+
+def get_preset(name: str) -> Preset:
+    if name not in presets:
+        raise ToolchainError(f"Unknown preset `{name}', available presets are: {', '.join(presets)}")
+    return presets[name]
+
+def tool(name: str) -> str:
+    return os.environ.get(name.upper().replace("-", "_"), name)
+
+def run_stage(command: List[str], input_data: bytes) -> bytes:
+    """
+    Runs one tool, feeding it the input over stdin and returning what it writes to stdout
+    """
+    try:
+        res=subprocess.run(command, input=input_data, capture_output=True)
+    except FileNotFoundError:
+        raise ToolchainError(f"Could not find `{command[0]}', is LLVM on your PATH?")
+    if res.returncode != 0:
+        raise ToolchainError(f"`{' '.join(command)}' failed:\n{res.stderr.decode(errors='replace')}")
+    return res.stdout
+
+def lower_to_llvm_dialect(mlir_text: str, preset: Preset) -> bytes:
+    """
+    Lowers standard dialect IR to the llvm dialect via the mlir-opt pipeline of the preset
+    """
+    pipeline="builtin.module("+", ".join(preset.mlir_pipeline)+")"
+    return run_stage([tool("mlir-opt"), f"--pass-pipeline={pipeline}"], mlir_text.encode("utf-8"))
+
+def translate_to_llvm_ir(llvm_dialect: bytes) -> bytes:
+    return run_stage([tool("mlir-translate"), "-mlir-to-llvmir"], llvm_dialect)
+
+def mlir_to_llvm_ir(mlir_text: str, preset: Preset) -> bytes:
+    """
+    Lowers standard dialect IR to LLVM-IR via mlir-opt and mlir-translate
+    """
+    return translate_to_llvm_ir(lower_to_llvm_dialect(mlir_text, preset))
+
+def compile_llvm_ir(llvm_ir: bytes, preset: Preset, output_kind: str, output_file: Optional[str] = None,
+                    opt_level: str = "-O3") -> bytes:
+    """
+    Compiles LLVM-IR with clang to an object, shared object or executable, which clang writes
+    to the output file itself. Only an object can be written to stdout, which is returned if
+    there is no output file, as clang can not link to stdout
+    """
+    if output_kind not in native_outputs:
+        raise ToolchainError(f"Unknown output `{output_kind}', available outputs are: {', '.join(native_outputs)}")
+    if output_file is None and output_kind != "object":
+        raise ToolchainError(f"clang can only write an object to stdout, not a linked {output_kind}, "
+                             "so an output file is needed")
+    return run_stage([tool("clang"), opt_level]+native_outputs[output_kind]+preset.clang_flags+
+                     ["-x", "ir", "-o", output_file or "-", "-"], llvm_ir)
+
+def build_shared_object(mlir_text: str, preset: Preset, opt_level: str = "-O3") -> bytes:
+    """
+    Builds a shared object from standard dialect IR and returns its contents, clang
+    can not write a linked shared object to stdout so it goes via a scratch directory
+    """
+    llvm_ir=mlir_to_llvm_ir(mlir_text, preset)
+    with tempfile.TemporaryDirectory() as scratch:
+        so_path=os.path.join(scratch, "kernel.so")
+        compile_llvm_ir(llvm_ir, preset, "shared", so_path, opt_level)
+        with open(so_path, "rb") as f:
+            return f.read()
@@ -1,7 +1,18 @@
-from typing import Callable, List, Optional, Type, Union
+from typing import Callable, Dict, List, Optional, Tuple, Type, Union
 import re
 from xdsl.ir import Operation
 
+"""
+A visitor over the IR, for each operation that it reaches this calls the visitor's
+traverse_<op> method if there is one (which is then responsible for the operation's children),
+otherwise it goes into each of the operation's regions in order. Afterwards it calls the
+visit_<op> method if there is one, where <op> is the operation's class name in snake case.
+
+The methods that apply to each class of operation are looked up once per visitor class and
+kept in a dispatch table, rather than converting the class name and looking the methods up
+for every operation that is reached. The IR is walked with an explicit stack instead of by
+recursion, so deeply nested IR does not exceed Python's recursion limit.
+"""
 
 def camel_to_snake(name):
     pattern = re.compile(r'(?<!^)(?=[A-Z])')
@@ -18,21 +29,50 @@ def get_method(instance: object, method: str) -> Optional[Callable]:
         else:
             return None
 
+# For each visitor class, the traverse and visit functions (or None) for each operation class,
+# these are the functions of the visitor class so are called with the visitor as the first argument
+DispatchEntry = Tuple[Optional[Callable], Optional[Callable]]
+dispatch_tables: Dict[type, Dict[type, DispatchEntry]] = {}
+
+def get_dispatch_table(visitor_class: type) -> Dict[type, DispatchEntry]:
+    table=dispatch_tables.get(visitor_class)
+    if table is None:
+        table=dispatch_tables[visitor_class]={}
+    return table
+
+def lookup_dispatch(visitor_class: type, op_class: Type[Operation]) -> DispatchEntry:
+    class_name = camel_to_snake(op_class.__name__)
+    return (get_method(visitor_class, f"traverse_{class_name}"),
+            get_method(visitor_class, f"visit_{class_name}"))
+
 
 class Visitor:
 
     def traverse(self, operation: Operation):
-        class_name = camel_to_snake(type(operation).__name__)
-        
-        traverse = get_method(self, f"traverse_{class_name}")        
-        if traverse:
-            traverse(operation)
-        else:
-            for r in operation.regions:
-                for b in r.blocks:
-                    for op in b.ops:
-                        self.traverse(op)
-
-        visit = get_method(self, f"visit_{class_name}")
-        if visit:
-            visit(operation)
+        table = get_dispatch_table(type(self))
+        # Each entry is an operation still to be reached, or (once its children have been
+        # walked) the visit function still to be called on it
+        stack: List[Union[Operation, Tuple[Callable, Operation]]] = [operation]
+        while stack:
+            item = stack.pop()
+            if type(item) is tuple:
+                item[0](self, item[1])
+                continue
+            op_class = type(item)
+            entry = table.get(op_class)
+            if entry is None:
+                entry = table[op_class] = lookup_dispatch(type(self), op_class)
+            traverse, visit = entry
+            if traverse:
+                traverse(self, item)
+                if visit:
+                    visit(self, item)
+                continue
+            if visit:
+                stack.append((visit, item))
+            regions = item.regions
+            if regions:
+                # Pushed in reverse so that the children are reached in order
+                children = [op for r in regions for b in r.blocks for op in b.ops]
+                children.reverse()
+                stack.extend(children)
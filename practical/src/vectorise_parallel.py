@@ -0,0 +1,445 @@
+from xdsl.dialects.builtin import ModuleOp, IndexType, IntegerType, VectorType, AnyFloat
+from xdsl.ir import Operation, SSAValue, Block, Region, MLContext
+from xdsl.dialects import scf, arith, memref, vector
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import Dict, List, Optional, Tuple
+import sys
+from xdsl.passes import ModulePass
+from for_to_parallel import get_constant_value, describe_loop_location
+from vector_ext import ReductionOp
+from parallel_legality import reduction_identities
+
+"""
+Vectorises the innermost dimension of parallel loops, so that each thread running the
+loop also makes use of the SIMD units of its core. The innermost dimension is strip-mined
+into blocks of vectors, and each iteration of the parallel loop works on one block with a
+sequential scf.for over its vectors, each of which covers vector_width consecutive
+iterations of the original loop at once. This is followed by an scf.for over the remaining
+iterations of the block as a scalar epilogue, which is only needed by the last block, so
+the epilogue doesn't cost another parallel region.
+
+Each value in the body of the vectorised loop is one of:
+
+* Uniform, where it is the same for all the lanes of the vector, such as a value computed
+  outside of the loop or from only the outer induction variables. These stay as scalars
+  and are broadcast into a vector where they are combined with a vector.
+* Contiguous, an index that increases by one from lane to lane, such as the innermost
+  induction variable. This is held as a scalar which is the index of the first lane, and
+  loads and stores at a contiguous index become vector.load and vector.store.
+* A vector, holding a different value in each lane, which is computed by the same arith
+  operations as the scalar loop but on vector types.
+
+Reductions are accumulated lane by lane in a vector that is carried through the loop over
+the vectors, starting from the identity of the reduction, and only after that loop are its
+lanes combined into a scalar with vector.reduction. This is then continued by the epilogue
+and passed to scf.reduce as before, so the reductions of the parallel loop stay scalar and
+are lowered to OpenMP in the same way as without vectorisation. Where a value is converted
+(e.g. extended to double precision) before it is reduced, the lanes are instead combined
+every iteration and converted, so that it is still accumulated in the converted type.
+"""
+
+# Operations that apply to each lane of a vector in the same way as they do to a scalar
+elementwise_operations=["arith.addf", "arith.subf", "arith.mulf", "arith.divf", "arith.maxf",
+                        "arith.minf", "arith.addi", "arith.subi", "arith.muli", "arith.divsi",
+                        "arith.divui", "arith.maxsi", "arith.minsi", "arith.maxui", "arith.minui",
+                        "arith.andi", "arith.ori", "arith.xori", "arith.negf"]
+# Conversions between floating point types, xDSL's versions of these only accept scalars so
+# where a vector is converted ahead of a reduction we apply the conversion to the reduced value
+deferred_conversions=["arith.extf", "arith.truncf"]
+# The vector.reduction kind that corresponds to the operation in the body of scf.reduce
+reduction_kinds={"arith.addf": "add", "arith.addi": "add", "arith.mulf": "mul", "arith.muli": "mul",
+                 "arith.maxf": "maxf", "arith.minf": "minf", "arith.maxsi": "maxsi", "arith.minsi": "minsi",
+                 "arith.maxui": "maxui", "arith.minui": "minui", "arith.andi": "and", "arith.ori": "or",
+                 "arith.xori": "xor"}
+
+class LaneKind(Enum):
+    UNIFORM = "uniform"
+    CONTIGUOUS = "contiguous"
+    VECTOR = "vector"
+    # A vector whose conversion has been deferred until after it is reduced
+    CONVERTED = "converted"
+
+@dataclass
+class LaneAnalysis:
+    """
+    The kind of each value in the loop body, by the id of the value, along with why the
+    loop can't be vectorised (this is empty if it can be). Values that are not in kinds
+    are defined outside of the loop and-so are uniform
+    """
+    kinds: Dict[int, LaneKind] = field(default_factory=dict)
+    rejection: str = ""
+
+    def get_kind(self, value: SSAValue) -> LaneKind:
+        return self.kinds.get(id(value), LaneKind.UNIFORM)
+
+def get_reduction_kind(reduce_op: scf.ReduceOp) -> Optional[str]:
+    """
+    The vector.reduction kind of an scf.reduce, whose body is a single combining operation
+    """
+    ops=list(reduce_op.body.blocks[0].ops)
+    if len(ops) != 2:
+        return None
+    return reduction_kinds.get(ops[0].name)
+
+def is_contiguous_access(indices: List[SSAValue], analysis: LaneAnalysis) -> bool:
+    """
+    Whether a load or store accesses consecutive elements, this is where the last index is
+    contiguous and the others are the same for every lane
+    """
+    return (len(indices) > 0 and analysis.get_kind(indices[-1]) == LaneKind.CONTIGUOUS and
+            all(analysis.get_kind(index) == LaneKind.UNIFORM for index in indices[:-1]))
+
+def analyse_lanes(parallel_loop: scf.ParallelOp) -> LaneAnalysis:
+    """
+    Determines the kind of each value in the body when the innermost dimension of the loop
+    is vectorised, stopping at the first operation that can't be vectorised
+    """
+    analysis=LaneAnalysis()
+    body=parallel_loop.body.blocks[0]
+    for idx, arg in enumerate(body.args):
+        analysis.kinds[id(arg)]=LaneKind.CONTIGUOUS if idx == len(body.args)-1 else LaneKind.UNIFORM
+
+    for op in body.ops:
+        if isinstance(op, scf.Yield):
+            continue
+        operand_kinds=[analysis.get_kind(operand) for operand in op.operands]
+        if LaneKind.CONVERTED in operand_kinds and op.name not in deferred_conversions and not isinstance(op, scf.ReduceOp):
+            analysis.rejection=f"the result of {op.operands[0].op.name} is used by {op.name}, which needs it as a vector"
+            return analysis
+        if isinstance(op, scf.ReduceOp):
+            if operand_kinds[0] == LaneKind.CONTIGUOUS:
+                analysis.rejection="it reduces an index"
+            elif get_reduction_kind(op) is None:
+                analysis.rejection="it contains a reduction that has no vector.reduction equivalent"
+            if analysis.rejection:
+                return analysis
+            continue
+        if len(op.regions) > 0:
+            analysis.rejection=f"it contains {op.name}, only the innermost loop of a nest is vectorised"
+            return analysis
+
+        kind=None
+        if isinstance(op, memref.Store):
+            if (is_contiguous_access(list(op.indices), analysis) and
+                    analysis.get_kind(op.value) in (LaneKind.UNIFORM, LaneKind.VECTOR)):
+                continue
+        elif all(operand_kind == LaneKind.UNIFORM for operand_kind in operand_kinds):
+            # Computed once for all the lanes, calls might have side effects so must be in the scalar loop
+            if op.name.startswith("arith.") or isinstance(op, memref.Load):
+                kind=LaneKind.UNIFORM
+        elif isinstance(op, memref.Load):
+            if is_contiguous_access(list(op.indices), analysis):
+                kind=LaneKind.VECTOR
+        elif isinstance(op, arith.IndexCastOp):
+            if operand_kinds[0] == LaneKind.CONTIGUOUS:
+                kind=LaneKind.CONTIGUOUS
+        elif (op.name in ["arith.addi", "arith.subi"] and operand_kinds[0] == LaneKind.CONTIGUOUS and
+                operand_kinds[1] == LaneKind.UNIFORM) or (op.name == "arith.addi" and
+                operand_kinds[0] == LaneKind.UNIFORM and operand_kinds[1] == LaneKind.CONTIGUOUS):
+            # Offsetting a contiguous index by the same amount in every lane keeps it contiguous
+            kind=LaneKind.CONTIGUOUS
+        elif op.name in elementwise_operations:
+            if LaneKind.CONTIGUOUS not in operand_kinds:
+                kind=LaneKind.VECTOR
+        elif op.name in deferred_conversions:
+            kind=LaneKind.CONVERTED
+
+        if kind is None:
+            analysis.rejection=f"{op.name} can not be vectorised on the values that it is given"
+            return analysis
+        if kind == LaneKind.VECTOR and not (isinstance(op.results[0].typ, IntegerType) or
+                                           isinstance(op.results[0].typ, AnyFloat)):
+            analysis.rejection=f"vectors of {op.results[0].typ} are not supported"
+            return analysis
+        for result in op.results:
+            analysis.kinds[id(result)]=kind
+    return analysis
+
+def combine(reduce_op: scf.ReduceOp, lhs: SSAValue, rhs: SSAValue) -> Operation:
+    """
+    Combines two values with the operation of the scf.reduce, on vectors this combines
+    them lane by lane
+    """
+    combiner=reduce_op.body.blocks[0].ops.first
+    return combiner.__class__.build(operands=[lhs, rhs], result_types=[lhs.typ], attributes=dict(combiner.attributes))
+
+def build_accumulator(reduce_op: scf.ReduceOp, init_value: SSAValue, accumulator_type) -> Tuple[List[Operation], SSAValue]:
+    """
+    The operations that give the value that the accumulator of a reduction starts from in
+    each block, along with that value. This is the identity of the reduction, or for those
+    without one in the table (the minimums and maximums) the initial value of the loop, as
+    combining it more than once doesn't change the result. It is broadcast for a vector
+    """
+    element_type=accumulator_type.element_type if isinstance(accumulator_type, VectorType) else accumulator_type
+    combiner_name=reduce_op.body.blocks[0].ops.first.name
+    new_ops=[]
+    value=init_value
+    if combiner_name in reduction_identities:
+        identity=reduction_identities[combiner_name]
+        if isinstance(element_type, AnyFloat):
+            new_ops.append(arith.Constant.from_float_and_width(float(identity), element_type))
+        else:
+            new_ops.append(arith.Constant.from_int_and_width(identity, element_type))
+        value=new_ops[-1].results[0]
+    if isinstance(accumulator_type, VectorType):
+        new_ops.append(vector.Broadcast.build(operands=[value], result_types=[accumulator_type]))
+        value=new_ops[-1].results[0]
+    return new_ops, value
+
+class VectorBodyBuilder:
+    """
+    Builds the body of the loop over vectors from the body of the scalar loop
+    """
+
+    def __init__(self, analysis: LaneAnalysis, vector_width: int):
+        self.analysis=analysis
+        self.vector_width=vector_width
+        # The value in the new body for each value in the old body, by id
+        self.value_map={}
+        # The conversions yet to be applied to a converted vector, by id
+        self.pending_conversions={}
+        # Broadcasts of uniform values, by the id of the value, so each is only done once
+        self.broadcasts={}
+        self.block=None
+
+    def get_vector_type(self, element_type):
+        return VectorType.from_element_type_and_shape(element_type, [self.vector_width])
+
+    def get_accumulator_type(self, reduce_op: scf.ReduceOp):
+        """
+        Values are reduced into a vector which is only reduced to a scalar after the loop,
+        apart from values that are converted before they are reduced, as the conversions
+        only apply to scalars. The lanes of these are reduced each iteration and the
+        conversions applied, so they are still accumulated in the converted type
+        """
+        if self.analysis.get_kind(reduce_op.argument) == LaneKind.CONVERTED:
+            return reduce_op.argument.typ
+        return self.get_vector_type(reduce_op.argument.typ)
+
+    def get_scalar(self, value: SSAValue) -> SSAValue:
+        return self.value_map.get(id(value), value)
+
+    def get_vector(self, value: SSAValue) -> SSAValue:
+        """
+        The vector of a value, uniform values are broadcast to all the lanes
+        """
+        if self.analysis.get_kind(value) != LaneKind.UNIFORM:
+            return self.value_map[id(value)]
+        if id(value) not in self.broadcasts:
+            broadcast=vector.Broadcast.build(operands=[self.get_scalar(value)],
+                                             result_types=[self.get_vector_type(value.typ)])
+            self.block.add_op(broadcast)
+            self.broadcasts[id(value)]=broadcast.results[0]
+        return self.broadcasts[id(value)]
+
+    def clone_scalar(self, op: Operation) -> Operation:
+        new_op=op.clone()
+        for idx, operand in enumerate(op.operands):
+            new_op.replace_operand(idx, self.get_scalar(operand))
+        return new_op
+
+    def build_reduction(self, op: scf.ReduceOp, accumulator: SSAValue) -> List[Operation]:
+        """
+        Combines the value that is reduced into the accumulator, where the accumulator is a
+        scalar the lanes of the vector are first reduced and then converted
+        """
+        if isinstance(accumulator.typ, VectorType):
+            return [combine(op, accumulator, self.get_vector(op.argument))]
+        new_ops=[ReductionOp.get(get_reduction_kind(op), self.get_vector(op.argument))]
+        for conversion in self.pending_conversions.get(id(op.argument), []):
+            new_ops.append(conversion.__class__.build(operands=[new_ops[-1].results[0]],
+                                                      result_types=[conversion.results[0].typ]))
+        return new_ops+[combine(op, accumulator, new_ops[-1].results[0])]
+
+    def build(self, body: Block, block: Block, induction_vars: List[SSAValue]) -> List[SSAValue]:
+        """
+        Builds the vectorised body into the block, where the induction variables replace the
+        arguments of the old body and the arguments of the block after the first are the
+        accumulators of the reductions, in order. Returns the updated accumulators
+        """
+        self.block=block
+        for old_arg, new_arg in zip(body.args, induction_vars):
+            self.value_map[id(old_arg)]=new_arg
+        accumulators=list(block.args[1:])
+        updated=[]
+
+        for op in body.ops:
+            kind=self.analysis.get_kind(op.results[0]) if len(op.results) > 0 else None
+            if isinstance(op, scf.Yield):
+                continue
+            if isinstance(op, scf.ReduceOp):
+                new_ops=self.build_reduction(op, accumulators[len(updated)])
+                updated.append(new_ops[-1].results[0])
+            elif isinstance(op, memref.Store):
+                new_ops=[vector.Store.get(self.get_vector(op.value), self.get_scalar(op.memref),
+                                          [self.get_scalar(index) for index in op.indices])]
+            elif kind == LaneKind.CONVERTED:
+                self.value_map[id(op.results[0])]=self.value_map[id(op.operands[0])]
+                self.pending_conversions[id(op.results[0])]=self.pending_conversions.get(id(op.operands[0]), [])+[op]
+                continue
+            elif kind == LaneKind.VECTOR and isinstance(op, memref.Load):
+                new_ops=[vector.Load.build(operands=[self.get_scalar(op.memref), [self.get_scalar(index) for index in op.indices]],
+                                           result_types=[self.get_vector_type(op.results[0].typ)])]
+            elif kind == LaneKind.VECTOR:
+                operands=[self.get_vector(operand) for operand in op.operands]
+                new_ops=[op.__class__.build(operands=operands, result_types=[self.get_vector_type(op.results[0].typ)],
+                                            attributes=dict(op.attributes))]
+            else:
+                # Uniform and contiguous values are computed as before
+                new_ops=[self.clone_scalar(op)]
+            self.block.add_ops(new_ops)
+            for old_result, new_result in zip(op.results, new_ops[-1].results):
+                self.value_map[id(old_result)]=new_result
+        return updated
+
+def build_scalar_body(body: Block, block: Block, induction_vars: List[SSAValue]) -> List[SSAValue]:
+    """
+    Builds the scalar body of the epilogue into the block, in the same way as the vectorised
+    body but on scalars, with the reductions combined into the accumulators
+    """
+    value_map={id(old_arg): new_arg for old_arg, new_arg in zip(body.args, induction_vars)}
+    accumulators=list(block.args[1:])
+    updated=[]
+    for op in body.ops:
+        if isinstance(op, scf.Yield):
+            continue
+        if isinstance(op, scf.ReduceOp):
+            new_op=combine(op, accumulators[len(updated)], value_map.get(id(op.argument), op.argument))
+            updated.append(new_op.results[0])
+        else:
+            new_op=op.clone()
+            for idx, operand in enumerate(op.operands):
+                new_op.replace_operand(idx, value_map.get(id(operand), operand))
+        block.add_op(new_op)
+        for old_result, new_result in zip(op.results, new_op.results):
+            value_map[id(old_result)]=new_result
+    return updated
+
+def vectorise_loop(parallel_loop: scf.ParallelOp, analysis: LaneAnalysis, vector_width: int,
+                   vectors_per_iteration: int):
+    """
+    Strip-mines the innermost dimension of the loop into blocks of vectors_per_iteration
+    vectors, which become the iterations of the parallel loop. Each runs an scf.for over the
+    vectors of its block, with the reductions accumulated through this loop, and then an
+    scf.for over the remaining scalar iterations of the block (only the last block has any),
+    which continues the reductions from where the vectors left them. The result of each
+    reduction for the block is then passed to scf.reduce as before
+    """
+    dim=len(parallel_loop.lowerBound)-1
+    ub=parallel_loop.upperBound[dim]
+    body=parallel_loop.body.blocks[0]
+    reduce_ops=[op for op in body.ops if isinstance(op, scf.ReduceOp)]
+    builder=VectorBodyBuilder(analysis, vector_width)
+
+    width=arith.Constant.from_int_and_width(vector_width, IndexType())
+    block_size=arith.Constant.from_int_and_width(vector_width*vectors_per_iteration, IndexType())
+    one=arith.Constant.from_int_and_width(1, IndexType())
+    outside_ops=[width, block_size, one]
+    initial_accumulators=[]
+    for reduce_op, init_value in zip(reduce_ops, parallel_loop.initVals):
+        accumulator_ops, accumulator=build_accumulator(reduce_op, init_value, builder.get_accumulator_type(reduce_op))
+        outside_ops+=accumulator_ops
+        initial_accumulators.append(accumulator)
+
+    new_body=Block(arg_types=[arg.typ for arg in body.args])
+    block_start=new_body.args[dim]
+    # The last block stops at the upper bound, and its vectors at the last whole vector
+    full_block_end=arith.Addi.build(operands=[block_start, block_size], result_types=[IndexType()])
+    block_end=arith.MinSI.build(operands=[full_block_end, ub], result_types=[IndexType()])
+    block_range=arith.Subi.get(block_end, block_start)
+    vector_iterations=arith.DivSI.build(operands=[block_range, width], result_types=[IndexType()])
+    vector_range=arith.Muli.get(vector_iterations, width)
+    vector_end=arith.Addi.build(operands=[block_start, vector_range], result_types=[IndexType()])
+    new_body.add_ops([full_block_end, block_end, block_range, vector_iterations, vector_range, vector_end])
+
+    vector_block=Block(arg_types=[IndexType()]+[accumulator.typ for accumulator in initial_accumulators])
+    updated=builder.build(body, vector_block, list(new_body.args[:dim])+[vector_block.args[0]])
+    vector_block.add_op(scf.Yield.get(*updated))
+    vector_loop=scf.For.get(block_start, vector_end.results[0], width.results[0], initial_accumulators,
+                            Region([vector_block]))
+    new_body.add_op(vector_loop)
+
+    # The vector accumulators are reduced to scalars once, after the loop over the vectors
+    partial_results=[]
+    for reduce_op, result in zip(reduce_ops, vector_loop.results):
+        if isinstance(result.typ, VectorType):
+            reduced=ReductionOp.get(get_reduction_kind(reduce_op), result)
+            new_body.add_op(reduced)
+            result=reduced.results[0]
+        partial_results.append(result)
+
+    scalar_block=Block(arg_types=[IndexType()]+[result.typ for result in partial_results])
+    updated=build_scalar_body(body, scalar_block, list(new_body.args[:dim])+[scalar_block.args[0]])
+    scalar_block.add_op(scf.Yield.get(*updated))
+    epilogue=scf.For.get(vector_end.results[0], block_end.results[0], one.results[0], partial_results,
+                         Region([scalar_block]))
+    new_body.add_op(epilogue)
+
+    for reduce_op, result in zip(reduce_ops, epilogue.results):
+        new_reduce=reduce_op.clone()
+        new_reduce.replace_operand(0, result)
+        new_body.add_op(new_reduce)
+    new_body.add_op(scf.Yield.get())
+
+    blocked_loop=scf.ParallelOp.get(list(parallel_loop.lowerBound), list(parallel_loop.upperBound),
+                                    list(parallel_loop.step[:dim])+[block_size], [new_body], list(parallel_loop.initVals))
+    parent_block=parallel_loop.parent_block()
+    parent_block.insert_ops_before(outside_ops+[blocked_loop], parallel_loop)
+    for old_result, new_result in zip(parallel_loop.results, blocked_loop.results):
+        old_result.replace_by(new_result)
+    parent_block.erase_op(parallel_loop)
+
+def report_rejection(parallel_loop: scf.ParallelOp, loop_number: int, reason: str):
+    location=describe_loop_location(parallel_loop, loop_number)
+    print(f"remark: vectorise-parallel: parallel {location} not vectorised as {reason}", file=sys.stderr)
+
+@dataclass
+class VectoriseParallel(ModulePass):
+  """
+  This is the entry point for the transformation pass which will then apply the rewriter.
+  Each scf.parallel that does not contain another is vectorised in its innermost dimension,
+  vector_width is the number of iterations done at once and by default this is 8, which
+  fills a 256-bit AVX2 register with single precision values. vectors_per_iteration is the
+  number of vectors in each block, i.e. iteration of the parallel loop. As with
+  for-to-parallel, remarks report why a loop was not vectorised and can be turned off with
+  remarks=false
+  """
+  name = 'vectorise-parallel'
+
+  vector_width: int = 8
+  vectors_per_iteration: int = 16
+  remarks: bool = True
+
+  def apply(self, ctx: MLContext, input_module: ModuleOp):
+    if self.vector_width < 1:
+      raise Exception(f"The vector width must be at least one, but it is {self.vector_width}")
+    if self.vectors_per_iteration < 1:
+      raise Exception(f"There must be at least one vector per iteration, but there are {self.vectors_per_iteration}")
+    if self.vector_width == 1:
+      return
+
+    loops=[]
+    input_module.walk(lambda op: loops.append(op) if isinstance(op, scf.ParallelOp) else None)
+    for loop_number, parallel_loop in enumerate(loops):
+      inner_loops=[]
+      parallel_loop.body.walk(lambda op: inner_loops.append(op) if isinstance(op, scf.ParallelOp) else None)
+      if len(inner_loops) > 0:
+        # Only the innermost loop of a nest is vectorised
+        continue
+      dim=len(parallel_loop.lowerBound)-1
+      lb=get_constant_value(parallel_loop.lowerBound[dim])
+      ub=get_constant_value(parallel_loop.upperBound[dim])
+      if lb is not None and ub is not None and ub-lb < self.vector_width:
+        # Too few iterations to fill a vector
+        continue
+      if get_constant_value(parallel_loop.step[dim]) != 1:
+        reason="its innermost dimension does not have a step of one"
+      else:
+        analysis=analyse_lanes(parallel_loop)
+        reason=analysis.rejection
+      if reason:
+        if self.remarks:
+          report_rejection(parallel_loop, loop_number, reason)
+        continue
+      vectorise_loop(parallel_loop, analysis, self.vector_width, self.vectors_per_iteration)
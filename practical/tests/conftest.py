@@ -0,0 +1,61 @@
+import os
+import sys
+import pytest
+
+"""
+Shared set up for the tests, which are run from the practical directory with
+python -m pytest tests. The files in src have parts left for the exercises to complete,
+so the tests run against the sample solutions of those files instead, along with the rest
+of src, both in this process and in the tinypy-opt processes that some of the tests start.
+"""
+
+practical_dir=os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+src_dir=os.path.join(practical_dir, "src")
+test_path=[os.path.join(practical_dir, "two", "sample_solutions"),
+           os.path.join(practical_dir, "three", "sample_solutions"),
+           src_dir, os.path.join(src_dir, "dialects")]
+sys.path[:0]=test_path
+
+@pytest.fixture
+def tinypy_environment():
+    """
+    The environment for running our tools in another process, with the same PYTHONPATH
+    as the tests
+    """
+    environment=dict(os.environ)
+    environment["PYTHONPATH"]=os.pathsep.join(test_path + ([environment["PYTHONPATH"]] if "PYTHONPATH" in environment else []))
+    return environment
+
+@pytest.fixture
+def tinypy_opt():
+    return os.path.join(src_dir, "tools", "tinypy-opt")
+
+@pytest.fixture
+def kernel_file(tmp_path):
+    """
+    A file holding the tiny_py IR of a small kernel with a loop, for running tinypy-opt on
+    """
+    from python_compiler import generate_ir, print_ir
+    source="\n".join(["def kernel(a: Array[float], b: Array[float], n: int):",
+                      "    for i in range(0, n):",
+                      "        a[i]=a[i]*2.0+b[i]"])
+    path=tmp_path / "kernel.mlir"
+    path.write_text(print_ir(generate_ir(source)))
+    return str(path)
+
+@pytest.fixture
+def lower_kernel():
+    """
+    Generates the IR of a kernel's source and runs a pipeline of passes on it, returning the
+    module, e.g. lower_kernel(source, "tiny-py-to-standard,for-to-parallel")
+    """
+    from xdsl.ir import MLContext
+    from python_compiler import generate_ir, get_lowering_passes
+    from util.pass_options import parse_pipeline
+    def lower(source: str, pipeline: str = "tiny-py-to-standard"):
+        module=generate_ir(source)
+        for lowering_pass in parse_pipeline(pipeline, get_lowering_passes()):
+            lowering_pass.apply(MLContext(), module)
+        module.verify()
+        return module
+    return lower
@@ -0,0 +1,65 @@
+import os
+import tempfile
+from util.compile_cache import CompileCache
+
+def set_last_used(cache: CompileCache, key: str, suffix: str, time: int):
+    os.utime(cache.path_of(key, suffix), (time, time))
+
+def test_lookup_of_missing_entry(tmp_path):
+    cache=CompileCache(str(tmp_path), 1024)
+    assert cache.lookup("missing", ".mlir") is None
+    assert cache.read_text("missing", ".mlir") is None
+
+def test_insert_then_lookup(tmp_path):
+    cache=CompileCache(str(tmp_path), 1024)
+    path=cache.insert("key", ".mlir", "module")
+    assert path == cache.path_of("key", ".mlir")
+    assert cache.lookup("key", ".mlir") == path
+    assert cache.read_text("key", ".mlir") == "module"
+    # Entries of another kind for the same key are separate
+    assert cache.lookup("key", ".so") is None
+
+def test_oversize_entry_is_not_cached(tmp_path, monkeypatch):
+    scratch_dir=tmp_path / "scratch"
+    scratch_dir.mkdir()
+    monkeypatch.setattr(tempfile, "tempdir", str(scratch_dir))
+    cache=CompileCache(str(tmp_path / "cache"), 4)
+    assert cache.insert("key", ".so", b"too large") is None
+    assert cache.lookup("key", ".so") is None
+    assert list(scratch_dir.iterdir()) == []
+
+def test_evict_removes_least_recently_used(tmp_path):
+    cache=CompileCache(str(tmp_path), 10)
+    cache.insert("a", ".mlir", "aaaa")
+    cache.insert("b", ".mlir", "bbbb")
+    set_last_used(cache, "a", ".mlir", 1000)
+    set_last_used(cache, "b", ".mlir", 2000)
+    # Looking up an entry makes it the most recently used
+    cache.lookup("a", ".mlir")
+    cache.insert("c", ".mlir", "cccc")
+    assert cache.lookup("b", ".mlir") is None
+    assert cache.read_text("a", ".mlir") == "aaaa"
+    assert cache.read_text("c", ".mlir") == "cccc"
+
+def test_evict_keeps_entries_of_keep_key(tmp_path):
+    cache=CompileCache(str(tmp_path), 10)
+    cache.insert("a", ".so", "aaaa")
+    cache.insert("b", ".mlir", "bbbb")
+    set_last_used(cache, "a", ".so", 1000)
+    set_last_used(cache, "b", ".mlir", 2000)
+    # The shared object of a is older than b, but is kept as it is used with a's signature
+    cache.insert("a", ".json", "aaaa")
+    assert cache.lookup("a", ".so") is not None
+    assert cache.lookup("a", ".json") is not None
+    assert cache.lookup("b", ".mlir") is None
+
+def test_evict_without_keep_key(tmp_path):
+    cache=CompileCache(str(tmp_path), 12)
+    for key in ["a", "b", "c"]:
+        cache.insert(key, ".mlir", key*4)
+    set_last_used(cache, "a", ".mlir", 1000)
+    set_last_used(cache, "b", ".mlir", 2000)
+    set_last_used(cache, "c", ".mlir", 3000)
+    cache.max_size=4
+    cache.evict()
+    assert [cache.lookup(key, ".mlir") is not None for key in ["a", "b", "c"]] == [False, False, True]
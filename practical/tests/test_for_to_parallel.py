@@ -0,0 +1,41 @@
+from xdsl.dialects import scf
+
+"""
+Tests for how for-to-parallel uses its cost model, in particular when a loop is versioned
+with a runtime check of its trip count
+"""
+
+def count_ops(module, op_class) -> int:
+    found=[]
+    module.walk(lambda op: found.append(op) if isinstance(op, op_class) else None)
+    return len(found)
+
+def make_kernel(upper_bound: str) -> str:
+    return f"""def scale(a: Array[float], n: int):
+    for i in range(0, {upper_bound}):
+        a[i]=a[i]*2.0
+"""
+
+def test_runtime_trip_count_is_versioned(lower_kernel):
+    module=lower_kernel(make_kernel("n"), "tiny-py-to-standard,for-to-parallel")
+    assert count_ops(module, scf.If) == 1
+    assert count_ops(module, scf.ParallelOp) == 1
+    assert count_ops(module, scf.For) == 1
+
+def test_no_minimum_work_is_not_versioned(lower_kernel):
+    module=lower_kernel(make_kernel("n"), "tiny-py-to-standard,for-to-parallel{min-parallel-work=0}")
+    assert count_ops(module, scf.If) == 0
+    assert count_ops(module, scf.ParallelOp) == 1
+    assert count_ops(module, scf.For) == 0
+
+def test_constant_trip_count_above_threshold_is_not_versioned(lower_kernel):
+    module=lower_kernel(make_kernel("100000"), "tiny-py-to-standard,for-to-parallel")
+    assert count_ops(module, scf.If) == 0
+    assert count_ops(module, scf.ParallelOp) == 1
+    assert count_ops(module, scf.For) == 0
+
+def test_constant_trip_count_below_threshold_is_not_versioned(lower_kernel):
+    module=lower_kernel(make_kernel("10"), "tiny-py-to-standard,for-to-parallel")
+    assert count_ops(module, scf.If) == 0
+    assert count_ops(module, scf.ParallelOp) == 0
+    assert count_ops(module, scf.For) == 1
@@ -0,0 +1,87 @@
+from xdsl.dialects import scf
+
+"""
+Tests for which loops for-to-parallel parallelises, the cost model is disabled so that
+only the legality analysis decides this
+"""
+
+pipeline="tiny-py-to-standard,for-to-parallel{min-parallel-work=0}"
+
+def is_parallelised(lower_kernel, source: str) -> bool:
+    module=lower_kernel(source, pipeline)
+    found=[]
+    module.walk(lambda op: found.append(op) if isinstance(op, scf.ParallelOp) else None)
+    return len(found) > 0
+
+def test_same_type_reduction_is_parallelised(lower_kernel):
+    source="""def dot(a: Array[float], b: Array[float], n: int) -> float:
+    s=0.0
+    for i in range(0, n):
+        s=s+a[i]*b[i]
+    return s
+"""
+    assert is_parallelised(lower_kernel, source)
+
+def test_float_sum_narrowed_every_iteration_is_rejected(lower_kernel, capsys):
+    # The sum is computed in double precision then rounded to single precision in each
+    # iteration, summing the rounded values in another order gives a different result
+    source="""def total(a: Array[float64], n: int) -> float:
+    s=0.0
+    for i in range(0, n):
+        s=s+a[i]
+    return s
+"""
+    assert not is_parallelised(lower_kernel, source)
+    assert "rounded to a narrower type" in capsys.readouterr().err
+
+def test_integer_sum_narrowed_every_iteration_is_parallelised(lower_kernel):
+    # Integer sums wrap around to the same value whatever the order
+    source="""def total(a: Array[int64], n: int) -> int:
+    s=0
+    for i in range(0, n):
+        s=s+a[i]
+    return s
+"""
+    assert is_parallelised(lower_kernel, source)
+
+def test_loop_carried_array_dependence_is_rejected(lower_kernel, capsys):
+    source="""def shift(a: Array[float], n: int):
+    for i in range(1, n):
+        a[i]=a[i-1]
+"""
+    assert not is_parallelised(lower_kernel, source)
+    assert "accessed at different elements" in capsys.readouterr().err
+
+def test_injective_writes_are_parallelised(lower_kernel):
+    source="""def scale(a: Array[float], b: Array[float], n: int):
+    for i in range(0, n):
+        a[i]=a[i]*2.0
+        b[2*i]=b[2*i]+1.0
+"""
+    assert is_parallelised(lower_kernel, source)
+
+def test_write_to_the_same_element_is_rejected(lower_kernel, capsys):
+    source="""def fill(a: Array[float], n: int):
+    for i in range(0, n):
+        a[i*0]=1.0
+"""
+    assert not is_parallelised(lower_kernel, source)
+    assert "might write to the same element" in capsys.readouterr().err
+
+def test_non_injective_index_is_rejected(lower_kernel, capsys):
+    # Dividing integers in tiny_py is integer division, so i and i+1 can map to one element
+    source="""def halve(a: Array[float], n: int):
+    for i in range(0, n):
+        a[i/2]=1.0
+"""
+    assert not is_parallelised(lower_kernel, source)
+    assert "might write to the same element" in capsys.readouterr().err
+
+def test_loop_with_call_is_rejected(lower_kernel, capsys):
+    source="""def show(a: Array[float], n: int):
+    for i in range(0, n):
+        a[i]=1.0
+        print(i)
+"""
+    assert not is_parallelised(lower_kernel, source)
+    assert "which might have side effects" in capsys.readouterr().err
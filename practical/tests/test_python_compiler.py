@@ -0,0 +1,15 @@
+import os
+import python_compiler
+
+def test_lowering_version_covers_everything_lowering_uses(monkeypatch):
+    hashed=[]
+    def record_files(paths):
+        hashed.extend(os.path.basename(path) for path in paths)
+        return "hash"
+    monkeypatch.setattr(python_compiler, "hash_files", record_files)
+    monkeypatch.setattr(python_compiler, "_compiler_version", "compiler")
+    monkeypatch.setattr(python_compiler, "_lowering_version", None)
+    python_compiler.get_lowering_version()
+    for name in ["tiny_py_to_standard.py", "for_to_parallel.py", "parallel_legality.py", "toolchain.py",
+                 "native_kernel.py", "llvm_func.py", "vector_ext.py"]:
+        assert name in hashed
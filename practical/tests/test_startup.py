@@ -0,0 +1,93 @@
+import re
+import subprocess
+import sys
+import pytest
+from util.lazy_registry import LazyMLContext, register_tinypy_dialects
+
+"""
+Checks that tinypy-opt and python_compiler start up quickly, as the tool is run once per
+kernel in a build, and that passes and dialects are only imported once they are needed.
+Each case runs in a fresh interpreter with python -X importtime and the time spent
+importing modules must be within a budget. The budgets are several times what these take
+on a laptop, so that they only fail on a real regression such as importing every pass or
+dialect up front, and benchmarks/startup_benchmark.py gives the details of where the time
+goes.
+"""
+
+importtime_pattern=re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|( *)(\S+)\s*$")
+
+python_compiler_budget_ms=400
+tinypy_opt_budget_ms=2000
+
+def run_with_importtime(command, environment, repeats=3):
+    """
+    Runs the command with python -X importtime, returning the least time (in milliseconds)
+    spent importing over the runs and the modules that were imported
+    """
+    best_ms, modules=None, set()
+    for _ in range(repeats):
+        result=subprocess.run([sys.executable, "-X", "importtime"]+command, capture_output=True, text=True,
+                              env=environment)
+        assert result.returncode == 0, result.stderr
+        import_us=0
+        run_modules=set()
+        for line in result.stderr.splitlines():
+            match=importtime_pattern.match(line)
+            if match is None:
+                continue
+            run_modules.add(match.group(4))
+            # Only the modules imported at the top level, as the others are within their time
+            if len(match.group(3)) <= 1:
+                import_us+=int(match.group(2))
+        if best_ms is None or import_us/1000 < best_ms:
+            best_ms=import_us/1000
+        modules=run_modules
+    return best_ms, modules
+
+def test_python_compiler_import_time(tinypy_environment):
+    import_ms, modules=run_with_importtime(["-c", "import python_compiler"], tinypy_environment)
+    assert import_ms < python_compiler_budget_ms
+    # The passes and dialects are only needed once a kernel is compiled
+    assert "tiny_py_to_standard" not in modules
+    assert "xdsl.dialects.builtin" not in modules
+
+@pytest.mark.parametrize("passes", [[], ["-p", "tiny-py-to-standard"]])
+def test_tinypy_opt_import_time(tinypy_environment, tinypy_opt, kernel_file, passes):
+    import_ms, _=run_with_importtime([tinypy_opt, kernel_file]+passes, tinypy_environment)
+    assert import_ms < tinypy_opt_budget_ms
+
+def test_tinypy_opt_only_imports_requested_passes(tinypy_environment, tinypy_opt, kernel_file):
+    _, modules=run_with_importtime([tinypy_opt, kernel_file, "-p", ""], tinypy_environment, repeats=1)
+    assert "tiny_py_to_standard" not in modules
+    assert "for_to_parallel" not in modules
+    # The kernel is tiny_py IR, so only that dialect is needed to parse it
+    assert "tiny_py" in modules
+    assert "vector_ext" not in modules
+
+    _, modules=run_with_importtime([tinypy_opt, kernel_file, "-p", "tiny-py-to-standard"], tinypy_environment,
+                                   repeats=1)
+    assert "tiny_py_to_standard" in modules
+    assert "for_to_parallel" not in modules
+
+def test_lazy_context_loads_dialect_when_parsed(kernel_file):
+    from xdsl.parser import Parser
+    from xdsl.dialects.builtin import Builtin
+    ctx=LazyMLContext()
+    ctx.register_dialect(Builtin)
+    register_tinypy_dialects(ctx)
+    assert "tiny_py.module" not in ctx._registeredOps
+    assert "tiny_py" in ctx.lazy_dialects
+
+    with open(kernel_file) as f:
+        module=Parser(ctx, f.read()).parse_module()
+    assert "tiny_py.module" in ctx._registeredOps
+    # All the prefixes of a dialect are loaded together, and other dialects are still lazy
+    assert "tiny_py" not in ctx.lazy_dialects and "bool" not in ctx.lazy_dialects
+    assert "vector" in ctx.lazy_dialects
+    assert module.ops.first.name == "tiny_py.module"
+
+def test_lazy_context_unknown_op():
+    ctx=LazyMLContext()
+    register_tinypy_dialects(ctx)
+    assert ctx.get_optional_op("not_a_dialect.op") is None
+    assert "tiny_py" in ctx.lazy_dialects
@@ -0,0 +1,61 @@
+import pytest
+from xdsl.dialects import func
+from util.semantic_error import SemanticError
+
+def test_return_at_top_level(lower_kernel):
+    source="""def first(a: Array[float], n: int) -> float:
+    for i in range(0, n):
+        a[i]=1.0
+    return a[0]
+"""
+    module=lower_kernel(source)
+    returns=[]
+    module.walk(lambda op: returns.append(op) if isinstance(op, func.Return) else None)
+    assert len(returns) == 1
+
+@pytest.mark.parametrize("ssa_form", [False, True])
+def test_return_inside_loop_is_rejected(ssa_form):
+    from xdsl.ir import MLContext
+    from python_compiler import generate_ir
+    from tiny_py_to_standard import LowerTinyPyToStandard
+    source="""def find(a: Array[float], n: int) -> int:
+    for i in range(0, n):
+        return i
+    return n
+"""
+    module=generate_ir(source, ssa_form)
+    with pytest.raises(SemanticError, match="Return inside a loop of `find'"):
+        LowerTinyPyToStandard().apply(MLContext(), module)
+
+def test_lookup_translation_of_subclass_uses_nearest_base():
+    import tiny_py
+    from tiny_py_to_standard import lookup_translation, statement_translations
+    class CheckedAssign(tiny_py.Assign):
+        pass
+    class BoundsCheckedAssign(CheckedAssign):
+        pass
+    translations=dict(statement_translations)
+    assert lookup_translation(translations, BoundsCheckedAssign) is translations[tiny_py.Assign]
+    # The result is held against the class so the bases are only searched once
+    assert translations[BoundsCheckedAssign] is translations[tiny_py.Assign]
+
+    checked_translation=lambda ctx, op: []
+    translations=dict(statement_translations)
+    translations[CheckedAssign]=checked_translation
+    assert lookup_translation(translations, BoundsCheckedAssign) is checked_translation
+    assert lookup_translation(translations, tiny_py.Assign) is statement_translations[tiny_py.Assign]
+
+def test_op_without_translation_is_an_error():
+    from xdsl.dialects import arith
+    from xdsl.dialects.builtin import i32
+    from tiny_py_to_standard import (SSAValueCtx, LoweringState, lookup_translation, statement_translations,
+                                     translate_stmt, translate_expr)
+    constant=arith.Constant.from_int_and_width(1, i32)
+    translations=dict(statement_translations)
+    assert lookup_translation(translations, arith.Constant) is None
+    assert translations[arith.Constant] is None
+    ctx=SSAValueCtx(state=LoweringState())
+    with pytest.raises(Exception, match="Could not translate .* as a statement"):
+        translate_stmt(ctx, constant)
+    with pytest.raises(Exception, match="Could not translate .* as an expression"):
+        translate_expr(ctx, constant)
@@ -0,0 +1,26 @@
+import pytest
+from util import toolchain
+from util.pass_options import parse_pipeline
+
+def test_presets_run_the_exercise_pipelines():
+    assert toolchain.get_preset("sequential").tinypy_passes == ["tiny-py-to-standard"]
+    assert toolchain.get_preset("openmp").tinypy_passes == ["tiny-py-to-standard", "for-to-parallel"]
+    assert toolchain.get_preset("openmp-vector").tinypy_passes == ["tiny-py-to-standard", "for-to-parallel",
+                                                                   "vectorise-parallel"]
+
+def test_optimised_presets_add_optimisation_passes():
+    for name in ["sequential", "openmp", "openmp-vector"]:
+        preset=toolchain.get_preset(name)
+        optimised=toolchain.get_preset(name+"-optimised")
+        assert "fuse-loops" in optimised.tinypy_passes and "fuse-loops" not in preset.tinypy_passes
+        assert optimised.mlir_pipeline == preset.mlir_pipeline
+        assert optimised.clang_flags == preset.clang_flags
+
+def test_preset_passes_are_available():
+    from python_compiler import get_lowering_passes
+    for preset in toolchain.presets.values():
+        parse_pipeline(",".join(preset.tinypy_passes), get_lowering_passes())
+
+def test_unknown_preset():
+    with pytest.raises(toolchain.ToolchainError, match="Unknown preset"):
+        toolchain.get_preset("fast")
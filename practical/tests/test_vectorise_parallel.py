@@ -0,0 +1,54 @@
+from xdsl.dialects import scf, vector
+from xdsl.dialects.builtin import VectorType
+from vector_ext import ReductionOp
+
+pipeline="tiny-py-to-standard,for-to-parallel{min-parallel-work=0},vectorise-parallel"
+
+dot_source="""def dot(a: Array[float], b: Array[float], n: int) -> float:
+    s=0.0
+    for i in range(0, n):
+        s=s+a[i]*b[i]
+    return s
+"""
+
+def find_ops(module, op_class):
+    found=[]
+    module.walk(lambda op: found.append(op) if isinstance(op, op_class) else None)
+    return found
+
+def test_reduction_accumulated_in_vector(lower_kernel):
+    module=lower_kernel(dot_source, pipeline)
+    # Without a minimum amount of work the loop is not versioned, so is parallelised outright
+    parallel_loop=find_ops(module, scf.ParallelOp)[0]
+    body_loops=[op for op in parallel_loop.body.blocks[0].ops if isinstance(op, scf.For)]
+    assert len(body_loops) == 2
+    vector_loop, epilogue=body_loops
+    assert isinstance(vector_loop.results[0].typ, VectorType)
+    # The lanes are combined once, after the loop over the vectors rather than in it
+    assert len(find_ops(vector_loop, ReductionOp)) == 0
+    reductions=[op for op in parallel_loop.body.blocks[0].ops if isinstance(op, ReductionOp)]
+    assert len(reductions) == 1 and reductions[0].operands[0] is vector_loop.results[0]
+    # The epilogue is sequential and continues the reduction from the vectors
+    assert not isinstance(epilogue.results[0].typ, VectorType)
+    assert epilogue.iter_args[0] is reductions[0].results[0]
+
+def test_epilogue_is_not_another_parallel_loop(lower_kernel):
+    source="""def axpy(a: Array[float], b: Array[float], n: int):
+    for i in range(0, n):
+        a[i]=a[i]*2.0+b[i]
+"""
+    module=lower_kernel(source, pipeline)
+    assert len(find_ops(module, scf.ParallelOp)) == 1
+    assert len(find_ops(module, vector.Store)) == 1
+
+def test_converted_reduction_accumulates_in_converted_type(lower_kernel):
+    source="""def norm(a: Array[float], n: int, s: float64) -> float64:
+    for i in range(0, n):
+        s=s+a[i]*a[i]
+    return s
+"""
+    module=lower_kernel(source, pipeline)
+    parallel_loop=find_ops(module, scf.ParallelOp)[0]
+    vector_loop=[op for op in parallel_loop.body.blocks[0].ops if isinstance(op, scf.For)][0]
+    # The products are single precision, but are summed in double precision as before
+    assert str(vector_loop.results[0].typ) == "f64"
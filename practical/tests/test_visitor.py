@@ -0,0 +1,126 @@
+from types import SimpleNamespace
+from util.visitor import Visitor, camel_to_snake, get_method
+
+class Node:
+    """
+    Stands in for an operation, the visitor only needs the class and the regions of each
+    """
+    def __init__(self, *children):
+        self.regions=[SimpleNamespace(blocks=[SimpleNamespace(ops=list(children))])] if children else []
+
+class Loop(Node):
+    pass
+
+class InnerLoop(Loop):
+    pass
+
+class UnrolledLoop(Loop):
+    pass
+
+class Statement(Node):
+    pass
+
+class RecordingVisitor(Visitor):
+    def __init__(self):
+        self.visited=[]
+
+    def visit_loop(self, op):
+        self.visited.append(("loop", op))
+
+    def visit_inner_loop(self, op):
+        self.visited.append(("inner_loop", op))
+
+    def visit_statement(self, op):
+        self.visited.append(("statement", op))
+
+class StatementCountingVisitor(RecordingVisitor):
+    def visit_statement(self, op):
+        self.visited.append(("counted", op))
+
+def test_dispatch_on_subclasses_uses_the_class_of_the_op():
+    inner_statement=Statement()
+    inner=InnerLoop(inner_statement)
+    unrolled=UnrolledLoop()
+    outer=Loop(inner, unrolled)
+    visitor=RecordingVisitor()
+    visitor.traverse(outer)
+    # Each op is dispatched on the name of its own class, even once its base class is in the
+    # dispatch table, so the unrolled loop (with no visit_unrolled_loop) is not visited
+    assert visitor.visited == [("statement", inner_statement), ("inner_loop", inner), ("loop", outer)]
+
+def test_visitor_subclasses_have_their_own_dispatch():
+    statement=Statement()
+    RecordingVisitor().traverse(Loop(statement))
+    visitor=StatementCountingVisitor()
+    visitor.traverse(Loop(statement))
+    assert visitor.visited[0] == ("counted", statement)
+    base_visitor=RecordingVisitor()
+    base_visitor.traverse(statement)
+    assert base_visitor.visited == [("statement", statement)]
+
+def test_traverse_method_takes_over_the_children():
+    class SkipLoops(RecordingVisitor):
+        def traverse_loop(self, op):
+            self.visited.append(("traverse", op))
+
+    statement=Statement()
+    outer=Statement(Loop(Statement()), statement)
+    visitor=SkipLoops()
+    visitor.traverse(outer)
+    assert [kind for kind, _ in visitor.visited] == ["traverse", "loop", "statement", "statement"]
+
+class RecursiveVisitor:
+    """
+    The recursive walk that the visitor replaced, which gives the order that it must keep
+    """
+    def traverse(self, operation):
+        class_name=camel_to_snake(type(operation).__name__)
+        traverse=get_method(self, f"traverse_{class_name}")
+        if traverse:
+            traverse(operation)
+        else:
+            for r in operation.regions:
+                for b in r.blocks:
+                    for op in b.ops:
+                        self.traverse(op)
+        visit=get_method(self, f"visit_{class_name}")
+        if visit:
+            visit(operation)
+
+def make_order_recorder(base: type) -> type:
+    """
+    A visitor that records the order it reaches the ops of a tiny_py module in, it traverses
+    the expressions of assignments itself to check traverse methods keep their place too
+    """
+    def record(name):
+        return lambda self, op: self.order.append((name, id(op)))
+    methods={"__init__": lambda self: setattr(self, "order", [])}
+    for name in ["module", "function", "loop", "assign", "array_assign", "array_access", "binary_operation",
+                 "var", "constant", "return"]:
+        methods["visit_"+name]=record(name)
+    def traverse_assign(self, op):
+        self.order.append(("traverse_assign", id(op)))
+        for expr_op in op.value.blocks[0].ops:
+            self.traverse(expr_op)
+    methods["traverse_assign"]=traverse_assign
+    return type("OrderRecorder", (base,), methods)
+
+def test_walk_order_matches_recursive_walk():
+    from python_compiler import generate_ir
+    source="""def nested(a: Array[float], b: Array[float], n: int) -> float:
+    s=0.0
+    for i in range(0, n):
+        for j in range(0, n):
+            a[i*n+j]=a[i*n+j]+b[j]*2.0
+            s=s+a[i*n+j]
+        b[i]=s
+    return s
+"""
+    module=generate_ir(source)
+    expected=make_order_recorder(RecursiveVisitor)()
+    expected.traverse(module)
+    visitor=make_order_recorder(Visitor)()
+    visitor.traverse(module)
+    assert len(expected.order) > 20
+    assert [name for name, _ in expected.order].count("loop") == 2
+    assert visitor.order == expected.order